@@ -0,0 +1,4 @@
+# Benchmarks for the image preparation scripts.
+#
+# Run them from the repository root as modules, e.g.
+#   python -m benchmarks.bench_box_array
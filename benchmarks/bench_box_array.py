@@ -0,0 +1,124 @@
+import argparse, copy, time
+import numpy as np
+from ml_utils import BoundingBoxAnnotation
+from box_array import BoxArray
+
+
+
+# Compares the per-box BoundingBoxAnnotation objects with the vectorized
+# BoxArray on the bounding box work done by smart_resize for an image with
+# several objects: scale all boxes to the target size, crop them around the
+# combined box, clamp and filter them, and then build one zoomed variant per
+# box (copy all boxes, crop, rescale to the box center, clamp and filter).
+# Only the box math is measured, no pixels are touched.
+
+
+
+def randomBoxes(numBoxes, imgW, imgH, rng):
+    w = rng.uniform(20, imgW / 8, numBoxes)
+    h = rng.uniform(20, imgH / 8, numBoxes)
+    x = rng.uniform(0, imgW - w)
+    y = rng.uniform(0, imgH - h)
+    return np.stack((x, y, x + w, y + h), axis=1)
+
+
+def legacyWorkload(boxes, imgW, imgH, targetW, targetH):
+    bboxAnnotations = [BoundingBoxAnnotation(None, 'object', *box) for box in boxes]
+    scale = max(targetW / imgW, targetH / imgH)
+
+    bboxAnnotationsCopy = [copy.deepcopy(bbox) for bbox in bboxAnnotations]
+    for bbox in bboxAnnotationsCopy:
+        bbox.scale(scale, scale)
+    centerX = (min(bbox.xmin for bbox in bboxAnnotationsCopy) + max(bbox.xmax for bbox in bboxAnnotationsCopy)) / 2.0
+    centerY = (min(bbox.ymin for bbox in bboxAnnotationsCopy) + max(bbox.ymax for bbox in bboxAnnotationsCopy)) / 2.0
+    for bbox in bboxAnnotationsCopy:
+        bbox.crop(centerX - targetW / 2, centerY - targetH / 2, targetW, targetH)
+        bbox.clamp(targetW, targetH)
+    kept = [bbox for bbox in bboxAnnotationsCopy if not bbox.isEmpty()]
+
+    for index in range(len(bboxAnnotations)):
+        bboxAnnotationsCopy = [copy.deepcopy(bbox) for bbox in bboxAnnotations]
+        bboxCopy = bboxAnnotationsCopy[index]
+        percentMin = max(bboxCopy.percentW(targetW), bboxCopy.percentH(targetH))
+        if (percentMin < 0.5 and not bboxCopy.isTouchingBorder(imgW, imgH)):
+            (x, y) = (int(bboxCopy.centerX() - targetW / 2), int(bboxCopy.centerY() - targetH / 2))
+            for bbox in bboxAnnotationsCopy:
+                bbox.crop(x, y, targetW, targetH)
+            percentMin = max(bboxCopy.percentW(targetW, 20.0), bboxCopy.percentH(targetH, 20.0))
+            rescale = min(1.0 / percentMin, 4.0 * scale)
+            (centerX, centerY) = (bboxCopy.centerX(), bboxCopy.centerY())
+            for bbox in bboxAnnotationsCopy:
+                bbox.scaleToCenter(rescale, rescale, centerX, centerY)
+                bbox.clamp(targetW, targetH)
+            kept = [bbox for bbox in bboxAnnotationsCopy if not bbox.isEmpty()]
+    return kept
+
+
+def boxArrayWorkload(boxes, imgW, imgH, targetW, targetH):
+    bboxAnnotations = BoxArray(boxes, None, ('object',))
+    scale = max(targetW / imgW, targetH / imgH)
+
+    bboxAnnotationsCopy = bboxAnnotations.copy()
+    bboxAnnotationsCopy.scale(scale, scale)
+    combined = bboxAnnotationsCopy.combined()
+    bboxAnnotationsCopy.crop(combined.centerX()[0] - targetW / 2, combined.centerY()[0] - targetH / 2)
+    bboxAnnotationsCopy.clamp(targetW, targetH)
+    kept = bboxAnnotationsCopy.select(~bboxAnnotationsCopy.isEmpty())
+
+    percentMin = np.maximum(bboxAnnotations.percentW(targetW), bboxAnnotations.percentH(targetH))
+    candidates = (percentMin < 0.5) & ~bboxAnnotations.isTouchingBorder(imgW, imgH)
+    for index in np.flatnonzero(candidates):
+        bboxAnnotationsCopy = bboxAnnotations.copy()
+        bboxCopy = bboxAnnotationsCopy[index]
+        (x, y) = (int(bboxCopy.centerX()[0] - targetW / 2), int(bboxCopy.centerY()[0] - targetH / 2))
+        bboxAnnotationsCopy.crop(x, y)
+        bboxCopy = bboxAnnotationsCopy[index]
+        percentMin = max(bboxCopy.percentW(targetW, 20.0)[0], bboxCopy.percentH(targetH, 20.0)[0])
+        rescale = min(1.0 / percentMin, 4.0 * scale)
+        bboxAnnotationsCopy.scaleToCenter(rescale, rescale, bboxCopy.centerX()[0], bboxCopy.centerY()[0])
+        bboxAnnotationsCopy.clamp(targetW, targetH)
+        kept = bboxAnnotationsCopy.select(~bboxAnnotationsCopy.isEmpty())
+    return kept
+
+
+def timeit(func, args, minTime):
+    # Repeats func until minTime seconds have passed and returns the seconds per call
+    runs = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < minTime or runs == 0:
+        func(*args)
+        runs += 1
+        elapsed = time.perf_counter() - start
+    return elapsed / runs
+
+
+def run(boxCounts, imgW, imgH, targetW, targetH, minTime, seed):
+    rng = np.random.default_rng(seed)
+    results = []
+    print(f"{'boxes':>6} {'legacy ms':>12} {'BoxArray ms':>12} {'speedup':>8}")
+    for numBoxes in boxCounts:
+        boxes = randomBoxes(numBoxes, imgW, imgH, rng)
+        args = (boxes, imgW, imgH, targetW, targetH)
+        legacy = timeit(legacyWorkload, args, minTime)
+        vectorized = timeit(boxArrayWorkload, args, minTime)
+        results.append((numBoxes, legacy, vectorized))
+        print(f"{numBoxes:>6} {legacy * 1000.0:>12.3f} {vectorized * 1000.0:>12.3f} {legacy / vectorized:>7.1f}x")
+    return results
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark BoundingBoxAnnotation lists against BoxArray')
+    parser.add_argument('-b', '--boxes', dest='boxes', help='Comma separated list of box counts per image', default='1,10,100,1000')
+    parser.add_argument('--width', dest='width', help='Source image width', type=int, default=4000)
+    parser.add_argument('--height', dest='height', help='Source image height', type=int, default=3000)
+    parser.add_argument('-x', '--new_x', dest='x', help='Target image width', type=int, default=320)
+    parser.add_argument('-y', '--new_y', dest='y', help='Target image height', type=int, default=320)
+    parser.add_argument('-t', '--min_time', dest='min_time', help='Minimum seconds per measurement', type=float, default=0.5)
+    parser.add_argument('--seed', dest='seed', help='Random seed for the generated boxes', type=int, default=0)
+    args = parser.parse_args()
+
+    boxCounts = [int(count) for count in args.boxes.split(',')]
+    run(boxCounts, args.width, args.height, args.x, args.y, args.min_time, args.seed)
@@ -0,0 +1,70 @@
+import argparse
+import numpy as np
+from box_array import BoxArray
+from voc_merge import merge_boxes, MERGE_IOU
+from benchmarks.bench_box_array import randomBoxes, timeit
+
+
+
+# Benchmark of merging the boxes of two annotations of the same image (see
+# voc_merge): the vectorized merge with the IoU matrix of BoxArray against a
+# loop over all pairs of boxes in Python. The second annotation has the boxes
+# of the first one slightly shifted and as many new boxes, so half of its
+# boxes are merged.
+#
+# Example:
+#   python -m benchmarks.bench_box_merge -b 10,100,1000,5000
+
+
+
+def pairIou(a, b):
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    return intersection / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection)
+
+
+def loopMerge(boxes, names, otherBoxes, otherNames, threshold):
+    merged = list(zip(names, boxes))
+    for (otherName, otherBox) in zip(otherNames, otherBoxes):
+        if not any(name == otherName and pairIou(box, otherBox) >= threshold for (name, box) in zip(names, boxes)):
+            merged.append((otherName, otherBox))
+    return merged
+
+
+def run(boxCounts, imgW, imgH, threshold, minTime, seed):
+    rng = np.random.default_rng(seed)
+    print(f"{'boxes':>6} {'loop ms':>12} {'vectorized ms':>14} {'speedup':>8} {'merged':>7}")
+    for numBoxes in boxCounts:
+        boxes = randomBoxes(numBoxes, imgW, imgH, rng)
+        labels = rng.integers(0, 3, numBoxes)
+        otherBoxes = np.concatenate((boxes + rng.uniform(-2, 2, boxes.shape), randomBoxes(numBoxes, imgW, imgH, rng)))
+        otherLabels = np.concatenate((labels, rng.integers(0, 3, numBoxes)))
+        names = ('cat', 'dog', 'bird')
+        first = BoxArray(boxes, labels, names)
+        second = BoxArray(otherBoxes, otherLabels, names)
+        vectorized = timeit(merge_boxes, (first, second, threshold), minTime)
+        merged = len(merge_boxes(first, second, threshold)) - numBoxes
+        if numBoxes <= 2000:
+            loop = timeit(loopMerge, (boxes.tolist(), labels.tolist(), otherBoxes.tolist(), otherLabels.tolist(), threshold), minTime)
+            print(f"{numBoxes:>6} {loop * 1000.0:>12.3f} {vectorized * 1000.0:>14.3f} {loop / vectorized:>7.1f}x {merged:>7}")
+        else:
+            # The loop takes minutes
+            print(f"{numBoxes:>6} {'-':>12} {vectorized * 1000.0:>14.3f} {'-':>8} {merged:>7}")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the vectorized merge of duplicate annotations against a loop over all box pairs')
+    parser.add_argument('-b', '--boxes', dest='boxes', help='Comma separated list of box counts per image', default='10,100,1000,5000')
+    parser.add_argument('--width', dest='width', help='Image width', type=int, default=4000)
+    parser.add_argument('--height', dest='height', help='Image height', type=int, default=3000)
+    parser.add_argument('-i', '--iou', dest='iou', help='IoU threshold', type=float, default=MERGE_IOU)
+    parser.add_argument('-t', '--min_time', dest='min_time', help='Minimum seconds per measurement', type=float, default=0.5)
+    parser.add_argument('--seed', dest='seed', help='Random seed for the generated boxes', type=int, default=0)
+    args = parser.parse_args()
+
+    run([int(count) for count in args.boxes.split(',')], args.width, args.height, args.iou, args.min_time, args.seed)
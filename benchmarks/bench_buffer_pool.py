@@ -0,0 +1,90 @@
+import argparse, multiprocessing, resource, tempfile
+from concurrent.futures import ProcessPoolExecutor
+from parallel_utils import run_jobs, run_pipeline
+from output_writer import configure_writer
+from buffer_pool import DEFAULT_MAX_BYTES
+from benchmarks.bench_resize import collectJobs, MODES
+from benchmarks.synthetic_dataset import generateDataset, DEFAULT_CONFIG
+
+
+
+# Benchmark of the image buffer pool (see buffer_pool) against allocating a
+# new array for every resize and warp, like the scripts did before.
+#
+# Every mode resizes the synthetic dataset once with the pool disabled
+# (maxBytes = 0) and once per pool size. Each run happens in a fresh process,
+# so its peak resident memory (ru_maxrss) isn't inflated by earlier runs.
+# Reported are the time per image, the hit rate of the pool, the bytes
+# allocated for image buffers (without the pool: every requested byte), the
+# peak memory held by the pool and the peak RSS of the process.
+#
+# Example:
+#   python -m benchmarks.bench_buffer_pool -m size,crop,smart -n 200 -x 640 -y 640
+
+
+
+def runConfig(mode, inPath, x, y, threads, writerThreads, poolBytes):
+    # Runs in its own process, see above
+    with tempfile.TemporaryDirectory() as outPath:
+        (func, jobs, prefetch) = collectJobs(mode, inPath, outPath, x, y, True)
+        initargs = (writerThreads, None, None, poolBytes)
+        if threads > 0:
+            summary = run_pipeline(func, jobs, threads, prefetch, desc=mode, initializer=configure_writer, initargs=initargs)
+        else:
+            summary = run_jobs(func, jobs, 1, desc=mode, initializer=configure_writer, initargs=initargs)
+    pool = summary.bufferPool
+    return {
+        'ms_per_image': 1000.0 * summary.elapsed / max(summary.jobs, 1),
+        'buffers': pool.acquires,
+        'hit_rate': pool.hitRate(),
+        'requested_mb': pool.requestedBytes / 2**20,
+        'allocated_mb': pool.allocatedBytes / 2**20,
+        'pool_peak_mb': pool.peakBytes() / 2**20,
+        # Kilobytes on Linux
+        'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+
+def runIsolated(mode, inPath, x, y, threads, writerThreads, poolBytes):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(runConfig, mode, inPath, x, y, threads, writerThreads, poolBytes).result()
+
+
+def run(inPath, modes, x, y, threads, writerThreads, poolSizes, repeat):
+    print(f"{'mode':<8} {'pool MB':>8} {'ms/image':>9} {'buffers':>8} {'hits':>7} {'alloc MB':>9} {'pool peak':>10} {'max RSS':>8}")
+    for mode in modes:
+        for poolMB in [0] + poolSizes:
+            results = [runIsolated(mode, inPath, x, y, threads, writerThreads, poolMB * 2**20) for _ in range(repeat)]
+            best = min(results, key=lambda result: result['ms_per_image'])
+            # The memory numbers don't depend on the timing, the lowest peak RSS is the least noisy
+            maxRss = min(result['max_rss_mb'] for result in results)
+            print(f"{mode:<8} {poolMB if poolMB > 0 else 'off':>8} {best['ms_per_image']:>9.2f} {best['buffers']:>8} {100.0 * best['hit_rate']:>6.1f}% "
+                  f"{best['allocated_mb']:>9.1f} {best['pool_peak_mb']:>10.1f} {maxRss:>8.1f}")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the image buffer pool of the resize scripts')
+    parser.add_argument('-d', '--dataset', dest='dataset', help='Directory of the synthetic dataset (reused if its config matches, default: temporary directory)', default=None)
+    parser.add_argument('-n', '--images', dest='images', help='Number of images', type=int, default=DEFAULT_CONFIG['images'])
+    parser.add_argument('-m', '--modes', dest='modes', help='Comma separated list of modes', default='size,crop,smart')
+    parser.add_argument('-x', '--new_x', dest='x', help='Target image width', type=int, default=320)
+    parser.add_argument('-y', '--new_y', dest='y', help='Target image height', type=int, default=320)
+    parser.add_argument('-p', '--pool_sizes', dest='pool_sizes', help='Comma separated list of pool sizes in MB, compared with the pool disabled',
+                        default=str(DEFAULT_MAX_BYTES // 2**20))
+    parser.add_argument('--threads', dest='threads', help='Decode/transform threads of the streaming pipeline (0 = no pipeline)', type=int, default=0)
+    parser.add_argument('--writer_threads', dest='writer_threads', help='Number of writer threads', type=int, default=2)
+    parser.add_argument('-r', '--repeat', dest='repeat', help='Runs per configuration, the fastest one is kept', type=int, default=2)
+    args = parser.parse_args()
+
+    modes = args.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"Invalid mode: {mode}")
+    poolSizes = [int(value) for value in args.pool_sizes.split(',') if int(value) > 0]
+
+    with tempfile.TemporaryDirectory() as tempPath:
+        inPath = args.dataset or tempPath
+        generateDataset(inPath, dict(DEFAULT_CONFIG, images=args.images))
+        run(inPath, modes, args.x, args.y, args.threads, args.writer_threads, poolSizes, args.repeat)
@@ -0,0 +1,106 @@
+import argparse, tempfile
+from concurrency import available_cpus, configure_threads
+from parallel_utils import run_jobs, run_pipeline
+from output_writer import configure_writer
+from benchmarks.bench_resize import collectJobs, MODES
+from benchmarks.synthetic_dataset import generateDataset, DEFAULT_CONFIG
+
+
+
+# Finds the best split of the CPUs between worker processes (or pipeline
+# threads) and the internal threads of OpenCV for the resize scripts.
+#
+# Every combination of worker processes (run_jobs) or pipeline threads
+# (run_pipeline with one process) and OpenCV threads per worker, up to twice
+# the available CPUs in total, resizes the synthetic dataset. The best of
+# several runs is reported per combination in images per second, together
+# with the combination the scripts choose automatically (see concurrency).
+#
+# Example:
+#   python -m benchmarks.bench_concurrency -m size,smart -n 200
+
+
+
+def powersOfTwo(limit):
+    values = []
+    value = 1
+    while value < limit:
+        values.append(value)
+        value *= 2
+    return values + [limit]
+
+
+def configureBenchWorker(cvThreads, writerThreads):
+    # Overrides the automatic thread limits of parallel_utils
+    configure_threads(cvThreads)
+    configure_writer(writerThreads)
+
+
+def candidates(cpus):
+    # (kind, workers or pipeline threads, OpenCV threads per worker)
+    result = []
+    for kind in ('pool', 'pipeline'):
+        for parallel in powersOfTwo(cpus):
+            for cvThreads in powersOfTwo(cpus):
+                if parallel * cvThreads <= 2 * cpus:
+                    result.append((kind, parallel, cvThreads))
+    return result
+
+
+def runCandidate(mode, inPath, x, y, kind, parallel, cvThreads, writerThreads, repeat):
+    best = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as outPath:
+            (func, jobs, prefetch) = collectJobs(mode, inPath, outPath, x, y, True)
+            initargs = (cvThreads, writerThreads)
+            if kind == 'pipeline':
+                summary = run_pipeline(func, jobs, parallel, prefetch, desc=mode, initializer=configureBenchWorker, initargs=initargs)
+            else:
+                summary = run_jobs(func, jobs, parallel, desc=mode, initializer=configureBenchWorker, initargs=initargs)
+            configure_writer(writerThreads)
+        if best is None or summary.elapsed < best.elapsed:
+            best = summary
+    return best.imagesPerSecond()
+
+
+def run(inPath, modes, x, y, cpus, writerThreads, repeat):
+    print(f"{cpus} available CPUs")
+    for mode in modes:
+        results = []
+        for (kind, parallel, cvThreads) in candidates(cpus):
+            results.append((kind, parallel, cvThreads, runCandidate(mode, inPath, x, y, kind, parallel, cvThreads, writerThreads, repeat)))
+        best = max(results, key=lambda result: result[3])
+        print(f"{'mode':<10} {'kind':<9} {'parallel':>8} {'cv2':>4} {'img/s':>8}")
+        for (kind, parallel, cvThreads, imagesPerSecond) in results:
+            # Same split as concurrency.threads_per_worker, for the given number of CPUs
+            automatic = cvThreads == max(1, cpus // parallel)
+            flags = ('  best' if (kind, parallel, cvThreads) == best[:3] else '') + ('  auto' if automatic else '')
+            print(f"{mode:<10} {kind:<9} {parallel:>8} {cvThreads:>4} {imagesPerSecond:>8.1f}{flags}")
+        option = f"-w {best[1]} -t 0" if best[0] == 'pool' else f"-w 1 -t {best[1]}"
+        # The scripts keep an OpenCV thread count set in the environment
+        print(f"Best for {mode}: OPENCV_FOR_THREADS_NUM={best[2]} with {option} ({best[3]:.1f} images/s)")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark worker processes x OpenCV threads for the resize scripts')
+    parser.add_argument('-d', '--dataset', dest='dataset', help='Directory of the synthetic dataset (reused if its config matches, default: temporary directory)', default=None)
+    parser.add_argument('-n', '--images', dest='images', help='Number of images', type=int, default=DEFAULT_CONFIG['images'])
+    parser.add_argument('-m', '--modes', dest='modes', help='Comma separated list of modes', default='size,smart')
+    parser.add_argument('-x', '--new_x', dest='x', help='Target image width', type=int, default=320)
+    parser.add_argument('-y', '--new_y', dest='y', help='Target image height', type=int, default=320)
+    parser.add_argument('-c', '--cpus', dest='cpus', help='Number of CPUs to plan for (default: available CPUs)', type=int, default=None)
+    parser.add_argument('--writer_threads', dest='writer_threads', help='Number of writer threads per process', type=int, default=2)
+    parser.add_argument('-r', '--repeat', dest='repeat', help='Runs per combination, the fastest one is kept', type=int, default=2)
+    args = parser.parse_args()
+
+    modes = args.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"Invalid mode: {mode}")
+
+    with tempfile.TemporaryDirectory() as tempPath:
+        inPath = args.dataset or tempPath
+        generateDataset(inPath, dict(DEFAULT_CONFIG, images=args.images))
+        run(inPath, modes, args.x, args.y, args.cpus or available_cpus(), args.writer_threads, args.repeat)
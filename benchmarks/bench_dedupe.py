@@ -0,0 +1,90 @@
+import argparse, os, random, tempfile, time
+import cv2
+import imagehash
+import numpy as np
+from PIL import Image
+from remove_identical_images import find_duplicates, collect_images
+
+
+
+# Benchmark of the duplicate detection of remove_identical_images.
+#
+# For every file count, a folder of small random images is generated, a
+# fraction of them duplicates (byte copies and re-encoded copies) of other
+# images. The hashing pass (every image hashed once, grouped by hash) is
+# timed on all files, together with the number of decodes the byte-level
+# prefilter saved (byte copies aren't decoded). The old pairwise comparison
+# (both images of every pair decoded and hashed again) is timed on a few pairs
+# and extrapolated to the n * (n - 1) pairs of the folder, it can't run on
+# more than a few hundred images.
+#
+# Example:
+#   python -m benchmarks.bench_dedupe -n 1000,10000,100000
+
+
+
+def generateImages(outPath, count, duplicateFraction, seed, width = 64, height = 48):
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    originals = []
+    for index in range(count):
+        path = os.path.join(outPath, f"img{index}.jpg")
+        if len(originals) > 0 and random.random() < duplicateFraction:
+            source = random.choice(originals)
+            if random.random() < 0.5:
+                with open(source, 'rb') as fsrc, open(path, 'wb') as fdst:
+                    fdst.write(fsrc.read())
+            else:
+                cv2.imwrite(path, cv2.imread(source), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        else:
+            # Blocks of random colors, so the perceptual hashes of the originals differ
+            blocks = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+            cv2.imwrite(path, cv2.resize(blocks, (width, height), interpolation=cv2.INTER_NEAREST))
+            originals.append(path)
+
+
+def oldImageHash(path):
+    # The hash of the old remove_identical_images: the file opened with Pillow, hashed as stored
+    with Image.open(path) as img:
+        return imagehash.phash(img)
+
+
+def oldCompare(path1, path2):
+    return (oldImageHash(path1) - oldImageHash(path2)) == 0
+
+
+def timePairwise(images, pairs, seed):
+    sample = random.Random(seed).sample(images, min(len(images), 2 * pairs))
+    start = time.perf_counter()
+    for index in range(0, len(sample) - 1, 2):
+        oldCompare(sample[index], sample[index + 1])
+    return (time.perf_counter() - start) / max(1, len(sample) // 2)
+
+
+def run(counts, duplicateFraction, pairs, seed):
+    print(f"{'files':>8} {'hash+group s':>13} {'images/s':>9} {'groups':>7} {'duplicates':>11} {'decodes saved':>14} {'pairwise s (est.)':>18} {'speedup':>9}")
+    for count in counts:
+        with tempfile.TemporaryDirectory() as tempPath:
+            generateImages(tempPath, count, duplicateFraction, seed)
+            images = collect_images(tempPath)
+            start = time.perf_counter()
+            hashCounts = {}
+            (groups, _) = find_duplicates(images, progress=False, counts=hashCounts)
+            elapsed = time.perf_counter() - start
+            perPair = timePairwise(images, pairs, seed)
+        pairwise = perPair * count * (count - 1)
+        duplicates = sum(len(group) - 1 for group in groups)
+        print(f"{count:>8} {elapsed:>13.2f} {count / elapsed:>9.0f} {len(groups):>7} {duplicates:>11} {hashCounts['copies']:>14} {pairwise:>18.0f} {pairwise / elapsed:>8.0f}x")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the duplicate detection of remove_identical_images')
+    parser.add_argument('-n', '--counts', dest='counts', help='Comma separated list of file counts', default='1000,10000,100000')
+    parser.add_argument('-f', '--duplicates', dest='duplicates', help='Fraction of the files that are duplicates', type=float, default=0.1)
+    parser.add_argument('-p', '--pairs', dest='pairs', help='Number of pairs the pairwise comparison is timed on', type=int, default=200)
+    parser.add_argument('--seed', dest='seed', help='Random seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run([int(value) for value in args.counts.split(',')], args.duplicates, args.pairs, args.seed)
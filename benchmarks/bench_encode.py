@@ -0,0 +1,119 @@
+import argparse, os, random, tempfile, time
+from io import BytesIO
+import cv2
+from PIL import Image
+from encoder_options import EncoderOptions
+from image_io import read_image
+from benchmarks.synthetic_dataset import generateDataset, DEFAULT_CONFIG
+
+
+
+# Benchmark of the output encoder settings (see encoder_options).
+#
+# A sample of images (of a dataset directory or a synthetic dataset) is
+# decoded and scaled to the target size like the resize scripts do, then
+# every setting encodes all sample images. Reported are the encode time per
+# image (best of several runs) and the mean file size per image. OpenCV is
+# the encoder of the resize scripts, Pillow the one of convert_images_to_jpg.
+#
+# Example:
+#   python -m benchmarks.bench_encode -d /data/images -n 200 -x 640 -y 640
+
+
+
+# name -> (library, file extension, EncoderOptions)
+SETTINGS = {
+    'jpeg':               ('cv2', '.jpg', EncoderOptions()),
+    'jpeg_q75':           ('cv2', '.jpg', EncoderOptions(jpegQuality=75)),
+    'jpeg_q85':           ('cv2', '.jpg', EncoderOptions(jpegQuality=85)),
+    'jpeg_q95':           ('cv2', '.jpg', EncoderOptions(jpegQuality=95)),
+    'jpeg_q95_444':       ('cv2', '.jpg', EncoderOptions(jpegQuality=95, jpegSubsampling='444')),
+    'jpeg_q95_optimize':  ('cv2', '.jpg', EncoderOptions(jpegQuality=95, jpegOptimize=True)),
+    'jpeg_q95_prog':      ('cv2', '.jpg', EncoderOptions(jpegQuality=95, jpegProgressive=True)),
+    'pil_jpeg':           ('pil', '.jpg', EncoderOptions()),
+    'pil_jpeg_q95':       ('pil', '.jpg', EncoderOptions(jpegQuality=95)),
+    'pil_jpeg_q95_opt':   ('pil', '.jpg', EncoderOptions(jpegQuality=95, jpegOptimize=True)),
+    'png_1':              ('cv2', '.png', EncoderOptions(pngLevel=1)),
+    'png':                ('cv2', '.png', EncoderOptions()),
+    'png_9':              ('cv2', '.png', EncoderOptions(pngLevel=9)),
+    'webp_q80':           ('cv2', '.webp', EncoderOptions(webpQuality=80)),
+    'webp_q80_m0':        ('cv2', '.webp', EncoderOptions(webpQuality=80, webpMethod=0)),
+    'webp_q80_m6':        ('cv2', '.webp', EncoderOptions(webpQuality=80, webpMethod=6)),
+}
+
+IMAGE_FORMATS = ('.jpg', '.jpeg', '.png', '.webp')
+
+
+def loadSample(inPath, count, x, y, seed):
+    imageFiles = sorted(os.path.join(root, file) for root, _, files in os.walk(inPath)
+                        for file in files if file.lower().endswith(IMAGE_FORMATS))
+    random.Random(seed).shuffle(imageFiles)
+    images = []
+    for imageFile in imageFiles[:count]:
+        image = read_image(imageFile)
+        if image is None:
+            continue
+        if x > 0 and y > 0:
+            interp = cv2.INTER_LINEAR if x * y > image.shape[0] * image.shape[1] else cv2.INTER_AREA
+            image = cv2.resize(image, (x, y), interpolation=interp)
+        images.append(image)
+    return images
+
+
+def encodeWith(library, ext, options, image):
+    if library == 'pil':
+        buffer = BytesIO()
+        Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)).save(buffer, Image.registered_extensions()[ext], **options.pilParams(ext))
+        return buffer.getvalue()
+    return options.encode(ext, image)
+
+
+def measure(library, ext, options, images, repeat):
+    best = None
+    for _ in range(repeat):
+        size = 0
+        start = time.perf_counter()
+        for image in images:
+            size += len(encodeWith(library, ext, options, image))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (1000.0 * best / len(images), size / len(images))
+
+
+def run(images, names, repeat):
+    print(f"{'setting':<20} {'library':>7} {'ms/image':>9} {'KB/image':>9} {'size':>7}")
+    reference = None
+    for name in names:
+        (library, ext, options) = SETTINGS[name]
+        (ms, size) = measure(library, ext, options, images, repeat)
+        reference = reference or size
+        print(f"{name:<20} {library:>7} {ms:>9.2f} {size / 1024.0:>9.1f} {100.0 * size / reference:>6.0f}%")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the output encoder settings on a sample of images')
+    parser.add_argument('-d', '--dataset', dest='dataset', help='Directory with the images (default: synthetic dataset)', default=None)
+    parser.add_argument('-n', '--images', dest='images', help='Number of sample images', type=int, default=50)
+    parser.add_argument('-x', '--new_x', dest='x', help='Width the images are scaled to before encoding (0 = original size)', type=int, default=320)
+    parser.add_argument('-y', '--new_y', dest='y', help='Height the images are scaled to before encoding (0 = original size)', type=int, default=320)
+    parser.add_argument('-s', '--settings', dest='settings', help='Comma separated list of settings', default=','.join(SETTINGS))
+    parser.add_argument('-r', '--repeat', dest='repeat', help='Runs per setting, the fastest one is kept', type=int, default=3)
+    parser.add_argument('--seed', dest='seed', help='Random seed of the sample', type=int, default=0)
+    args = parser.parse_args()
+
+    names = args.settings.split(',')
+    for name in names:
+        if name not in SETTINGS:
+            parser.error(f"Invalid setting: {name} (possible values: {', '.join(SETTINGS)})")
+
+    with tempfile.TemporaryDirectory() as tempPath:
+        inPath = args.dataset or tempPath
+        if args.dataset is None:
+            generateDataset(inPath, dict(DEFAULT_CONFIG, images=args.images))
+        images = loadSample(inPath, args.images, args.x, args.y, args.seed)
+    if len(images) == 0:
+        parser.error(f"No images found in {args.dataset}")
+    print(f"{len(images)} sample images")
+    run(images, names, args.repeat)
@@ -0,0 +1,79 @@
+import argparse, time
+import numpy as np
+from hash_index import near_pairs, clusters, popcount
+
+
+
+# Benchmark of the near-duplicate search of hash_index.
+#
+# For every count, random hashes are generated, a fraction of them
+# near-duplicates of other hashes (up to threshold bits flipped) and some of
+# them identical copies. The index search (all pairs within the threshold)
+# and the clustering are timed, and the planted near-duplicates that the
+# search found are counted (it's exact, so all of them). The pairwise
+# comparison (vectorized, one hash against all others) is timed on a few
+# hashes and extrapolated to the n * (n - 1) / 2 pairs.
+#
+# Example:
+#   python -m benchmarks.bench_hash_index -n 100000,1000000 -t 1,2,4
+
+
+
+def generateHashes(count, bits, duplicateFraction, threshold, seed):
+    rng = np.random.default_rng(seed)
+    words = (bits + 63) // 64
+    codes = rng.integers(0, 1 << 63, (count, words), dtype=np.int64).astype(np.uint64) << np.uint64(1)
+    codes ^= rng.integers(0, 2, (count, words), dtype=np.int64).astype(np.uint64)
+    if bits % 64 != 0:
+        # Unused bits of the last word are zero (see pack_hashes)
+        codes[:, -1] &= np.uint64(((1 << (bits % 64)) - 1) << (64 - bits % 64))
+    duplicates = np.flatnonzero(rng.random(count) < duplicateFraction)
+    duplicates = duplicates[duplicates > 0]
+    sources = (rng.random(len(duplicates)) * duplicates).astype(np.int64)
+    for (index, source, flips) in zip(duplicates, sources, rng.integers(0, threshold + 1, len(duplicates))):
+        codes[index] = codes[source]
+        for bit in rng.choice(bits, flips, replace=False):
+            codes[index, bit // 64] ^= np.uint64(1) << np.uint64(63 - bit % 64)
+    return (codes, duplicates, sources)
+
+
+def timePairwise(codes, samples):
+    start = time.perf_counter()
+    for index in range(samples):
+        popcount(codes ^ codes[index])
+    return (time.perf_counter() - start) / samples / len(codes)
+
+
+def run(counts, thresholds, bits, duplicateFraction, samples, seed):
+    print(f"{'hashes':>8} {'threshold':>9} {'index s':>8} {'cluster s':>9} {'pairs':>9} {'clusters':>9} {'planted':>8} {'found':>8} {'pairwise s (est.)':>18} {'speedup':>9}")
+    for count in counts:
+        for threshold in thresholds:
+            (codes, duplicates, sources) = generateHashes(count, bits, duplicateFraction, threshold, seed)
+            start = time.perf_counter()
+            (first, second, _) = near_pairs(codes, bits, threshold)
+            indexed = time.perf_counter() - start
+            start = time.perf_counter()
+            groups = clusters(count, first, second)
+            clustered = time.perf_counter() - start
+            label = np.full(count, -1, dtype=np.int64)
+            for (number, group) in enumerate(groups):
+                label[group] = number
+            found = int(np.count_nonzero((label[duplicates] >= 0) & (label[duplicates] == label[sources])))
+            pairwise = timePairwise(codes, samples) * count * (count - 1) / 2
+            elapsed = indexed + clustered
+            print(f"{count:>8} {threshold:>9} {indexed:>8.2f} {clustered:>9.2f} {len(first):>9} {len(groups):>9} {len(duplicates):>8} {found:>8} {pairwise:>18.0f} {pairwise / elapsed:>8.0f}x")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the near-duplicate search of hash_index against the pairwise comparison')
+    parser.add_argument('-n', '--counts', dest='counts', help='Comma separated list of hash counts', default='100000,1000000')
+    parser.add_argument('-t', '--thresholds', dest='thresholds', help='Comma separated list of Hamming distance thresholds', default='1,2,4')
+    parser.add_argument('-b', '--bits', dest='bits', help='Bits per hash (64 for the default pHash)', type=int, default=64)
+    parser.add_argument('-f', '--duplicates', dest='duplicates', help='Fraction of the hashes that are near-duplicates', type=float, default=0.1)
+    parser.add_argument('-s', '--samples', dest='samples', help='Number of hashes the pairwise comparison is timed on', type=int, default=20)
+    parser.add_argument('--seed', dest='seed', help='Random seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run([int(value) for value in args.counts.split(',')], [int(value) for value in args.thresholds.split(',')], args.bits, args.duplicates, args.samples, args.seed)
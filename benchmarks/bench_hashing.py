@@ -0,0 +1,82 @@
+import argparse, os, tempfile, time
+from hash_cache import image_fingerprints, HASH_ALGORITHMS
+from hash_index import pack_hashes, popcount
+from benchmarks.bench_dedupe import oldImageHash
+from benchmarks.synthetic_dataset import generateDataset, joinList, DEFAULT_CONFIG
+
+
+
+# Benchmark of the image hashing of remove_identical_images (see hash_cache).
+#
+# All images of a dataset directory (or a synthetic dataset) are hashed
+#
+#   old      image by image, opened with Pillow and hashed like the old
+#            remove_identical_images did (for reference)
+#   full     image_fingerprints with the full decode
+#   reduced  image_fingerprints with the JPEG draft mode decode
+#
+# for every number of worker processes, without the hash cache. The
+# throughput is reported in images per second, and for the reduced decode the
+# mean and maximum number of bits in which its hashes differ from those of
+# the full decode.
+#
+# Example:
+#   python -m benchmarks.bench_hashing -d /data/images -w 1,4
+#   python -m benchmarks.bench_hashing -n 200 -s 8,16
+
+
+
+def collectImages(inPath):
+    return sorted(os.path.join(root, file) for root, _, files in os.walk(inPath)
+                  for file in files if file.lower().endswith(('.jpg', '.jpeg', '.png')))
+
+
+def hashDistances(first, second, algorithm, hashSize):
+    images = [image for image in first if image in second]
+    (a, _) = pack_hashes([getattr(first[image], algorithm) for image in images], hashSize * hashSize)
+    (b, _) = pack_hashes([getattr(second[image], algorithm) for image in images], hashSize * hashSize)
+    return popcount(a ^ b)
+
+
+def run(images, workerCounts, hashSizes, algorithm):
+    print(f"{'method':<8} {'hash size':>9} {'workers':>7} {'images':>7} {'s':>7} {'images/s':>9} {'speedup':>8} {'bits differ (mean/max)':>23}")
+    start = time.perf_counter()
+    for image in images:
+        oldImageHash(image)
+    reference = len(images) / (time.perf_counter() - start)
+    print(f"{'old':<8} {8:>9} {1:>7} {len(images):>7} {len(images) / reference:>7.2f} {reference:>9.1f} {1:>7.1f}x")
+    for hashSize in hashSizes:
+        for workers in workerCounts:
+            results = {}
+            for reduced in (False, True):
+                start = time.perf_counter()
+                (results[reduced], _) = image_fingerprints(images, None, hashSize, reduced, workers, progress=False)
+                elapsed = time.perf_counter() - start
+                differ = ''
+                if reduced:
+                    distances = hashDistances(results[False], results[True], algorithm, hashSize)
+                    differ = f"{distances.mean():.2f} / {distances.max()}" if len(distances) > 0 else '-'
+                rate = len(images) / elapsed
+                print(f"{'reduced' if reduced else 'full':<8} {hashSize:>9} {workers:>7} {len(images):>7} {elapsed:>7.2f} {rate:>9.1f} {rate / reference:>7.1f}x {differ:>23}")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the image hashing with reduced decode and worker processes against the full decode')
+    parser.add_argument('-d', '--dataset', dest='dataset', help='Directory with the images (default: synthetic dataset)', default=None)
+    parser.add_argument('-n', '--images', dest='images', help='Number of images of the synthetic dataset', type=int, default=100)
+    parser.add_argument('-w', '--workers', dest='workers', help='Comma separated list of worker process counts', default='1')
+    parser.add_argument('-s', '--hash_sizes', dest='hashSizes', help='Comma separated list of hash sizes', default='8')
+    parser.add_argument('-a', '--algorithm', dest='algorithm', help='Hash compared between full and reduced decode', choices=HASH_ALGORITHMS, default='phash')
+    parser.add_argument('--sizes', dest='sizes', help='Comma separated long edges of the synthetic images', default=joinList(DEFAULT_CONFIG['sizes']))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempPath:
+        inPath = args.dataset or tempPath
+        if args.dataset is None:
+            generateDataset(inPath, dict(DEFAULT_CONFIG, images=args.images, sizes=[int(value) for value in args.sizes.split(',')]))
+        images = collectImages(inPath)
+        if len(images) == 0:
+            parser.error(f"No images found in {inPath}")
+        run(images, [int(value) for value in args.workers.split(',')], [int(value) for value in args.hashSizes.split(',')], args.algorithm)
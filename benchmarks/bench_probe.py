@@ -0,0 +1,113 @@
+import argparse, os, random, tempfile, time
+import cv2
+from PIL import Image
+from image_header import read_header
+from image_backend import EXIF_ORIENTATION_TAG
+from benchmarks.synthetic_dataset import generateDataset, joinList, DEFAULT_CONFIG
+
+
+
+# Benchmark of reading the image size (see image_header).
+#
+# Every method reads the size of all sample images (of a dataset directory or
+# a synthetic dataset) from disk, per file format:
+#
+#   header     the header parser of image_header (the default of all scripts)
+#   pil_open   Image.open with the size and the EXIF orientation
+#   cv2_imread cv2.imread, i.e. the whole image is decoded
+#
+# The best of several runs is reported in microseconds per image and relative
+# to the header parser, together with the number of images for which a
+# method got a different size than the header parser (sizes with the EXIF
+# orientation applied).
+#
+# Example:
+#   python -m benchmarks.bench_probe -d /data/images -n 500
+#   python -m benchmarks.bench_probe -f .jpg,.png,.webp -n 300
+
+
+
+def probeHeader(path):
+    return read_header(path).size()
+
+
+def probePil(path):
+    with Image.open(path) as img:
+        (width, height) = img.size
+        orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    return (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+
+
+def probeCv2(path):
+    image = cv2.imread(path)
+    return (image.shape[1], image.shape[0])
+
+
+METHODS = {
+    'header': probeHeader,
+    'pil_open': probePil,
+    'cv2_imread': probeCv2,
+}
+
+IMAGE_FORMATS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.avif')
+
+
+def collectSample(inPath, count, seed):
+    imageFiles = sorted(os.path.join(root, file) for root, _, files in os.walk(inPath)
+                        for file in files if file.lower().endswith(IMAGE_FORMATS))
+    random.Random(seed).shuffle(imageFiles)
+    byFormat = {}
+    for imageFile in imageFiles[:count]:
+        byFormat.setdefault(os.path.splitext(imageFile)[1].lower(), []).append(imageFile)
+    return byFormat
+
+
+def measure(func, files, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        sizes = [func(file) for file in files]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return (1e6 * best / len(files), sizes)
+
+
+def run(byFormat, names, repeat):
+    print(f"{'format':<7} {'method':<11} {'images':>7} {'us/image':>10} {'vs header':>9} {'differ':>7}")
+    for (ext, files) in sorted(byFormat.items()):
+        # Files the parser doesn't support are left out, they are probed by Pillow anyway
+        files = [file for file in files if read_header(file) is not None]
+        if len(files) == 0:
+            continue
+        (reference, expected) = measure(probeHeader, files, repeat)
+        for name in names:
+            (us, sizes) = (reference, expected) if name == 'header' else measure(METHODS[name], files, repeat)
+            differ = sum(1 for (size, expectedSize) in zip(sizes, expected) if tuple(size) != tuple(expectedSize))
+            print(f"{ext:<7} {name:<11} {len(files):>7} {us:>10.1f} {us / reference:>8.1f}x {differ:>7}")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the header parser against Image.open and cv2.imread for reading image sizes')
+    parser.add_argument('-d', '--dataset', dest='dataset', help='Directory with the images (default: synthetic dataset)', default=None)
+    parser.add_argument('-n', '--images', dest='images', help='Number of sample images', type=int, default=200)
+    parser.add_argument('-f', '--formats', dest='formats', help='Comma separated list of image file extensions of the synthetic dataset', default=joinList(DEFAULT_CONFIG['formats']))
+    parser.add_argument('-m', '--methods', dest='methods', help='Comma separated list of methods', default=','.join(METHODS))
+    parser.add_argument('-r', '--repeat', dest='repeat', help='Runs per method, the fastest one is kept', type=int, default=3)
+    parser.add_argument('--seed', dest='seed', help='Random seed of the sample', type=int, default=0)
+    args = parser.parse_args()
+
+    names = args.methods.split(',')
+    for name in names:
+        if name not in METHODS:
+            parser.error(f"Invalid method: {name} (possible values: {', '.join(METHODS)})")
+
+    with tempfile.TemporaryDirectory() as tempPath:
+        inPath = args.dataset or tempPath
+        if args.dataset is None:
+            generateDataset(inPath, dict(DEFAULT_CONFIG, images=args.images, formats=args.formats.split(',')))
+        byFormat = collectSample(inPath, args.images, args.seed)
+        if len(byFormat) == 0:
+            parser.error(f"No images found in {inPath}")
+        run(byFormat, names, args.repeat)
@@ -0,0 +1,115 @@
+import argparse, os, resource, tempfile, time
+import multiprocessing as mp
+import numpy as np
+import cv2
+from image_io import probe_image_size, reduction_for_scale, read_image
+from smart_resize_images import smart_resize
+from output_writer import flush_writer
+from benchmarks.synthetic_dataset import randomImage, writeAnnotation
+
+
+
+# Compares full resolution JPEG decoding with the reduced decoding (1/2, 1/4
+# and 1/8 resolution) used by the resize scripts, once for the decode alone
+# and once end-to-end for smart_resize on annotated images.
+#
+# Every decode is measured in a fresh process, so the peak memory (maximum
+# resident set size) of the process can be reported per variant. The
+# baseline memory of the process (interpreter, OpenCV) is subtracted, so
+# allocations that fit into memory the process already held show up as 0.
+# The size of the decoded image buffer is reported as well.
+
+
+
+def writeJpeg(path, imgW, imgH, rng):
+    cv2.imwrite(path, randomImage(imgW, imgH, rng), [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+
+def maxRssMb():
+    # ru_maxrss is given in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _decode(path, reduction, repeat):
+    baseline = maxRssMb()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        image = read_image(path, reduction)
+    elapsed = (time.perf_counter() - start) / repeat
+    return (elapsed, image.shape, maxRssMb() - baseline)
+
+
+def _smartResize(imageFiles, outputPath, targetW, targetH, reducedDecode):
+    baseline = maxRssMb()
+    start = time.perf_counter()
+    outputs = 0
+    for imageFile in imageFiles:
+        xmlFile = os.path.splitext(imageFile)[0] + '.xml'
+        outputs += smart_resize(imageFile, xmlFile, (targetW, targetH), outputPath, reducedDecode)
+    flush_writer()
+    return ((time.perf_counter() - start) / len(imageFiles), outputs, maxRssMb() - baseline)
+
+
+def inFreshProcess(func, *args):
+    with mp.get_context('spawn').Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+def runDecode(path, repeat):
+    (imgW, imgH) = probe_image_size(path)
+    print(f"{imgW}x{imgH}:")
+    print(f"{'reduction':>10} {'decoded':>11} {'ms':>8} {'speedup':>8} {'image MB':>9} {'peak MB':>8}")
+    fullTime = None
+    for reduction in (1, 2, 4, 8):
+        (elapsed, shape, peak) = inFreshProcess(_decode, path, reduction, repeat)
+        fullTime = fullTime or elapsed
+        print(f"{'1/' + str(reduction):>10} {shape[1]:>5}x{shape[0]:<5} {elapsed * 1000.0:>8.1f} {fullTime / elapsed:>7.1f}x {np.prod(shape) / 2**20:>9.1f} {peak:>8.1f}")
+
+
+def runSmartResize(workPath, imgW, imgH, numImages, numBoxes, targetW, targetH, rng):
+    imageFiles = []
+    for index in range(numImages):
+        imageFile = os.path.join(workPath, f"image{index}.jpg")
+        writeJpeg(imageFile, imgW, imgH, rng)
+        w = rng.uniform(imgW / 20, imgW / 4, numBoxes)
+        h = rng.uniform(imgH / 20, imgH / 4, numBoxes)
+        x = rng.uniform(10, imgW - w - 10)
+        y = rng.uniform(10, imgH - h - 10)
+        writeAnnotation(os.path.splitext(imageFile)[0] + '.xml', imageFile, imgW, imgH, np.stack((x, y, x + w, y + h), axis=1))
+        imageFiles.append(imageFile)
+
+    print(f"smart_resize {imgW}x{imgH} -> {targetW}x{targetH}, {numBoxes} boxes per image:")
+    print(f"{'decode':>8} {'ms/image':>9} {'outputs':>8} {'peak MB':>8}")
+    for (name, reducedDecode) in (('full', False), ('reduced', True)):
+        outputPath = os.path.join(workPath, name)
+        os.makedirs(outputPath, exist_ok=True)
+        (elapsed, outputs, peak) = inFreshProcess(_smartResize, imageFiles, outputPath, targetW, targetH, reducedDecode)
+        print(f"{name:>8} {elapsed * 1000.0:>9.1f} {outputs:>8} {peak:>8.1f}")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark full against reduced resolution JPEG decoding')
+    parser.add_argument('-s', '--sizes', dest='sizes', help='Comma separated list of source sizes', default='4000x3000,6000x4000')
+    parser.add_argument('-r', '--repeat', dest='repeat', help='Decodes per measurement', type=int, default=5)
+    parser.add_argument('-n', '--images', dest='images', help='Number of images for the smart_resize comparison', type=int, default=8)
+    parser.add_argument('-b', '--boxes', dest='boxes', help='Comma separated list of box counts per image', default='1,5')
+    parser.add_argument('-x', '--new_x', dest='x', help='Target image width', type=int, default=320)
+    parser.add_argument('-y', '--new_y', dest='y', help='Target image height', type=int, default=320)
+    parser.add_argument('--seed', dest='seed', help='Random seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes.split(',')]
+    with tempfile.TemporaryDirectory() as workPath:
+        for (imgW, imgH) in sizes:
+            path = os.path.join(workPath, f"{imgW}x{imgH}.jpg")
+            writeJpeg(path, imgW, imgH, rng)
+            runDecode(path, args.repeat)
+            print(f"reduction for a single {args.x}x{args.y} output: 1/{reduction_for_scale(max(args.x / imgW, args.y / imgH), path)}")
+            for numBoxes in (int(count) for count in args.boxes.split(',')):
+                sizePath = os.path.join(workPath, f"{imgW}x{imgH}_{numBoxes}")
+                os.makedirs(sizePath)
+                runSmartResize(sizePath, imgW, imgH, args.images, numBoxes, args.x, args.y, rng)
+            print()
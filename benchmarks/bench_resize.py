@@ -0,0 +1,176 @@
+import argparse, json, os, platform, sys, tempfile
+import resize_images
+import smart_resize_images
+import ml_utils
+from parallel_utils import run_jobs, run_pipeline
+from output_writer import configure_writer, STAGES
+from benchmarks.synthetic_dataset import generateDataset, parseList, joinList, DEFAULT_CONFIG
+
+
+
+# End-to-end benchmark of the resize scripts on a synthetic dataset.
+#
+# Every mode of resize_images (size, scale, target, crop), smart_resize_images
+# (smart) and ml_utils.smart_resize (ml_utils) resizes the whole dataset into
+# a temporary directory. The best of several runs is kept per mode, with the
+# time per stage (read, decode, transform, encode, write, wait) of that run. The
+# results are written as JSON and can be compared against a stored baseline
+# (the JSON output of an earlier run): modes and stages that got slower than
+# the threshold are reported as regressions and the exit code is 1.
+#
+# Example:
+#   python -m benchmarks.bench_resize -n 200 -o baseline.json
+#   ... change the code ...
+#   python -m benchmarks.bench_resize -n 200 --baseline baseline.json
+
+
+
+RESIZE_MODES = ('size', 'scale', 'target', 'crop')
+SMART_MODES = {'smart': smart_resize_images, 'ml_utils': ml_utils}
+MODES = RESIZE_MODES + tuple(SMART_MODES)
+
+# Stages below this share of the baseline time of a mode are too noisy to be compared
+MIN_STAGE_SHARE = 0.1
+
+
+def collectJobs(mode, inPath, outPath, x, y, reducedDecode):
+    # Returns the job function, the jobs and the prefetch function for run_pipeline
+    if mode in SMART_MODES:
+        module = SMART_MODES[mode]
+        return (module.process_image, module.collect_resize_jobs(inPath, outPath, x, y, reducedDecode), None)
+    return (resize_images.process_image, resize_images.collect_resize_jobs(inPath, outPath, x, y, mode, reducedDecode), resize_images.read_source_files)
+
+
+def runMode(mode, inPath, x, y, workers, threads, writerThreads, reducedDecode, repeat):
+    best = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as outPath:
+            (func, jobs, prefetch) = collectJobs(mode, inPath, outPath, x, y, reducedDecode)
+            if workers == 1 and threads > 0:
+                summary = run_pipeline(func, jobs, threads, prefetch, desc=mode, initializer=configure_writer, initargs=(writerThreads,))
+            else:
+                summary = run_jobs(func, jobs, workers, desc=mode, initializer=configure_writer, initargs=(writerThreads,))
+            configure_writer(writerThreads)
+        if best is None or summary.elapsed < best.elapsed:
+            best = summary
+    return {
+        'images': best.jobs,
+        'outputs': best.outputs,
+        'errors': len(best.errors),
+        'seconds': best.elapsed,
+        'ms_per_image': 1000.0 * best.elapsed / max(best.jobs, 1),
+        # Summed over all processes and writer threads
+        'stages': {stage: best.timings.seconds.get(stage, 0.0) * 1000.0 / max(best.jobs, 1) for stage in STAGES},
+    }
+
+
+def run(inPath, datasetConfig, modes, x, y, workers, threads, writerThreads, reducedDecode, repeat):
+    results = {
+        'dataset': datasetConfig,
+        'target': [x, y],
+        'workers': workers,
+        'threads': threads,
+        'writer_threads': writerThreads,
+        'reduced_decode': reducedDecode,
+        'repeat': repeat,
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'modes': {},
+    }
+    for mode in modes:
+        results['modes'][mode] = runMode(mode, inPath, x, y, workers, threads, writerThreads, reducedDecode, repeat)
+    return results
+
+
+def printResults(results):
+    print(f"{'mode':<10} {'images':>7} {'outputs':>8} {'ms/image':>9} " + ' '.join(f"{stage:>9}" for stage in STAGES))
+    for (mode, result) in results['modes'].items():
+        print(f"{mode:<10} {result['images']:>7} {result['outputs']:>8} {result['ms_per_image']:>9.2f} "
+              + ' '.join(f"{result['stages'][stage]:>9.2f}" for stage in STAGES))
+
+
+def compare(results, baseline, threshold):
+    """
+    Compares the results with the baseline results and returns the list of
+    regressions (mode, stage or None for the total, baseline ms, new ms).
+    """
+    for key in ('dataset', 'target', 'workers', 'threads', 'writer_threads', 'reduced_decode'):
+        if results[key] != baseline.get(key):
+            print(f"[WARNING] {key} differs from the baseline ({baseline.get(key)}), the timings are not comparable")
+    if results['machine'] != baseline.get('machine'):
+        print(f"[WARNING] The baseline was measured on a different machine ({baseline.get('machine')})")
+
+    regressions = []
+    print(f"{'mode':<10} {'stage':<10} {'baseline':>9} {'current':>9} {'change':>8}")
+    for (mode, result) in results['modes'].items():
+        base = baseline['modes'].get(mode)
+        if base is None:
+            continue
+        if result['outputs'] != base['outputs']:
+            print(f"[WARNING] {mode} wrote {result['outputs']} outputs, the baseline {base['outputs']}")
+        pairs = [(None, base['ms_per_image'], result['ms_per_image'])]
+        pairs += [(stage, base['stages'][stage], result['stages'][stage]) for stage in STAGES
+                  if base['stages'].get(stage, 0.0) >= MIN_STAGE_SHARE * base['ms_per_image']]
+        for (stage, before, after) in pairs:
+            change = after / before - 1.0 if before > 0 else 0.0
+            flag = ''
+            if change > threshold:
+                regressions.append((mode, stage, before, after))
+                flag = '  REGRESSION'
+            print(f"{mode:<10} {stage or 'total':<10} {before:>9.2f} {after:>9.2f} {100.0 * change:>+7.1f}%{flag}")
+    return regressions
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the resize scripts on a synthetic dataset')
+    parser.add_argument('-d', '--dataset', dest='dataset', help='Directory of the synthetic dataset (reused if its config matches, default: temporary directory)', default=None)
+    parser.add_argument('-n', '--images', dest='images', help='Number of images', type=int, default=DEFAULT_CONFIG['images'])
+    parser.add_argument('-s', '--sizes', dest='sizes', help='Comma separated list of long edge sizes', default=joinList(DEFAULT_CONFIG['sizes']))
+    parser.add_argument('-a', '--aspect_ratios', dest='aspect_ratios', help='Comma separated list of aspect ratios (width / height)', default=joinList(DEFAULT_CONFIG['aspect_ratios']))
+    parser.add_argument('-b', '--boxes', dest='boxes', help='Comma separated list of box counts per image', default=joinList(DEFAULT_CONFIG['box_counts']))
+    parser.add_argument('--border', dest='border', help='Fraction of the boxes that touch the image border', type=float, default=DEFAULT_CONFIG['border_fraction'])
+    parser.add_argument('-f', '--formats', dest='formats', help='Comma separated list of image file extensions', default=joinList(DEFAULT_CONFIG['formats']))
+    parser.add_argument('--seed', dest='seed', help='Random seed of the dataset', type=int, default=DEFAULT_CONFIG['seed'])
+    parser.add_argument('-m', '--modes', dest='modes', help='Comma separated list of modes', default=','.join(MODES))
+    parser.add_argument('-x', '--new_x', dest='x', help='Target image width', type=int, default=320)
+    parser.add_argument('-y', '--new_y', dest='y', help='Target image height', type=int, default=320)
+    parser.add_argument('-w', '--workers', dest='workers', help='Number of worker processes', type=int, default=1)
+    parser.add_argument('--threads', dest='threads', help='Decode/transform threads of the streaming pipeline with a single worker process (0 = no pipeline)', type=int, default=0)
+    parser.add_argument('--writer_threads', dest='writer_threads', help='Number of writer threads per process', type=int, default=2)
+    parser.add_argument('--reduced_decode', dest='reduced_decode', help='Decode JPEGs at reduced resolution where the outputs allow it', action='store_true')
+    parser.add_argument('-r', '--repeat', dest='repeat', help='Runs per mode, the fastest one is kept', type=int, default=3)
+    parser.add_argument('-o', '--output', dest='output', help='Write the results to this JSON file', default=None)
+    parser.add_argument('--baseline', dest='baseline', help='Compare the results with this JSON file of an earlier run', default=None)
+    parser.add_argument('-t', '--threshold', dest='threshold', help='Slowdown that is reported as regression (default: 0.1 = 10 %%)', type=float, default=0.1)
+    args = parser.parse_args()
+
+    modes = args.modes.split(',')
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"Invalid mode: {mode}")
+    datasetConfig = dict(DEFAULT_CONFIG, **{
+        'images': args.images,
+        'sizes': parseList(args.sizes, int),
+        'aspect_ratios': parseList(args.aspect_ratios),
+        'box_counts': parseList(args.boxes, int),
+        'border_fraction': args.border,
+        'formats': args.formats.split(','),
+        'seed': args.seed,
+    })
+
+    with tempfile.TemporaryDirectory() as tempPath:
+        inPath = args.dataset or tempPath
+        generateDataset(inPath, datasetConfig)
+        results = run(inPath, datasetConfig, modes, args.x, args.y, args.workers, args.threads, args.writer_threads, args.reduced_decode, args.repeat)
+    printResults(results)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if len(regressions) > 0:
+            print(f"{len(regressions)} regressions above {100.0 * args.threshold:.0f} %.")
+            sys.exit(1)
@@ -0,0 +1,84 @@
+import argparse, copy, time
+import numpy as np
+import xml.etree.ElementTree as ET
+from box_array import BoxArray
+from voc_writer import VocTemplate, render_box_array
+from benchmarks.synthetic_dataset import randomBoxes
+
+
+
+# Compares the XML output of the resize scripts before (deep copy of the
+# source tree per output, objects removed and rebuilt, then serialized) with
+# the template based serialization of voc_writer, for one source file with
+# several outputs. Both variants produce the same bytes, which is checked.
+
+
+
+def sourceXml(imgW, imgH, boxes):
+    objects = ''.join(
+        f"<object><name>Object{index % 3}</name><pose>Unspecified</pose><truncated>0</truncated><difficult>0</difficult>"
+        f"<bndbox><xmin>{int(x0)}</xmin><ymin>{int(y0)}</ymin><xmax>{int(x1)}</xmax><ymax>{int(y1)}</ymax></bndbox></object>"
+        for (index, (x0, y0, x1, y1)) in enumerate(boxes))
+    return ET.fromstring(f"<annotation><folder>bench</folder><filename>image.jpg</filename><path>/data/image.jpg</path>"
+                         f"<source><database>Unknown</database></source><size><width>{imgW}</width><height>{imgH}</height><depth>3</depth></size>"
+                         f"<segmented>0</segmented>{objects}</annotation>")
+
+
+def legacyXml(origXmlRoot, bboxAnnotations, outputs):
+    results = []
+    for index in range(outputs):
+        xmlRoot = copy.deepcopy(origXmlRoot)
+        xmlRoot.find('filename').text = f"image_{index}.jpg"
+        xmlRoot.find('path').text = f"/out/image_{index}.jpg"
+        size_node = xmlRoot.find('size')
+        size_node.find('width').text = '320'
+        size_node.find('height').text = '320'
+        for xmlObject in xmlRoot.findall('object'):
+            xmlRoot.remove(xmlObject)
+        bboxAnnotations.toXml(xmlRoot)
+        results.append(ET.tostring(xmlRoot, encoding='us-ascii'))
+    return results
+
+
+def templateXml(origXmlRoot, bboxAnnotations, outputs):
+    xmlTemplate = VocTemplate(origXmlRoot)
+    return [xmlTemplate.render(f"image_{index}.jpg", f"/out/image_{index}.jpg", 320, 320, render_box_array(bboxAnnotations))
+            for index in range(outputs)]
+
+
+def measure(func, args, minTime):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        result = func(*args)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= minTime:
+            return (elapsed / runs, result)
+
+
+def run(boxCounts, outputs, minTime, seed):
+    rng = np.random.default_rng(seed)
+    print(f"{'boxes':>6} {'outputs':>8} {'legacy ms':>10} {'template ms':>12} {'speedup':>8}")
+    for numBoxes in boxCounts:
+        xmlRoot = sourceXml(4000, 3000, randomBoxes(4000, 3000, numBoxes, 0.2, rng))
+        bboxAnnotations = BoxArray.fromXml(xmlRoot)
+        bboxAnnotations.scale(0.1, 0.1)
+        (legacyTime, legacy) = measure(legacyXml, (xmlRoot, bboxAnnotations, outputs), minTime)
+        (templateTime, template) = measure(templateXml, (xmlRoot, bboxAnnotations, outputs), minTime)
+        if legacy != template:
+            raise AssertionError(f"Different XML output for {numBoxes} boxes")
+        print(f"{numBoxes:>6} {outputs:>8} {legacyTime * 1000.0:>10.3f} {templateTime * 1000.0:>12.3f} {legacyTime / templateTime:>7.1f}x")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the deep copy XML output against the template based VOC serialization')
+    parser.add_argument('-b', '--boxes', dest='boxes', help='Comma separated list of box counts per image', default='1,5,20,100')
+    parser.add_argument('-n', '--outputs', dest='outputs', help='Output images per source image', type=int, default=6)
+    parser.add_argument('-t', '--min_time', dest='min_time', help='Minimum seconds per measurement', type=float, default=0.5)
+    parser.add_argument('--seed', dest='seed', help='Random seed for the generated boxes', type=int, default=0)
+    args = parser.parse_args()
+
+    run([int(count) for count in args.boxes.split(',')], args.outputs, args.min_time, args.seed)
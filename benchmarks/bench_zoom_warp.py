@@ -0,0 +1,82 @@
+import argparse, time
+import numpy as np
+from ml_utils import getCenteredWindow, cropImage, scaleImageToCenter, cropAndScaleImageToCenter, scaleImageToCenterAndCrop
+from box_array import BoxArray
+from benchmarks.synthetic_dataset import randomImage
+
+
+
+# Compares the full-frame warps used before with the ROI-only warps of
+# saveZoomedBoundingBoxes (crop + zoom) and saveBoundingBox (zoom + crop) on
+# large source images. Besides the timings, the largest per-pixel difference
+# between both variants is reported. The ROI warps differ from the full-frame
+# warps by at most one gray level, caused by the float32 rounding of the
+# translation part of the affine matrix.
+
+
+
+def legacyZoom(image, box, targetW, targetH, rescale):
+    (x, y, w, h) = getCenteredWindow(box.centerX()[0], box.centerY()[0], targetW, targetH, image.shape[1], image.shape[0], False)
+    imageCopy = cropImage(image, x, y, w, h, box)
+    return scaleImageToCenter(imageCopy, rescale, rescale, box.centerX()[0], box.centerY()[0], box)
+
+
+def roiZoom(image, box, targetW, targetH, rescale):
+    (x, y, w, h) = getCenteredWindow(box.centerX()[0], box.centerY()[0], targetW, targetH, image.shape[1], image.shape[0], False)
+    (centerX, centerY) = (box.centerX()[0] - x, box.centerY()[0] - y)
+    return cropAndScaleImageToCenter(image, x, y, w, h, rescale, rescale, centerX, centerY, box)
+
+
+def legacyBoundingBox(image, box, targetW, targetH, newscale):
+    (centerX, centerY) = (box.centerX()[0], box.centerY()[0])
+    (x, y, w, h) = getCenteredWindow(centerX, centerY, targetW, targetH, image.shape[1], image.shape[0], True)
+    imageCopy = scaleImageToCenter(image, newscale, newscale, centerX, centerY, box)
+    return cropImage(imageCopy, x, y, w, h, box)
+
+
+def roiBoundingBox(image, box, targetW, targetH, newscale):
+    (centerX, centerY) = (box.centerX()[0], box.centerY()[0])
+    (x, y, w, h) = getCenteredWindow(centerX, centerY, targetW, targetH, image.shape[1], image.shape[0], True)
+    return scaleImageToCenterAndCrop(image, newscale, newscale, centerX, centerY, x, y, w, h, box)
+
+
+def measure(func, image, boxes, targetW, targetH, scales):
+    outputs = []
+    start = time.perf_counter()
+    for box, scale in zip(boxes, scales):
+        outputs.append(func(image, box.copy(), targetW, targetH, scale))
+    return ((time.perf_counter() - start) / len(boxes), outputs)
+
+
+def maxDifference(outputsA, outputsB):
+    return max(int(np.abs(a.astype(np.int16) - b.astype(np.int16)).max()) for a, b in zip(outputsA, outputsB))
+
+
+def run(sizes, numBoxes, targetW, targetH, seed):
+    rng = np.random.default_rng(seed)
+    print(f"{'source':>11} {'variant':>12} {'legacy ms':>10} {'ROI ms':>8} {'speedup':>8} {'max diff':>9}")
+    for (imgW, imgH) in sizes:
+        image = randomImage(imgW, imgH, rng)
+        centers = rng.uniform((50, 50), (imgW - 50, imgH - 50), (numBoxes, 2))
+        boxes = [BoxArray([[cx - 40, cy - 30, cx + 40, cy + 30]]) for (cx, cy) in centers]
+        zoomScales = rng.uniform(0.25, 4.0, numBoxes)
+        boxScales = rng.uniform(0.05, 2.0, numBoxes)
+        for (name, legacy, roi, scales) in (('zoomed box', legacyZoom, roiZoom, zoomScales), ('bounding box', legacyBoundingBox, roiBoundingBox, boxScales)):
+            (legacyTime, legacyOutputs) = measure(legacy, image, boxes, targetW, targetH, scales)
+            (roiTime, roiOutputs) = measure(roi, image, boxes, targetW, targetH, scales)
+            print(f"{imgW:>5}x{imgH:<5} {name:>12} {legacyTime * 1000.0:>10.2f} {roiTime * 1000.0:>8.2f} {legacyTime / roiTime:>7.1f}x {maxDifference(legacyOutputs, roiOutputs):>9}")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark full-frame against ROI-only affine warps')
+    parser.add_argument('-s', '--sizes', dest='sizes', help='Comma separated list of source sizes', default='1024x768,4000x3000,6000x4000')
+    parser.add_argument('-b', '--boxes', dest='boxes', help='Number of zoomed boxes per source image', type=int, default=20)
+    parser.add_argument('-x', '--new_x', dest='x', help='Target image width', type=int, default=320)
+    parser.add_argument('-y', '--new_y', dest='y', help='Target image height', type=int, default=320)
+    parser.add_argument('--seed', dest='seed', help='Random seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes.split(',')]
+    run(sizes, args.boxes, args.x, args.y, args.seed)
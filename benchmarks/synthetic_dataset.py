@@ -0,0 +1,148 @@
+import argparse, json, os
+import numpy as np
+import cv2
+
+
+
+# Generator for reproducible synthetic Pascal VOC datasets, used by the
+# benchmarks of the resize scripts.
+#
+# Every image gets a random size (one of the given long edge sizes combined
+# with one of the given aspect ratios), a random format and a random number of
+# bounding boxes. A fraction of the boxes touches the image border, which
+# drives the resize scripts into their clamping and cropping branches. The
+# same config (including the seed) always generates the same dataset. The
+# config is stored as dataset.json next to the images, so an existing dataset
+# can be reused as long as its config didn't change.
+
+
+
+CONFIG_FILE_NAME = 'dataset.json'
+
+DEFAULT_CONFIG = {
+    'images': 100,
+    # Long edge of the images in pixels
+    'sizes': [640, 1920, 4000],
+    # Width / height, values below 1 are portrait images
+    'aspect_ratios': [1.0, 4 / 3, 16 / 9, 3 / 4],
+    'box_counts': [1, 2, 5],
+    # Fraction of the boxes that touch the image border
+    'border_fraction': 0.2,
+    'formats': ['.jpg'],
+    'labels': ['Cat', 'Dog', 'Bird'],
+    # The images are distributed over this number of sub directories
+    'folders': 2,
+    'seed': 0,
+}
+
+
+def randomImage(imgW, imgH, rng):
+    # Smooth random content, so that interpolation differences become visible
+    small = (rng.random((max(imgH // 8, 1), max(imgW // 8, 1), 3)) * 255).astype(np.uint8)
+    return cv2.resize(small, (imgW, imgH), interpolation=cv2.INTER_LINEAR)
+
+
+def writeAnnotation(path, imageFile, imgW, imgH, boxes, names = None):
+    # boxes is a sequence of (xmin, ymin, xmax, ymax), names the label of every box (default: object)
+    names = names if names is not None else ['object'] * len(boxes)
+    objects = ''.join(
+        f"<object><name>{name}</name><pose>Unspecified</pose><truncated>0</truncated><difficult>0</difficult>"
+        f"<bndbox><xmin>{int(x0)}</xmin><ymin>{int(y0)}</ymin><xmax>{int(x1)}</xmax><ymax>{int(y1)}</ymax></bndbox></object>"
+        for (name, (x0, y0, x1, y1)) in zip(names, boxes))
+    with open(path, 'w') as f:
+        f.write(f"<annotation><folder>{os.path.basename(os.path.dirname(imageFile))}</folder><filename>{os.path.basename(imageFile)}</filename>"
+                f"<path>{imageFile}</path><source><database>Unknown</database></source>"
+                f"<size><width>{imgW}</width><height>{imgH}</height><depth>3</depth></size><segmented>0</segmented>{objects}</annotation>")
+
+
+def imageSize(longEdge, aspectRatio):
+    longEdge = int(longEdge)
+    if aspectRatio >= 1.0:
+        return (longEdge, max(1, int(round(longEdge / aspectRatio))))
+    return (max(1, int(round(longEdge * aspectRatio))), longEdge)
+
+
+def randomBoxes(imgW, imgH, count, borderFraction, rng):
+    w = rng.uniform(min(20, imgW), max(imgW / 2, 20), count).clip(1, imgW)
+    h = rng.uniform(min(20, imgH), max(imgH / 2, 20), count).clip(1, imgH)
+    x = rng.uniform(0, imgW - w)
+    y = rng.uniform(0, imgH - h)
+    # Move some boxes to one of the four image borders
+    border = rng.random(count) < borderFraction
+    side = rng.integers(0, 4, count)
+    x = np.where(border & (side == 0), 0, x)
+    x = np.where(border & (side == 1), imgW - w, x)
+    y = np.where(border & (side == 2), 0, y)
+    y = np.where(border & (side == 3), imgH - h, y)
+    return np.stack((x, y, x + w, y + h), axis=1)
+
+
+def generateDataset(outPath, config = None):
+    """
+    Generates the dataset for the given config (missing keys are taken from
+    DEFAULT_CONFIG) in outPath and returns the list of image files. An
+    existing dataset with the same config is reused.
+    """
+    config = dict(DEFAULT_CONFIG, **(config or {}))
+    configFile = os.path.join(outPath, CONFIG_FILE_NAME)
+    folders = [os.path.join(outPath, f"folder{index}") for index in range(max(1, config['folders']))]
+    if os.path.exists(configFile):
+        with open(configFile) as f:
+            if json.load(f) == json.loads(json.dumps(config)):
+                return sorted(os.path.join(root, file) for root, _, files in os.walk(outPath)
+                              for file in files if file.endswith(tuple(config['formats'])))
+        raise ValueError(f"{outPath} contains a dataset with a different config")
+
+    rng = np.random.default_rng(config['seed'])
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+    imageFiles = []
+    for index in range(config['images']):
+        (imgW, imgH) = imageSize(rng.choice(config['sizes']), rng.choice(config['aspect_ratios']))
+        ext = rng.choice(config['formats'])
+        imageFile = os.path.join(folders[index % len(folders)], f"image{index:06d}{ext}")
+        cv2.imwrite(imageFile, randomImage(imgW, imgH, rng))
+        count = int(rng.choice(config['box_counts']))
+        names = [str(rng.choice(config['labels'])) for _ in range(count)]
+        writeAnnotation(os.path.splitext(imageFile)[0] + '.xml', imageFile, imgW, imgH, randomBoxes(imgW, imgH, count, config['border_fraction'], rng), names)
+        imageFiles.append(imageFile)
+
+    with open(configFile, 'w') as f:
+        json.dump(config, f, indent=2)
+    return imageFiles
+
+
+def parseList(value, type = float):
+    return [type(item) for item in value.split(',')]
+
+
+def joinList(values):
+    return ','.join(str(value) for value in values)
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic Pascal VOC dataset')
+    parser.add_argument('-o', '--output', dest='output', help='Output directory of the dataset', required=True)
+    parser.add_argument('-n', '--images', dest='images', help='Number of images', type=int, default=DEFAULT_CONFIG['images'])
+    parser.add_argument('-s', '--sizes', dest='sizes', help='Comma separated list of long edge sizes', default=joinList(DEFAULT_CONFIG['sizes']))
+    parser.add_argument('-a', '--aspect_ratios', dest='aspect_ratios', help='Comma separated list of aspect ratios (width / height)', default=joinList(DEFAULT_CONFIG['aspect_ratios']))
+    parser.add_argument('-b', '--boxes', dest='boxes', help='Comma separated list of box counts per image', default=joinList(DEFAULT_CONFIG['box_counts']))
+    parser.add_argument('--border', dest='border', help='Fraction of the boxes that touch the image border', type=float, default=DEFAULT_CONFIG['border_fraction'])
+    parser.add_argument('-f', '--formats', dest='formats', help='Comma separated list of image file extensions', default=joinList(DEFAULT_CONFIG['formats']))
+    parser.add_argument('--folders', dest='folders', help='Number of sub directories', type=int, default=DEFAULT_CONFIG['folders'])
+    parser.add_argument('--seed', dest='seed', help='Random seed', type=int, default=DEFAULT_CONFIG['seed'])
+    args = parser.parse_args()
+
+    imageFiles = generateDataset(args.output, {
+        'images': args.images,
+        'sizes': parseList(args.sizes, int),
+        'aspect_ratios': parseList(args.aspect_ratios),
+        'box_counts': parseList(args.boxes, int),
+        'border_fraction': args.border,
+        'formats': args.formats.split(','),
+        'folders': args.folders,
+        'seed': args.seed,
+    })
+    print(f"{len(imageFiles)} images in {args.output}")
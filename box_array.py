@@ -0,0 +1,180 @@
+import numpy as np
+import xml.etree.ElementTree as ET
+
+
+
+# Vectorized container for all bounding boxes of one annotated image.
+#
+# The boxes are stored as an (N, 4) float array with the columns
+# xmin, ymin, xmax, ymax plus an (N,) array of label indices into a tuple of
+# (lower case) class names. It offers the same operations as the per-box
+# BoundingBoxAnnotation class in ml_utils, but every operation is applied to
+# all boxes at once as a NumPy operation.
+#
+# Transformations never modify the arrays in place, they always assign new
+# arrays to the instance. This makes copy() a cheap copy-on-write operation:
+# the copy shares the arrays of the original until one of both is
+# transformed, so no box has to be cloned just to try out another variant.
+
+
+
+class BoxArray:
+    def __init__(self, boxes = None, labels = None, names = ()):
+        if boxes is None:
+            boxes = np.zeros((0, 4), dtype=np.float64)
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        if labels is None:
+            labels = np.zeros(len(self.boxes), dtype=np.int32)
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.names = tuple(names)
+
+    @classmethod
+    def fromXml(cls, xmlRoot):
+        names = []
+        nameIndex = {}
+        labels = []
+        coords = []
+        for xmlObject in xmlRoot.findall('object'):
+            name = xmlObject.find('name').text.lower()
+            if name not in nameIndex:
+                nameIndex[name] = len(names)
+                names.append(name)
+            labels.append(nameIndex[name])
+            bndbox = xmlObject.find('bndbox')
+            coords.append((
+                float(bndbox.find('xmin').text),
+                float(bndbox.find('ymin').text),
+                float(bndbox.find('xmax').text),
+                float(bndbox.find('ymax').text)
+            ))
+        return cls(coords, labels, names)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __getitem__(self, index):
+        # An integer index returns a BoxArray with a single box, which is a view on this array.
+        if isinstance(index, (int, np.integer)):
+            index = slice(index, index + 1 if index != -1 else None)
+        return BoxArray(self.boxes[index], self.labels[index], self.names)
+
+    def copy(self):
+        return BoxArray(self.boxes, self.labels, self.names)
+
+    def select(self, mask):
+        return BoxArray(self.boxes[mask], self.labels[mask], self.names)
+
+    def name(self, index):
+        return self.names[self.labels[index]]
+
+    def xmin(self):
+        return self.boxes[:, 0]
+
+    def ymin(self):
+        return self.boxes[:, 1]
+
+    def xmax(self):
+        return self.boxes[:, 2]
+
+    def ymax(self):
+        return self.boxes[:, 3]
+
+    def width(self):
+        return self.boxes[:, 2] - self.boxes[:, 0]
+
+    def height(self):
+        return self.boxes[:, 3] - self.boxes[:, 1]
+
+    def centerX(self):
+        return (self.boxes[:, 0] + self.boxes[:, 2]) / 2.0
+
+    def centerY(self):
+        return (self.boxes[:, 1] + self.boxes[:, 3]) / 2.0
+
+    def scale(self, scaleX, scaleY):
+        self.boxes = self.boxes * np.array([scaleX, scaleY, scaleX, scaleY])
+
+    def scaleToCenter(self, scaleX, scaleY, centerX, centerY):
+        center = np.array([centerX, centerY, centerX, centerY])
+        self.boxes = center + (self.boxes - center) * np.array([scaleX, scaleY, scaleX, scaleY])
+
+    def crop(self, cropX, cropY):
+        self.boxes = self.boxes - np.array([cropX, cropY, cropX, cropY])
+
+    def clamp(self, imgW, imgH):
+        self.boxes = np.clip(self.boxes, 0.0, np.array([imgW, imgH, imgW, imgH]))
+
+    def isEmpty(self, minSize = 10.0):
+        return (self.width() < minSize) | (self.height() < minSize)
+
+    def percentW(self, imgW, padding = 0.0):
+        factor = (~self.isTouchingLeftBorder()).astype(np.float64) + (~self.isTouchingRightBorder(imgW))
+        return (self.width() + factor * padding) / imgW
+
+    def percentH(self, imgH, padding = 0.0):
+        factor = (~self.isTouchingTopBorder()).astype(np.float64) + (~self.isTouchingBottomBorder(imgH))
+        return (self.height() + factor * padding) / imgH
+
+    def percentAvg(self, imgW, imgH, padding = 0.0):
+        return (self.percentW(imgW, padding) + self.percentH(imgH, padding)) / 2.0
+
+    def isTouchingBorder(self, imgW, imgH):
+        return self.isTouchingLeftBorder() | self.isTouchingTopBorder() | self.isTouchingRightBorder(imgW) | self.isTouchingBottomBorder(imgH)
+
+    def isTouchingLeftBorder(self):
+        return self.boxes[:, 0] <= 3.5
+
+    def isTouchingTopBorder(self):
+        return self.boxes[:, 1] <= 3.5
+
+    def isTouchingRightBorder(self, imgW):
+        return self.boxes[:, 2] >= imgW - 3.5
+
+    def isTouchingBottomBorder(self, imgH):
+        return self.boxes[:, 3] >= imgH - 3.5
+
+    def area(self):
+        return np.maximum(self.width(), 0.0) * np.maximum(self.height(), 0.0)
+
+    def iou(self, other):
+        # (len(self), len(other)) matrix with the intersection over union of every pair of boxes
+        # Column by column, (N, M) arrays are much faster than (N, M, 2) ones
+        overlapW = np.minimum(self.boxes[:, None, 2], other.boxes[None, :, 2]) - np.maximum(self.boxes[:, None, 0], other.boxes[None, :, 0])
+        overlapH = np.minimum(self.boxes[:, None, 3], other.boxes[None, :, 3]) - np.maximum(self.boxes[:, None, 1], other.boxes[None, :, 1])
+        intersection = np.clip(overlapW, 0.0, None, out=overlapW) * np.clip(overlapH, 0.0, None, out=overlapH)
+        union = self.area()[:, None] + other.area()[None, :] - intersection
+        # Boxes without area have no intersection, so their IoU is 0
+        return intersection / np.maximum(union, np.finfo(np.float64).tiny)
+
+    def labelsIn(self, names):
+        # Labels of the boxes as indices into names, -1 for class names that aren't in names
+        mapping = np.array([names.index(name) if name in names else -1 for name in self.names], dtype=np.int32)
+        return mapping[self.labels]
+
+    def concatenate(self, other):
+        # Boxes of both arrays, class names of other that are new to this array are appended to its names
+        names = self.names + tuple(name for name in other.names if name not in self.names)
+        return BoxArray(np.concatenate((self.boxes, other.boxes)), np.concatenate((self.labels, other.labelsIn(names))), names)
+
+    def combined(self):
+        # Returns a BoxArray with the single box enclosing all boxes
+        bounds = np.concatenate((self.boxes[:, :2].min(axis=0), self.boxes[:, 2:].max(axis=0)))
+        return BoxArray(bounds, None, ('',))
+
+    def toXml(self, xmlRoot, minSize = 10.0):
+        # Appends one <object> node per box to the given XML root, boxes smaller than minSize are skipped.
+        keep = ~self.isEmpty(minSize)
+        rounded = np.rint(self.boxes).astype(np.int64)
+        for index in np.flatnonzero(keep):
+            xmlObject = ET.SubElement(xmlRoot, 'object')
+            ET.SubElement(xmlObject, 'name').text = self.name(index)
+            ET.SubElement(xmlObject, 'pose').text = 'Unspecified'
+            ET.SubElement(xmlObject, 'truncated').text = '0'
+            ET.SubElement(xmlObject, 'difficult').text = '0'
+            bndbox = ET.SubElement(xmlObject, 'bndbox')
+            (xmin, ymin, xmax, ymax) = rounded[index]
+            ET.SubElement(bndbox, 'xmin').text = str(xmin)
+            ET.SubElement(bndbox, 'ymin').text = str(ymin)
+            ET.SubElement(bndbox, 'xmax').text = str(xmax)
+            ET.SubElement(bndbox, 'ymax').text = str(ymax)
+        return int(keep.sum())
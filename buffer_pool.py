@@ -0,0 +1,183 @@
+import os, math, threading
+import numpy as np
+
+
+
+# Size-bucketed pool of preallocated image buffers for the resize scripts.
+#
+# Every resize, warp or border operation of the resize scripts writes its
+# result into a buffer of this pool (OpenCV's dst parameter) instead of a
+# freshly allocated array. The buffers are flat byte arrays, grouped into
+# buckets of (slightly) larger capacity than requested: 4 buckets per power
+# of two, so an image of any size finds a recycled buffer after a few
+# images, wasting at most 19 % of the memory.
+#
+# A buffer is leased to its owner (the function that renders an output) and
+# to the writer for every queued encode (see output_writer): the owner
+# releases it when it is done with the image and the writer after encoding
+# it. Only when all leases are released, the buffer goes back to the pool.
+# Views of a buffer (e.g. crop windows) count for the buffer itself. Arrays
+# that don't belong to the pool can be released as well, which does nothing.
+#
+# The pool keeps at most maxBytes of free buffers per process, maxBytes = 0
+# disables it (every acquire allocates a new array, like before).
+
+
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+BUCKETS_PER_OCTAVE = 4
+MIN_BUCKET_BYTES = 64 * 1024
+PAGE_BYTES = 4096
+
+
+def bucket_size(nbytes):
+    # Smallest bucket capacity (multiple of the page size) for nbytes
+    nbytes = max(nbytes, MIN_BUCKET_BYTES)
+    step = math.ceil(math.log2(nbytes) * BUCKETS_PER_OCTAVE)
+    capacity = int(math.ceil(2.0 ** (step / BUCKETS_PER_OCTAVE)))
+    return -(-capacity // PAGE_BYTES) * PAGE_BYTES
+
+
+class BufferPoolStats:
+    def __init__(self, acquires = 0, hits = 0, requestedBytes = 0, allocatedBytes = 0, peaks = None):
+        self.acquires = acquires
+        # Acquires served by a recycled buffer
+        self.hits = hits
+        # Bytes of all acquired images, i.e. what would be allocated without the pool
+        self.requestedBytes = requestedBytes
+        # Bytes of the buffers that were actually allocated
+        self.allocatedBytes = allocatedBytes
+        # Largest memory held by the pool (leased and free buffers) per process id
+        self.peaks = peaks or {}
+
+    def merge(self, other):
+        self.acquires += other.acquires
+        self.hits += other.hits
+        self.requestedBytes += other.requestedBytes
+        self.allocatedBytes += other.allocatedBytes
+        for (pid, peak) in other.peaks.items():
+            self.peaks[pid] = max(self.peaks.get(pid, 0), peak)
+
+    def peakBytes(self):
+        # The processes run concurrently, their peaks add up at worst
+        return sum(self.peaks.values())
+
+    def hitRate(self):
+        return self.hits / self.acquires if self.acquires > 0 else 0.0
+
+    def print(self):
+        if self.acquires == 0:
+            return
+        print(f"Buffer pool: {self.acquires} image buffers, hit rate {100.0 * self.hitRate():.1f} %, "
+              f"{self.allocatedBytes / 2**20:.1f} MB allocated instead of {self.requestedBytes / 2**20:.1f} MB, "
+              f"peak {self.peakBytes() / 2**20:.1f} MB.")
+
+
+class BufferPool:
+    def __init__(self, maxBytes = DEFAULT_MAX_BYTES):
+        self.maxBytes = maxBytes
+        self._lock = threading.Lock()
+        # capacity -> list of free flat buffers
+        self._free = {}
+        self._freeBytes = 0
+        # id(flat buffer) -> [buffer, leases]
+        self._leased = {}
+        self._leasedBytes = 0
+        self._stats = BufferPoolStats()
+
+    def acquire(self, shape, dtype = np.uint8):
+        # Returns an uninitialized array of the given shape, leased once to the caller
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        with self._lock:
+            self._stats.acquires += 1
+            self._stats.requestedBytes += nbytes
+            if self.maxBytes <= 0:
+                self._stats.allocatedBytes += nbytes
+                return np.empty(shape, dtype)
+            capacity = bucket_size(nbytes)
+            free = self._free.get(capacity)
+            if free:
+                buffer = free.pop()
+                self._freeBytes -= capacity
+                self._stats.hits += 1
+            else:
+                buffer = np.empty(capacity, np.uint8)
+                self._stats.allocatedBytes += capacity
+            self._leased[id(buffer)] = [buffer, 1]
+            self._leasedBytes += capacity
+            self._notePeak()
+        return buffer[:nbytes].view(dtype).reshape(shape)
+
+    def _entry(self, array):
+        base = array.base if isinstance(array, np.ndarray) else None
+        return self._leased.get(id(base)) if base is not None else None
+
+    def retain(self, array):
+        # Adds a lease, e.g. for a queued encode of the array
+        with self._lock:
+            entry = self._entry(array)
+            if entry is not None:
+                entry[1] += 1
+
+    def release(self, array):
+        with self._lock:
+            entry = self._entry(array)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            buffer = entry[0]
+            del self._leased[id(buffer)]
+            self._leasedBytes -= buffer.nbytes
+            if self._freeBytes + buffer.nbytes <= self.maxBytes:
+                self._free.setdefault(buffer.nbytes, []).append(buffer)
+                self._freeBytes += buffer.nbytes
+
+    def _notePeak(self):
+        pid = os.getpid()
+        self._stats.peaks[pid] = max(self._stats.peaks.get(pid, 0), self._leasedBytes + self._freeBytes)
+
+    def resetStats(self):
+        # Returns the statistics collected so far and starts over
+        with self._lock:
+            (stats, self._stats) = (self._stats, BufferPoolStats())
+            self._notePeak()
+        return stats
+
+
+
+
+_pool = BufferPool()
+
+
+def buffer_pool():
+    return _pool
+
+
+def configure_buffer_pool(maxBytes = DEFAULT_MAX_BYTES):
+    # Replaces the pool of this process, the buffers of the old one are freed
+    global _pool
+    _pool = BufferPool(maxBytes)
+
+
+def output_buffer(image, width, height):
+    # Buffer for a width x height result with the channels and type of image
+    return _pool.acquire((int(height), int(width)) + image.shape[2:], image.dtype)
+
+
+def use_buffer(dst, result):
+    # OpenCV allocates a new array if dst doesn't fit, the unused buffer goes back to the pool
+    if result is not dst and not np.may_share_memory(result, dst):
+        _pool.release(dst)
+    return result
+
+
+def retain_buffer(array):
+    _pool.retain(array)
+
+
+def release_buffer(array):
+    _pool.release(array)
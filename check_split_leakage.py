@@ -0,0 +1,245 @@
+import argparse
+import csv
+import os
+import shutil
+from collections import Counter
+import numpy as np
+from hash_index import pack_hashes, near_pairs, clusters
+from hash_cache import HashCache, image_fingerprints, default_cache_path, CACHE_FILE, HASH_ALGORITHMS
+
+
+
+# Finds near-duplicate images in different splits of a dataset (e.g. the
+# train, validation and test folders of train_val_test_split), which make the
+# validation and test results look better than they are.
+#
+# All images of the split folders are hashed (see hash_cache, with the hash
+# cache in the dataset folder, so a second scan only stats the files). The
+# pairs of images within threshold bits are found with the index of
+# hash_index, images connected by such pairs form a cluster. A cluster with
+# images of more than one split is a leak. The leaks are summarized per split
+# and written to a CSV report (one row per image of a leaking cluster).
+#
+# With --move, all images of a leaking cluster are moved into one split,
+# together with their XML files: either the split that already holds most of
+# them (majority) or a fixed split (e.g. train, to keep the other splits
+# clean). The path below the split folder is kept, so the layout of
+# pascal_voc (images and Annotations sub folders) works as well.
+
+
+
+IMAGE_FORMATS = ('.jpeg', '.JPEG', '.png', '.PNG', '.jpg', '.JPG', '.bmp', '.BMP')
+
+DEFAULT_SPLITS = ('train', 'validation', 'test')
+
+# Sub folders of a split in the layout of pascal_voc
+VOC_IMAGES_FOLDER = 'images'
+VOC_ANNOTATIONS_FOLDER = 'Annotations'
+
+
+def collect_split_images(dataset_path, splits):
+    # Returns the images of all split folders and the split index of every image
+    images = []
+    image_splits = []
+    for (index, split) in enumerate(splits):
+        for root, _, files in os.walk(os.path.join(dataset_path, split)):
+            for file in sorted(files):
+                if file.endswith(IMAGE_FORMATS):
+                    images.append(os.path.join(root, file))
+                    image_splits.append(index)
+    return (images, np.array(image_splits, dtype=np.int64))
+
+
+def find_leaks(hashes, image_splits, threshold, nbits = None):
+    """
+    Returns the clusters of near-duplicate hashes (lists of indexes) that
+    contain images of more than one split.
+    """
+    (codes, nbits) = pack_hashes(hashes, nbits)
+    (first, second, _) = near_pairs(codes, nbits, threshold)
+    # A leaking cluster has at least one pair across splits, pairs within a split join more of its images
+    if not np.any(image_splits[first] != image_splits[second]):
+        return []
+    return [cluster for cluster in clusters(len(codes), first, second) if len(set(image_splits[cluster].tolist())) > 1]
+
+
+def target_split(cluster, image_splits, policy, splits):
+    # Split a leaking cluster is moved into: the one with most of its images (the first one on a tie) or a fixed split
+    if policy == 'majority':
+        counts = Counter(image_splits[cluster].tolist())
+        return max(sorted(counts), key=lambda split: counts[split])
+    return splits.index(policy)
+
+
+def annotation_file(image_path, split_root):
+    # XML file next to the image, or for an image in the images folder of the split, in its Annotations folder (pascal_voc)
+    (folder, file) = os.path.split(image_path)
+    stem = os.path.splitext(file)[0]
+    xml_paths = [os.path.join(folder, stem + '.xml')]
+    if os.path.normpath(folder) == os.path.normpath(os.path.join(split_root, VOC_IMAGES_FOLDER)):
+        xml_paths.append(os.path.join(split_root, VOC_ANNOTATIONS_FOLDER, stem + '.xml'))
+    for xml_path in xml_paths:
+        if os.path.isfile(xml_path):
+            return xml_path
+    return None
+
+
+def move_to_split(image_path, source_root, target_root):
+    """
+    Moves the image and its XML file from the source split folder to the same
+    relative path in the target split folder. Returns the new image path, or
+    None if a file of the same name already exists there.
+    """
+    files = [image_path]
+    xml_path = annotation_file(image_path, source_root)
+    if xml_path is not None:
+        files.append(xml_path)
+    targets = [os.path.join(target_root, os.path.relpath(file, source_root)) for file in files]
+    if any(os.path.exists(target) for target in targets):
+        return None
+    for (file, target) in zip(files, targets):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(file, target)
+    return targets[0]
+
+
+def write_report(report_path, leaks, images, image_splits, splits, targets = None):
+    with open(report_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['cluster', 'split', 'image'] + (['moved_to'] if targets is not None else []))
+        for (number, cluster) in enumerate(leaks):
+            for index in cluster:
+                row = [number, splits[image_splits[index]], images[index]]
+                writer.writerow(row + ([targets.get(index, '')] if targets is not None else []))
+
+
+def print_summary(leaks, image_splits, splits):
+    print(f"{len(leaks)} clusters of near-duplicate images leak across splits.")
+    leaked = Counter(image_splits[index] for cluster in leaks for index in cluster)
+    for (index, split) in enumerate(splits):
+        print(f"  {split:<12} {leaked[index]:>8} of {np.count_nonzero(image_splits == index)} images are in a leaking cluster")
+    for first in range(len(splits)):
+        for second in range(first + 1, len(splits)):
+            shared = sum(1 for cluster in leaks if {first, second} <= set(image_splits[cluster].tolist()))
+            print(f"  {splits[first]} / {splits[second]}: {shared} clusters")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Find near-duplicate images in different splits (train, validation, test) of a dataset')
+    parser.add_argument(
+        'path',
+        help='Directory that contains the split folders (default: current directory)',
+        nargs='?',
+        default=os.getcwd()
+    )
+    parser.add_argument(
+        '--splits',
+        help=f"Comma separated names of the split folders (default: {','.join(DEFAULT_SPLITS)})",
+        default=','.join(DEFAULT_SPLITS)
+    )
+    parser.add_argument(
+        '-t', '--threshold',
+        help='Images whose hashes differ in at most this number of bits are near-duplicates (default: 4)',
+        type=int,
+        default=4
+    )
+    parser.add_argument(
+        '--hash',
+        help='Perceptual hash of the images (default: phash)',
+        choices=HASH_ALGORITHMS,
+        default='phash'
+    )
+    parser.add_argument(
+        '--hash_size',
+        help='Bits per side of the hash, i.e. the hash has hash_size * hash_size bits (default: 8)',
+        type=int,
+        default=8
+    )
+    parser.add_argument(
+        '--reduced_decode',
+        help='Decode JPEG images only at the size the hash needs (faster, but the hashes differ in a few bits, '
+             'so it needs a threshold of at least 1)',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--workers',
+        help='Number of worker processes for hashing (0 = one per CPU core, default: 0)',
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        '--cache',
+        help=f'File of the hash cache (default: {CACHE_FILE} in the dataset directory)',
+        default=None
+    )
+    parser.add_argument(
+        '--no_cache',
+        help='Hash all images again, without reading or writing the hash cache',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--report',
+        help='CSV file with one row per image of a leaking cluster (default: split_leakage.csv in the dataset directory)',
+        default=None
+    )
+    parser.add_argument(
+        '--move',
+        help="Move every leaking cluster into one split: 'majority' (the split with most of its images) or the name of a split",
+        default=None
+    )
+    args = parser.parse_args()
+
+    splits = args.splits.split(',')
+    if args.threshold < 0:
+        parser.error('The threshold must not be negative')
+    if args.reduced_decode and args.threshold == 0:
+        parser.error('--reduced_decode needs a threshold of at least 1, identical images may get hashes that differ in a few bits')
+    if args.move is not None and args.move != 'majority' and args.move not in splits:
+        parser.error(f"Invalid value for --move: {args.move} (possible values: majority, {', '.join(splits)})")
+    for split in splits:
+        if not os.path.isdir(os.path.join(args.path, split)):
+            parser.error(f"Split folder not found: {os.path.join(args.path, split)}")
+
+    print('Folder: ' + args.path)
+    (images, image_splits) = collect_split_images(args.path, splits)
+    cache = None if args.no_cache else HashCache(args.cache or default_cache_path(args.path))
+    try:
+        (fingerprints, errors) = image_fingerprints(images, cache, args.hash_size, args.reduced_decode, args.workers)
+        for (image, error) in errors:
+            print(f"[ERROR] Could not hash {image}: {error}")
+        hashed = [index for (index, image) in enumerate(images) if image in fingerprints]
+        (images, image_splits) = ([images[index] for index in hashed], image_splits[hashed])
+        hashes = [getattr(fingerprints[image], args.hash) for image in images]
+        leaks = find_leaks(hashes, image_splits, args.threshold, args.hash_size * args.hash_size)
+        print_summary(leaks, image_splits, splits)
+
+        targets = None
+        if args.move is not None:
+            targets = {}
+            skipped = 0
+            for cluster in leaks:
+                target = target_split(cluster, image_splits, args.move, splits)
+                for index in cluster:
+                    if image_splits[index] == target:
+                        continue
+                    moved = move_to_split(images[index], os.path.join(args.path, splits[image_splits[index]]), os.path.join(args.path, splits[target]))
+                    if moved is None:
+                        print(f"[ERROR] Could not move {images[index]} to {splits[target]}: a file of the same name exists")
+                        skipped += 1
+                    else:
+                        targets[index] = splits[target]
+                        if cache is not None:
+                            # Moved within the file system, size, modification time and inode stay the same
+                            cache.put(moved, fingerprints[images[index]], hash_size=args.hash_size, reduced=args.reduced_decode)
+            print(f"Moved {len(targets)} images into the split of their cluster ({skipped} skipped).")
+            if cache is not None:
+                cache.prune(args.path, collect_split_images(args.path, splits)[0])
+    finally:
+        if cache is not None:
+            cache.close()
+
+    report_path = args.report or os.path.join(args.path, 'split_leakage.csv')
+    write_report(report_path, leaks, images, image_splits, splits, targets)
+    print(f"Report written to {report_path}")
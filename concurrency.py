@@ -0,0 +1,107 @@
+import os, math
+import cv2
+
+try:
+    # Installed with scikit-learn, limits the BLAS libraries that are already loaded
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+
+
+# Central thread configuration of all scripts.
+#
+# OpenCV (cv2.resize, cv2.warpAffine, cv2.imencode, ...) and the BLAS library
+# of numpy have their own thread pools, which by default use all cores of
+# the machine. Once the images are processed by several worker processes or
+# pipeline threads, every one of them would start that many threads, which
+# oversubscribes the cores badly. Every process therefore limits OpenCV and
+# BLAS to its share of the available CPUs:
+#
+#   threads per worker = available CPUs // (worker processes * threads per process)
+#
+# The available CPUs honour the CPU affinity of the process and the cgroup
+# CPU quota of a container (cgroup v2 cpu.max or cgroup v1
+# cpu.cfs_quota_us), which os.cpu_count() doesn't. The thread counts set by
+# the user (OPENCV_FOR_THREADS_NUM or one of the BLAS environment variables)
+# are always kept. parallel_utils configures every process it runs jobs in,
+# benchmarks/bench_concurrency finds the best split for the resize scripts.
+
+
+
+OPENCV_THREADS_ENV = 'OPENCV_FOR_THREADS_NUM'
+BLAS_THREADS_ENV = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+CGROUP_V2_CPU_MAX = '/sys/fs/cgroup/cpu.max'
+CGROUP_V1_QUOTA = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+CGROUP_V1_PERIOD = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+
+# Environment variables set by the user before this module was imported
+_USER_ENV = {name for name in (OPENCV_THREADS_ENV,) + BLAS_THREADS_ENV if name in os.environ}
+
+
+def _read_file(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit():
+    # CPU quota of the container in CPUs (e.g. 1.5), None without a limit
+    cpuMax = _read_file(CGROUP_V2_CPU_MAX)
+    if cpuMax is not None:
+        (quota, period) = (cpuMax.split() + ['100000'])[:2]
+        if quota != 'max' and int(period) > 0:
+            return int(quota) / int(period)
+        return None
+    (quota, period) = (_read_file(CGROUP_V1_QUOTA), _read_file(CGROUP_V1_PERIOD))
+    if quota is not None and period is not None and int(quota) > 0 and int(period) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def available_cpus():
+    # Number of CPUs this process can actually use
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, int(math.ceil(limit)))
+    return max(1, cpus)
+
+
+def threads_per_worker(workers = 1, threads = 1):
+    # Share of the available CPUs for each of workers * threads concurrent image operations
+    return max(1, available_cpus() // max(1, workers * threads))
+
+
+def configure_threads(cvThreads, blasThreads = None):
+    """
+    Limits the OpenCV and BLAS threads of this process (BLAS defaults to
+    cvThreads). The environment variables are set as well, so processes
+    started later (e.g. joblib workers) get the same limits.
+    """
+    if OPENCV_THREADS_ENV not in _USER_ENV:
+        cv2.setNumThreads(int(cvThreads))
+    blasThreads = int(blasThreads or cvThreads)
+    for name in BLAS_THREADS_ENV:
+        if name not in _USER_ENV:
+            os.environ[name] = str(blasThreads)
+    if threadpool_limits is not None and not _USER_ENV.intersection(BLAS_THREADS_ENV):
+        threadpool_limits(blasThreads)
+
+
+def configure_worker(workers = 1, threads = 1):
+    # Configures this process as one of workers processes, each running threads concurrent image operations
+    configure_threads(threads_per_worker(workers, threads))
+
+
+def initialize_worker(workers, threads, initializer = None, initargs = ()):
+    # Process pool initializer: thread limits first, then the initializer of the caller
+    configure_worker(workers, threads)
+    if initializer is not None:
+        initializer(*initargs)
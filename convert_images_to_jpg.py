@@ -19,6 +19,7 @@ Verwendung:
      ```bash
      python convert_and_rename_images.py /pfad/zum/verzeichnis
      ```
+   - Optional können die Einstellungen des JPEG-Encoders angegeben werden (`--jpeg_quality`, `--jpeg_optimize`, `--jpeg_progressive`, `--jpeg_subsampling`, siehe `encoder_options.py`). Standardmäßig werden die Voreinstellungen von Pillow verwendet.
 3. Ausgabe:
    - Konvertiert alle PNG-, WEBP- und AVIF-Bilder in JPG und benennt JPEG-Bilder um.
    - Aktualisiert die zugehörigen XML-Dateien, um den neuen Dateinamen und Pfad widerzuspiegeln.
@@ -39,19 +40,29 @@ Abhängigkeiten:
 """
 
 
-from sys import argv
+import argparse
 from pathlib import Path
 import pillow_avif
 from pillow_heif import register_heif_opener
-from PIL import Image
 import os
 import xml.etree.ElementTree as ET
 import uuid
-
-
-image_path = os.getcwd()
-if (len(argv) >= 2):
-    image_path = argv[1]
+from encoder_options import add_encoder_arguments, encoder_from_args
+from image_backend import decode_image, encode_image
+
+
+parser = argparse.ArgumentParser(description='Convert PNG, WEBP and AVIF images to JPG and rename JPEG images to JPG')
+parser.add_argument(
+    'path',
+    help='Directory of the images (default: current directory)',
+    nargs='?',
+    default=os.getcwd()
+)
+add_encoder_arguments(parser)
+args = parser.parse_args()
+
+image_path = args.path
+encoder = encoder_from_args(args)
 print('Folder: ' + image_path)
 
 register_heif_opener()
@@ -85,13 +96,14 @@ def convert(imagePath, ext):
 
         for file in fileList:
             try:
-                im = Image.open(file)
-                if not im.mode == 'RGB':
-                    im = im.convert('RGB')
+                # The pixels are kept as stored, the XML boxes refer to them
+                image = decode_image(file, default='pillow', oriented=False)
                 new_name = file.with_suffix('.jpg')
                 while new_name.exists():
                     new_name = new_name.with_stem(str(uuid.uuid4().hex))
-                im.save(new_name)
+                data = encode_image('.jpg', image, encoder, default='pillow')
+                with open(new_name, 'wb') as f:
+                    f.write(data)
                 os.remove(file)
                 updateXml(file, new_name)
             except Exception as e:
@@ -38,7 +38,7 @@ from sys import argv
 from pathlib import Path
 import os
 import re
-from PIL import Image
+from image_backend import probe_size
 
 
 image_path = os.getcwd()
@@ -91,9 +91,7 @@ for txt_file in txt_file_list:
 
         # If the image name is the same as the yolo filename
         # then we did NOT find an image that matches, and we will skip this code block
-        orig_img = Image.open(os.path.join(image_dir, image_name)) # open the image
-        image_width = orig_img.width
-        image_height = orig_img.height
+        (image_width, image_height) = probe_size(os.path.join(image_dir, image_name), oriented=False) # read the image size
 
         # Start the XML file
         # print('  > Creating XML file: ' + xml_file)
@@ -15,7 +15,6 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 import os
-import io
 import pandas as pd
 
 from tensorflow.python.framework.versions import VERSION
@@ -24,7 +23,7 @@ if VERSION >= "2.0.0a0":
 else:
     import tensorflow as tf
 
-from PIL import Image
+from image_backend import probe_size
 from object_detection.utils import dataset_util
 from collections import namedtuple, OrderedDict
 
@@ -44,9 +43,8 @@ def split(df, group):
 def create_tf_example(group, path):
     with tf.gfile.GFile(os.path.join(path, '{}'.format(group.filename)), 'rb') as fid:
         encoded_jpg = fid.read()
-    encoded_jpg_io = io.BytesIO(encoded_jpg)
-    image = Image.open(encoded_jpg_io)
-    width, height = image.size
+    # The stored size, TensorFlow decodes the image without the EXIF orientation
+    width, height = probe_size(group.filename, encoded_jpg, oriented=False)
 
     filename = group.filename.encode('utf8')
     image_format = b'jpg'
@@ -33,7 +33,7 @@ Hinweise:
 Abhängigkeiten:
 - Python 3.x
 - duckduckgo_search
-- joblib
+- joblib (>= 1.3, für parallel_config)
 - tqdm
 - requests
 - PIL
@@ -53,6 +53,7 @@ import joblib
 import contextlib
 from tqdm.auto import tqdm
 import mimetypes
+from concurrency import available_cpus, threads_per_worker
 import urllib.request
 import errno
 import tempfile
@@ -222,7 +223,9 @@ def _download_urls(urls, folder):
 def _parallel_download_urls(urls, folder):
     downloaded = 0
     with tqdm_parallel(tqdm(total=len(urls))):
-        with joblib.Parallel(n_jobs=os.cpu_count()) as parallel:
+        # One process per available CPU, each limited to its share of the CPUs for native threads
+        workers = available_cpus()
+        with joblib.parallel_config(backend='loky', inner_max_num_threads=threads_per_worker(workers)), joblib.Parallel(n_jobs=workers) as parallel:
             results = parallel(joblib.delayed(_download)(url, folder) for url in urls)
             for result in results:
                 if result:
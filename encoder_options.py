@@ -0,0 +1,148 @@
+import cv2
+from io import BytesIO
+from PIL import Image
+
+
+
+# Shared encoder settings of all scripts that write images.
+#
+# Every setting is optional: None keeps the default of the library that
+# encodes the image (cv2.imencode in the resize scripts, PIL.Image.save in
+# convert_images_to_jpg), so the output doesn't change unless a setting is
+# given. The settings are mapped to the parameters of both libraries:
+#
+#   setting           OpenCV                          Pillow
+#   jpegQuality       IMWRITE_JPEG_QUALITY            quality
+#   jpegOptimize      IMWRITE_JPEG_OPTIMIZE           optimize
+#   jpegProgressive   IMWRITE_JPEG_PROGRESSIVE        progressive
+#   jpegSubsampling   IMWRITE_JPEG_SAMPLING_FACTOR    subsampling
+#   pngLevel          IMWRITE_PNG_COMPRESSION         compress_level
+#   webpQuality       IMWRITE_WEBP_QUALITY            quality
+#   webpMethod        -                               method
+#
+# OpenCV has no WebP method parameter, WebP images with a method are encoded
+# with Pillow instead.
+
+
+
+JPEG_FORMATS = ('.jpg', '.jpeg')
+PNG_FORMATS = ('.png',)
+WEBP_FORMATS = ('.webp',)
+
+# Chroma subsampling: name -> (OpenCV sampling factor, Pillow subsampling)
+JPEG_SUBSAMPLING = {
+    '444': (cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444, 0),
+    '422': (cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422, 1),
+    '420': (cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420, 2),
+}
+
+
+class EncoderOptions:
+    def __init__(self, jpegQuality = None, jpegOptimize = None, jpegProgressive = None, jpegSubsampling = None,
+                 pngLevel = None, webpQuality = None, webpMethod = None):
+        if jpegSubsampling is not None and jpegSubsampling not in JPEG_SUBSAMPLING:
+            raise ValueError(f"Invalid JPEG subsampling: {jpegSubsampling} (possible values: {', '.join(JPEG_SUBSAMPLING)})")
+        self.jpegQuality = jpegQuality
+        self.jpegOptimize = jpegOptimize
+        self.jpegProgressive = jpegProgressive
+        self.jpegSubsampling = jpegSubsampling
+        self.pngLevel = pngLevel
+        self.webpQuality = webpQuality
+        self.webpMethod = webpMethod
+
+    def toDict(self):
+        # Only the settings that differ from the library defaults, e.g. for the resize manifest
+        return {key: value for (key, value) in vars(self).items() if value is not None}
+
+    def isDefault(self):
+        return len(self.toDict()) == 0
+
+    def __repr__(self):
+        return 'EncoderOptions(' + ', '.join(f"{key}={value!r}" for (key, value) in self.toDict().items()) + ')'
+
+    def cv2Params(self, ext):
+        # Parameter list of cv2.imencode / cv2.imwrite for the file extension
+        ext = ext.lower()
+        params = []
+        if ext in JPEG_FORMATS:
+            if self.jpegQuality is not None:
+                params += [cv2.IMWRITE_JPEG_QUALITY, int(self.jpegQuality)]
+            if self.jpegOptimize is not None:
+                params += [cv2.IMWRITE_JPEG_OPTIMIZE, int(self.jpegOptimize)]
+            if self.jpegProgressive is not None:
+                params += [cv2.IMWRITE_JPEG_PROGRESSIVE, int(self.jpegProgressive)]
+            if self.jpegSubsampling is not None:
+                params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, JPEG_SUBSAMPLING[self.jpegSubsampling][0]]
+        elif ext in PNG_FORMATS:
+            if self.pngLevel is not None:
+                params += [cv2.IMWRITE_PNG_COMPRESSION, int(self.pngLevel)]
+        elif ext in WEBP_FORMATS:
+            if self.webpQuality is not None:
+                params += [cv2.IMWRITE_WEBP_QUALITY, int(self.webpQuality)]
+        return params
+
+    def pilParams(self, ext):
+        # Keyword arguments of PIL.Image.save for the file extension
+        ext = ext.lower()
+        params = {}
+        if ext in JPEG_FORMATS:
+            if self.jpegQuality is not None:
+                params['quality'] = int(self.jpegQuality)
+            if self.jpegOptimize is not None:
+                params['optimize'] = bool(self.jpegOptimize)
+            if self.jpegProgressive is not None:
+                params['progressive'] = bool(self.jpegProgressive)
+            if self.jpegSubsampling is not None:
+                params['subsampling'] = JPEG_SUBSAMPLING[self.jpegSubsampling][1]
+        elif ext in PNG_FORMATS:
+            if self.pngLevel is not None:
+                params['compress_level'] = int(self.pngLevel)
+        elif ext in WEBP_FORMATS:
+            if self.webpQuality is not None:
+                params['quality'] = int(self.webpQuality)
+            if self.webpMethod is not None:
+                params['method'] = int(self.webpMethod)
+        return params
+
+    def encode(self, ext, image):
+        """
+        Encodes the image (BGR as decoded by OpenCV) for the file extension
+        and returns the file content as bytes.
+        """
+        if ext.lower() in WEBP_FORMATS and self.webpMethod is not None:
+            buffer = BytesIO()
+            Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)).save(buffer, 'WEBP', **self.pilParams(ext))
+            return buffer.getvalue()
+        (success, buffer) = cv2.imencode(ext, image, self.cv2Params(ext))
+        if not success:
+            raise IOError(f"Could not encode image as {ext}")
+        return buffer.tobytes()
+
+
+DEFAULT_ENCODER = EncoderOptions()
+
+
+def parse_bool(value):
+    value = str(value).lower()
+    if value in ('1', 'true', 'yes', 'on'):
+        return True
+    if value in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(f"Invalid boolean value: {value}")
+
+
+def add_encoder_arguments(parser):
+    # Adds the encoder settings to the argument parser of a script, see encoder_from_args
+    group = parser.add_argument_group('encoder', 'Output encoder settings (default: the defaults of the image library)')
+    group.add_argument('--jpeg_quality', dest='jpeg_quality', help='JPEG quality (0-100)', type=int, default=None)
+    group.add_argument('--jpeg_optimize', dest='jpeg_optimize', help='Optimize the JPEG Huffman tables (0/1)', type=parse_bool, default=None)
+    group.add_argument('--jpeg_progressive', dest='jpeg_progressive', help='Write progressive JPEG files (0/1)', type=parse_bool, default=None)
+    group.add_argument('--jpeg_subsampling', dest='jpeg_subsampling', help='JPEG chroma subsampling', choices=tuple(JPEG_SUBSAMPLING), default=None)
+    group.add_argument('--png_level', dest='png_level', help='PNG compression level (0-9)', type=int, default=None)
+    group.add_argument('--webp_quality', dest='webp_quality', help='WebP quality (1-100)', type=int, default=None)
+    group.add_argument('--webp_method', dest='webp_method', help='WebP encoder method (0 = fast ... 6 = small)', type=int, default=None)
+
+
+def encoder_from_args(args):
+    return EncoderOptions(args.jpeg_quality, args.jpeg_optimize, args.jpeg_progressive, args.jpeg_subsampling,
+                          args.png_level, args.webp_quality, args.webp_method)
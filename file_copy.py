@@ -0,0 +1,86 @@
+import os, sys, shutil
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+
+
+
+# Copies files without reading them through Python, if the file system allows it.
+#
+# The resize scripts copy source images that already have the output size
+# instead of decoding and encoding them again. The copy is done by the
+# fastest method that works on the file system:
+#
+#   link             hard link (only if asked for): no data is copied, but the
+#                    output and the source are the same file afterwards
+#   reflink          copy-on-write clone (Btrfs, XFS, ...), shares the data
+#                    blocks until one of the files is modified
+#   copy_file_range  copy inside the kernel (also server-side on NFS 4.2)
+#   copy             plain copy
+#
+# An existing output file is removed first, so a hard link of an earlier run
+# never gets overwritten (which would modify the source as well).
+
+
+
+# ioctl number of FICLONE on Linux (not defined by fcntl before Python 3.12)
+FICLONE = getattr(fcntl, 'FICLONE', 0x40049409)
+
+
+def _reflink(fsrc, fdst):
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    try:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return True
+    except OSError:
+        return False
+
+
+def _copy_file_range(fsrc, fdst):
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    size = os.fstat(fsrc.fileno()).st_size
+    offset = 0
+    try:
+        while offset < size:
+            copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+            if copied == 0:
+                break
+            offset += copied
+    except OSError:
+        pass
+    if offset == size:
+        return True
+    # Not supported between these files, start over with a plain copy
+    fdst.seek(0)
+    fdst.truncate()
+    return False
+
+
+def copy_file(source, target, link = False):
+    """
+    Copies the source file to target (replacing it) and returns the method
+    that was used (see above), 'same' if target is the source file itself.
+    """
+    if os.path.exists(target):
+        # Written in place, or a hard link of an earlier run that may stay
+        if os.path.samefile(source, target) and (link or os.path.realpath(source) == os.path.realpath(target)):
+            return 'same'
+        os.remove(target)
+    if link:
+        try:
+            os.link(source, target)
+            return 'link'
+        except OSError:
+            pass
+    with open(source, 'rb') as fsrc, open(target, 'wb') as fdst:
+        if _reflink(fsrc, fdst):
+            return 'reflink'
+        if _copy_file_range(fsrc, fdst):
+            return 'copy_file_range'
+        shutil.copyfileobj(fsrc, fdst, 1 << 20)
+        return 'copy'
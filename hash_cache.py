@@ -0,0 +1,285 @@
+import hashlib
+import io
+import os
+import sqlite3
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import imagehash
+from PIL import Image
+from tqdm import tqdm
+from parallel_utils import default_workers, pool_context
+from concurrency import initialize_worker
+
+
+
+# Fingerprints of images (perceptual hashes and a digest of the file bytes),
+# cached on disk.
+#
+# Hashing decodes every image, which takes most of the time of a dedupe run
+# over a large folder, although only a few images change between two runs.
+# The fingerprints are therefore stored in an SQLite file next to the dataset
+# (CACHE_FILE in the folder of the images), one row per image path. A row is
+# only used if the size, the modification time (nanoseconds) and the inode of
+# the file are still the same, otherwise the image is hashed again and the row
+# replaced, so the cache never has to be cleared by hand. On a warm run, the
+# files are only stat'ed.
+#
+# A fingerprint holds the pHash, dHash and aHash (imagehash, hash_size bits
+# per side) and the BLAKE2b digest of the file bytes, so any script that
+# needs one of them can use the same cache. The hashes are kept as hex strings
+# (str of the ImageHash, imagehash.hex_to_hash converts them back), parsing
+# them would take longer than the stat. Rows of a different hash_size are
+# recomputed like changed files.
+#
+# The images are opened with Pillow and hashed as stored (without applying
+# the EXIF orientation), like remove_identical_images always did, so the
+# same images count as identical. The hashes only look at a tiny version of
+# the image (hash_size * 4 pixels per side for the pHash), so with reduced
+# (opt-in), JPEG images are decoded with Pillow's draft mode (DCT scaling to
+# 1/2, 1/4 or 1/8, directly in grayscale) at the smallest scale that still
+# has this resolution. This is several times faster, but the hashes differ
+# from those of the full decode in about one bit on average (up to 6 in the
+# hashing benchmark), so identical images can get different hashes: the
+# reduced decode is only meant for a search within a threshold. The cache
+# keeps the decode mode with the row. The images that aren't cached are
+# hashed in a pool of worker processes.
+#
+# Many duplicates are byte-identical files (e.g. downloaded twice under
+# different names), so a byte-level prefilter runs before the hashing: an
+# image that isn't cached, but has the same file size as another image, is
+# read once for its digest. If an image with the same digest is cached or
+# already being hashed, its fingerprint is taken over without decoding.
+
+
+
+CACHE_FILE = '.image_hashes.sqlite'
+
+# Stored in the file (PRAGMA user_version), a cache with another version is cleared.
+# Version 2: the full decode hashes the image as stored, without the EXIF orientation
+SCHEMA_VERSION = 2
+
+HASH_ALGORITHMS = ('phash', 'dhash', 'ahash')
+
+# Pixels per hash bit and side that the pHash samples (highfreq_factor of imagehash)
+HASH_RESOLUTION = 4
+
+Fingerprint = namedtuple('Fingerprint', ['phash', 'dhash', 'ahash', 'digest'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    hash_size INTEGER NOT NULL,
+    reduced INTEGER NOT NULL,
+    phash TEXT NOT NULL,
+    dhash TEXT NOT NULL,
+    ahash TEXT NOT NULL,
+    digest TEXT NOT NULL
+)
+"""
+
+# Rows written in one transaction, so an interrupted run keeps most of its work
+COMMIT_INTERVAL = 1000
+
+
+def file_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def stream_digest(path, blockSize = 1 << 20):
+    # Same as file_digest of the file content, without reading the whole file into memory
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def decode_for_hash(data, hash_size = 8, reduced = False):
+    # Grayscale image the hashes are computed from (imagehash converts every image to grayscale first)
+    with Image.open(io.BytesIO(data)) as img:
+        if reduced:
+            # No effect on formats other than JPEG
+            img.draft('L', (HASH_RESOLUTION * hash_size, HASH_RESOLUTION * hash_size))
+        return img.convert('L')
+
+
+def compute_fingerprint(path, hash_size = 8, reduced = False):
+    # Reads the file once: the digest of its bytes, the hashes of the decoded image
+    with open(path, 'rb') as f:
+        data = f.read()
+    image = decode_for_hash(data, hash_size, reduced)
+    return Fingerprint(str(imagehash.phash(image, hash_size)), str(imagehash.dhash(image, hash_size)),
+                       str(imagehash.average_hash(image, hash_size)), file_digest(data))
+
+
+def stat_key(path):
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+class HashCache:
+    """
+    Cache of the fingerprints of the images, stored in the SQLite file path.
+    The rows are read once when the cache is opened, get and put don't access
+    the file (put is written in batches, and on close).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.connection.execute('DROP TABLE IF EXISTS fingerprints')
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self.connection.execute(SCHEMA)
+        self.rows = {row[0]: row[1:] for row in self.connection.execute(
+            'SELECT path, size, mtime_ns, inode, hash_size, reduced, phash, dhash, ahash, digest FROM fingerprints')}
+        self.pending = []
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, imagePath, key = None, hash_size = 8, reduced = False):
+        # Cached fingerprint of the image, None if it's not cached or the file changed
+        row = self.rows.get(os.path.abspath(imagePath))
+        if row is None or row[3:5] != (hash_size, int(reduced)) or row[:3] != (key or stat_key(imagePath)):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Fingerprint(*row[5:])
+
+    def put(self, imagePath, fingerprint, key = None, hash_size = 8, reduced = False):
+        path = os.path.abspath(imagePath)
+        row = tuple(key or stat_key(imagePath)) + (hash_size, int(reduced)) + tuple(fingerprint)
+        self.rows[path] = row
+        self.pending.append((path,) + row)
+        if len(self.pending) >= COMMIT_INTERVAL:
+            self.flush()
+
+    def prune(self, folder, keep):
+        # Removes the rows of the images in folder that aren't in keep (deleted or renamed files)
+        prefix = os.path.join(os.path.abspath(folder), '')
+        keep = set(os.path.abspath(path) for path in keep)
+        stale = [path for path in self.rows if path.startswith(prefix) and path not in keep]
+        for path in stale:
+            del self.rows[path]
+        self.connection.executemany('DELETE FROM fingerprints WHERE path = ?', [(path,) for path in stale])
+        self.connection.commit()
+        return len(stale)
+
+    def flush(self):
+        self.connection.executemany('INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', self.pending)
+        self.connection.commit()
+        self.pending = []
+
+    def close(self):
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+
+def default_cache_path(folder):
+    return os.path.join(folder, CACHE_FILE)
+
+
+def _fingerprint_job(path, hash_size, reduced):
+    try:
+        return (compute_fingerprint(path, hash_size, reduced), None)
+    except Exception as e:
+        return (None, f"{type(e).__name__}: {e}")
+
+
+def image_fingerprints(images, cache = None, hash_size = 8, reduced = False, workers = 1, chunksize = 64, progress = True, prefilter = True, counts = None):
+    """
+    Returns the fingerprints of the images (dictionary image -> Fingerprint,
+    in the order of images), from the cache (a HashCache, or None) if
+    possible, and the list of (image, error message) of the images that
+    couldn't be hashed. The other images are hashed in workers processes
+    (0 = one per CPU core), except for byte-identical copies (if prefilter).
+    The numbers of 'cached', 'digested', 'copies' (decodes saved by the
+    prefilter) and 'decoded' images are added to the dictionary counts.
+    """
+    fingerprints = {}
+    errors = []
+    keys = {}
+    missing = []
+    for image in images:
+        try:
+            keys[image] = stat_key(image)
+        except OSError as e:
+            errors.append((image, f"{type(e).__name__}: {e}"))
+            continue
+        fingerprint = cache.get(image, keys[image], hash_size, reduced) if cache is not None else None
+        if fingerprint is None:
+            missing.append(image)
+        else:
+            fingerprints[image] = fingerprint
+    counts = counts if counts is not None else {}
+    for name in ('cached', 'digested', 'copies', 'decoded'):
+        counts.setdefault(name, 0)
+    counts['cached'] += len(fingerprints)
+
+    # Byte-level prefilter: only files of the same size can be identical
+    copies = {}
+    if prefilter and len(missing) > 0:
+        sizes = Counter(key[0] for key in keys.values())
+        byDigest = {fingerprint.digest: image for (image, fingerprint) in fingerprints.items()}
+        decode = []
+        for image in tqdm(missing, desc='Prefilter', unit='images', disable=not progress):
+            if sizes[keys[image][0]] > 1:
+                try:
+                    digest = stream_digest(image)
+                except OSError as e:
+                    errors.append((image, f"{type(e).__name__}: {e}"))
+                    continue
+                counts['digested'] += 1
+                if digest in byDigest:
+                    copies[image] = byDigest[digest]
+                    continue
+                byDigest[digest] = image
+            decode.append(image)
+        missing = decode
+    counts['copies'] += len(copies)
+    counts['decoded'] += len(missing)
+
+    if workers == 0:
+        workers = default_workers()
+    with tqdm(total=len(missing), desc='Hashing', unit='images', disable=not progress) as bar:
+        if workers <= 1:
+            results = map(_fingerprint_job, missing, repeat(hash_size), repeat(reduced))
+            _add_fingerprints(missing, results, keys, cache, hash_size, reduced, fingerprints, errors, bar)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context(), initializer=initialize_worker, initargs=(workers, 1)) as executor:
+                results = executor.map(_fingerprint_job, missing, repeat(hash_size), repeat(reduced), chunksize=chunksize)
+                _add_fingerprints(missing, results, keys, cache, hash_size, reduced, fingerprints, errors, bar)
+
+    failed = dict(errors)
+    for (image, source) in copies.items():
+        if source in fingerprints:
+            fingerprints[image] = fingerprints[source]
+            if cache is not None:
+                cache.put(image, fingerprints[image], keys[image], hash_size, reduced)
+        else:
+            errors.append((image, failed[source]))
+    return ({image: fingerprints[image] for image in images if image in fingerprints}, errors)
+
+
+def _add_fingerprints(missing, results, keys, cache, hash_size, reduced, fingerprints, errors, bar):
+    for (image, (fingerprint, error)) in zip(missing, results):
+        bar.update(1)
+        if error is not None:
+            errors.append((image, error))
+            continue
+        fingerprints[image] = fingerprint
+        if cache is not None:
+            cache.put(image, fingerprint, keys[image], hash_size, reduced)
@@ -0,0 +1,174 @@
+import math
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+
+# Finds all pairs of perceptual hashes within a Hamming distance.
+#
+# Comparing every hash with every other one is quadratic, which doesn't work
+# for hundreds of thousands of images. Instead, the hashes are indexed with
+# multi-index hashing: they are split into threshold + 1 blocks of bits. Two
+# hashes that differ in at most threshold bits are identical in at least one
+# of the blocks (pigeonhole principle), so only hashes that share a block
+# value are candidates. Per block, the hashes are sorted by the block value
+# and the candidates (hashes with the same value) are compared with their
+# exact distance, vectorized with numpy. Identical hashes are collapsed first,
+# so a large number of copies of one image doesn't create quadratic work.
+#
+# The expected work grows with n * n / 2^(bits / (threshold + 1)), i.e. it
+# stays far below the n * n of the pairwise comparison as long as the blocks
+# have more bits than log2(n): e.g. 64 bit hashes of 1M images up to a
+# threshold of about 4, larger hashes (see imagehash's hash_size) allow larger
+# thresholds. The pairs are turned into duplicate clusters as connected
+# components: images connected by a chain of near-duplicates are one cluster.
+
+
+
+# Popcount of every byte value, for numpy versions without bitwise_count
+_BYTE_BITS = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def hash_bits(value, nbits = None):
+    # Bits of a hash: an imagehash.ImageHash, a boolean array or a hex string (str of an ImageHash)
+    if isinstance(value, str):
+        nbits = nbits or 4 * len(value)
+        data = int(value, 16).to_bytes((nbits + 7) // 8, 'big')
+        return np.unpackbits(np.frombuffer(data, dtype=np.uint8))[-nbits:].astype(bool)
+    return np.asarray(getattr(value, 'hash', value), dtype=bool).flatten()
+
+
+def pack_hashes(hashes, nbits = None):
+    """
+    Returns the hashes (see hash_bits, all of the same size) as array of shape
+    (n, words) of 64 bit words, and the number of bits per hash. The number
+    of bits of hex strings is 4 per digit unless nbits is given.
+    """
+    bits = np.array([hash_bits(value, nbits) for value in hashes], dtype=bool)
+    if len(bits) == 0:
+        return (np.zeros((0, 1), dtype=np.uint64), 0)
+    nbits = bits.shape[1]
+    packed = np.packbits(bits, axis=1)
+    padded = np.zeros((len(packed), 8 * int(math.ceil(packed.shape[1] / 8))), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    return (padded.view('>u8').astype(np.uint64), nbits)
+
+
+def popcount(words):
+    # Number of set bits per row of an array of 64 bit words
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int64)
+    return _BYTE_BITS[np.ascontiguousarray(words).view(np.uint8)].sum(axis=1, dtype=np.int64)
+
+
+def hamming_distance(codes, first, second):
+    # Distances between the hashes codes[first[i]] and codes[second[i]]
+    return popcount(codes[first] ^ codes[second])
+
+
+def block_keys(codes, nbits, blocks):
+    # Integer value of each of the blocks (bit ranges of equal size) of every hash
+    bits = np.unpackbits(np.ascontiguousarray(codes.astype('>u8')).view(np.uint8), axis=1)[:, :nbits]
+    bounds = np.linspace(0, nbits, blocks + 1).astype(int)
+    keys = []
+    for (start, end) in zip(bounds[:-1], bounds[1:]):
+        weights = np.left_shift(np.uint64(1), np.arange(end - start, dtype=np.uint64))
+        keys.append((bits[:, start:end].astype(np.uint64) * weights).sum(axis=1, dtype=np.uint64))
+    return keys
+
+
+def _block_candidates(keys):
+    """
+    Yields (first, second) index arrays of all pairs with the same key. The
+    keys are sorted, the pairs of a run of equal keys are those at an offset
+    of 1, 2, ... within the run. Runs that are done are dropped, so every
+    round only works on the runs longer than the offset.
+    """
+    order = np.argsort(keys, kind='stable')
+    sortedKeys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sortedKeys[1:] != sortedKeys[:-1]])
+    lengths = np.diff(np.r_[starts, len(keys)])
+    runLength = np.repeat(lengths, lengths)
+    active = runLength > 1
+    (order, sortedKeys, runLength) = (order[active], sortedKeys[active], runLength[active])
+    offset = 1
+    while len(order) > offset:
+        same = sortedKeys[offset:] == sortedKeys[:-offset]
+        yield (order[:-offset][same], order[offset:][same])
+        offset += 1
+        active = runLength > offset
+        if active.sum() < len(order) // 2:
+            (order, sortedKeys, runLength) = (order[active], sortedKeys[active], runLength[active])
+
+
+def near_pairs(codes, nbits, threshold):
+    """
+    Returns the pairs (first, second, distance) of hashes (rows of codes, see
+    pack_hashes) with a Hamming distance of at most threshold, as index
+    arrays with first < second. Identical hashes are represented by the first
+    one of them: its copies are only paired with it, and only it is paired
+    with the other hashes within the threshold. So the pairs connect the same
+    clusters as all pairs would, without being quadratic in the copies.
+    """
+    if threshold + 1 > nbits:
+        raise ValueError(f"The threshold must be smaller than the number of bits of the hashes ({nbits})")
+    (unique, representative, inverse) = np.unique(codes, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+
+    # Identical hashes: every copy is paired with the first image of its hash
+    (first, second, distance) = ([], [], [])
+    copies = np.flatnonzero(representative[inverse] != np.arange(len(codes)))
+    first.append(representative[inverse[copies]])
+    second.append(copies)
+    distance.append(np.zeros(len(copies), dtype=np.int64))
+
+    # Distinct hashes within the threshold: candidates of every block, checked with their real distance
+    if threshold > 0 and len(unique) > 1:
+        blocks = max(threshold + 1, int(math.ceil(nbits / 64)))
+        found = []
+        for keys in block_keys(unique, nbits, blocks):
+            for (a, b) in _block_candidates(keys):
+                distances = hamming_distance(unique, a, b)
+                close = distances <= threshold
+                found.append((np.minimum(a, b)[close], np.maximum(a, b)[close], distances[close]))
+        if len(found) > 0:
+            a = np.concatenate([pair[0] for pair in found])
+            b = np.concatenate([pair[1] for pair in found])
+            distances = np.concatenate([pair[2] for pair in found])
+            # A pair is found once per block it shares
+            (_, index) = np.unique(a.astype(np.int64) * len(unique) + b, return_index=True)
+            first.append(representative[a[index]])
+            second.append(representative[b[index]])
+            distance.append(distances[index])
+
+    first = np.concatenate(first)
+    second = np.concatenate(second)
+    return (np.minimum(first, second), np.maximum(first, second), np.concatenate(distance))
+
+
+def cluster_labels(count, first, second):
+    # Connected component of each of count items, connected by the pairs (first[i], second[i])
+    graph = coo_matrix((np.ones(len(first), dtype=np.int8), (first, second)), shape=(count, count))
+    return connected_components(graph, directed=False)[1]
+
+
+def clusters(count, first, second):
+    """
+    Returns the clusters (lists of item indexes in ascending order) with at
+    least two items of the graph of count items and the given pairs.
+    """
+    if len(first) == 0:
+        return []
+    labels = cluster_labels(count, first, second)
+    order = np.argsort(labels, kind='stable')
+    starts = np.flatnonzero(np.r_[True, labels[order][1:] != labels[order][:-1]])
+    groups = np.split(order, starts[1:])
+    return [group.tolist() for group in groups if len(group) > 1]
+
+
+def near_duplicate_clusters(hashes, threshold, nbits = None):
+    # Clusters of indexes of the given hashes (see pack_hashes) within the Hamming distance threshold
+    (codes, nbits) = pack_hashes(hashes, nbits)
+    (first, second, _) = near_pairs(codes, nbits, threshold)
+    return clusters(len(codes), first, second)
@@ -0,0 +1,345 @@
+import os, io, json, math, time, random, argparse, platform
+import cv2
+import numpy as np
+import PIL
+from PIL import Image, ImageOps
+from image_header import read_header
+
+
+
+# Interchangeable image libraries for decode, header probe, resize and encode.
+#
+# All scripts read, probe, resize and write images through the functions of
+# this module. Images are passed around as numpy arrays in BGR order (as
+# OpenCV decodes them), so the backends can be mixed freely: e.g. Pillow for
+# the header probe, OpenCV for decode and resize. Decoding applies the EXIF
+# orientation by default, like cv2.imread does. Image sizes are probed by the
+# header backend by default, which parses the file headers itself (see
+# image_header) and leaves unknown formats to Pillow.
+#
+# Which backend is used for an operation (and file format) is read from a
+# JSON config file, written by the calibration command of this module:
+#
+#   python image_backend.py --calibrate -p /path/to/sample/images
+#
+# It times every backend on the sample files and stores the fastest one per
+# operation and format. Without a config entry every caller keeps the library
+# it always used (the default argument of the functions below), so the
+# outputs don't change unless a calibration was done. Pillow-SIMD is a drop-in
+# replacement of Pillow; if it is installed, the pillow backend uses it and
+# reports itself as pillow-simd.
+#
+# The config file is image_backend.json next to this module, or the file in
+# the IMAGE_BACKEND_CONFIG environment variable.
+
+
+
+OPERATIONS = ('decode', 'probe', 'resize', 'encode')
+
+CONFIG_ENV = 'IMAGE_BACKEND_CONFIG'
+DEFAULT_CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_backend.json')
+
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+class OpenCvBackend:
+    name = 'opencv'
+    # OpenCV can't read the image size without decoding the pixels
+    operations = ('decode', 'resize', 'encode')
+
+    def decode(self, path, reduction = 1, data = None, oriented = True):
+        flags = REDUCED_DECODE_FLAGS[reduction] | (0 if oriented else cv2.IMREAD_IGNORE_ORIENTATION)
+        if data is None:
+            image = cv2.imread(str(path), flags)
+        else:
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+        if image is None:
+            raise IOError(f"Could not decode image {path}")
+        return image
+
+    def resize(self, image, dsize, interpolation, fx = None, fy = None, dst = None):
+        if fx is not None:
+            return cv2.resize(image, (0, 0), dst=dst, fx=fx, fy=fy, interpolation=interpolation)
+        return cv2.resize(image, dsize, dst=dst, interpolation=interpolation)
+
+    def encode(self, ext, image, options):
+        return options.encode(ext, image)
+
+
+class PillowBackend:
+    name = 'pillow-simd' if '.post' in PIL.__version__ else 'pillow'
+    operations = OPERATIONS
+
+    RESAMPLING = {
+        cv2.INTER_NEAREST: Image.NEAREST,
+        cv2.INTER_LINEAR: Image.BILINEAR,
+        cv2.INTER_CUBIC: Image.BICUBIC,
+        cv2.INTER_AREA: Image.BOX,
+        cv2.INTER_LANCZOS4: Image.LANCZOS,
+    }
+
+    def decode(self, path, reduction = 1, data = None, oriented = True):
+        with Image.open(path if data is None else io.BytesIO(data)) as img:
+            if reduction > 1:
+                # JPEG DCT scaling, like the reduced decode of OpenCV
+                img.draft('RGB', (int(math.ceil(img.width / reduction)), int(math.ceil(img.height / reduction))))
+            if oriented:
+                img = ImageOps.exif_transpose(img)
+            rgb = np.asarray(img.convert('RGB'))
+        return np.ascontiguousarray(rgb[:, :, ::-1])
+
+    def probe(self, path, data = None, oriented = True):
+        with Image.open(path if data is None else io.BytesIO(data)) as img:
+            (width, height) = img.size
+            orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1) if oriented else 1
+        if orientation in (5, 6, 7, 8):
+            # The image is stored rotated by 90 degrees
+            (width, height) = (height, width)
+        return (width, height)
+
+    def resize(self, image, dsize, interpolation, fx = None, fy = None, dst = None):
+        if fx is not None:
+            dsize = (int(round(image.shape[1] * fx)), int(round(image.shape[0] * fy)))
+        resized = np.asarray(Image.fromarray(image).resize(tuple(int(value) for value in dsize), self.RESAMPLING.get(interpolation, Image.BILINEAR)))
+        if dst is not None and dst.shape == resized.shape:
+            np.copyto(dst, resized)
+            return dst
+        return resized
+
+    def encode(self, ext, image, options):
+        buffer = io.BytesIO()
+        Image.fromarray(np.ascontiguousarray(image[:, :, ::-1])).save(buffer, Image.registered_extensions()[ext.lower()], **options.pilParams(ext))
+        return buffer.getvalue()
+
+
+class HeaderBackend:
+    # Parses the file header itself (see image_header), other formats are probed by Pillow
+    name = 'header'
+    operations = ('probe',)
+
+    def probe(self, path, data = None, oriented = True):
+        header = read_header(path, data)
+        if header is None:
+            return BACKENDS['pillow'].probe(path, data, oriented)
+        return header.size(oriented)
+
+
+BACKENDS = {backend.name: backend for backend in (OpenCvBackend(), PillowBackend(), HeaderBackend())}
+# The config always uses the generic name, Pillow-SIMD is only reported
+BACKENDS['pillow'] = BACKENDS[PillowBackend.name]
+
+_config = None
+
+
+def config_file():
+    return os.environ.get(CONFIG_ENV, DEFAULT_CONFIG_FILE)
+
+
+def load_config(path = None):
+    # Returns {operation: {format or '*': backend name}}, empty if there is no config file
+    path = path or config_file()
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        config = json.load(f)
+    return {operation: config[operation] for operation in OPERATIONS if operation in config}
+
+
+def configure_backends(config):
+    # Sets the backend config of this process (None = load the config file on the next use)
+    global _config
+    _config = config
+
+
+def get_backend(operation, path = None, default = 'opencv'):
+    """
+    Returns the backend for the operation and the format of the given file
+    (by its extension). Without a config entry, the default backend is used.
+    """
+    global _config
+    if _config is None:
+        _config = load_config()
+    choices = _config.get(operation, {})
+    ext = os.path.splitext(str(path))[1].lower() if path is not None else ''
+    name = choices.get(ext) or choices.get('*') or default
+    backend = BACKENDS.get(name)
+    if backend is None or operation not in backend.operations:
+        backend = BACKENDS[default]
+    return backend
+
+
+def decode_image(path, reduction = 1, data = None, default = 'opencv', oriented = True):
+    """
+    Decodes the image (at 1/reduction of its resolution for JPEG files) into
+    a BGR array, with the EXIF orientation applied unless oriented is False.
+    If the configured backend can't decode the file (e.g. a format it doesn't
+    know), the other backends are tried.
+    """
+    backend = get_backend('decode', path, default)
+    try:
+        return backend.decode(path, reduction, data, oriented)
+    except Exception as e:
+        for other in BACKENDS.values():
+            if other is not backend:
+                try:
+                    return other.decode(path, reduction, data, oriented)
+                except Exception:
+                    pass
+        raise IOError(f"Could not decode image {path}") from e
+
+
+def probe_size(path, data = None, oriented = True, default = 'header'):
+    # (width, height) from the file header, with the EXIF orientation applied unless oriented is False
+    return get_backend('probe', path, default).probe(path, data, oriented)
+
+
+def resize_image(image, dsize, interpolation, fx = None, fy = None, dst = None, default = 'opencv'):
+    # Same arguments as cv2.resize: with fx and fy, the size is computed from the scale factors.
+    # The result is written to dst if it has the right size (see buffer_pool).
+    return get_backend('resize', None, default).resize(image, dsize, interpolation, fx, fy, dst)
+
+
+def encode_image(ext, image, options = None, default = 'opencv'):
+    # Returns the file content of the BGR image encoded for the file extension, see encoder_options
+    if options is None:
+        from encoder_options import DEFAULT_ENCODER
+        options = DEFAULT_ENCODER
+    return get_backend('encode', ext, default).encode(ext, image, options)
+
+
+def to_pil(image):
+    # BGR array -> RGB PIL image, for code that works on PIL images (e.g. imagehash)
+    return Image.fromarray(np.ascontiguousarray(image[:, :, ::-1]))
+
+
+def time_call(func, args, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(imageFiles, repeat = 3, scale = 0.25):
+    """
+    Times every backend for every operation on the given sample files and
+    returns the config with the fastest backend per operation and format, and
+    the timings (seconds per image) as second value. Resize is timed as a
+    downscale by the given factor.
+    """
+    from encoder_options import DEFAULT_ENCODER
+    backends = [BACKENDS['opencv'], BACKENDS['pillow'], BACKENDS['header']]
+    samples = {}
+    for imageFile in imageFiles:
+        ext = os.path.splitext(imageFile)[1].lower()
+        with open(imageFile, 'rb') as f:
+            data = f.read()
+        try:
+            image = BACKENDS['opencv'].decode(imageFile, 1, data)
+        except IOError:
+            continue
+        samples.setdefault(ext, []).append((imageFile, data, image))
+
+    timings = {operation: {} for operation in OPERATIONS}
+    for (ext, files) in samples.items():
+        for backend in backends:
+            work = {
+                'decode': lambda: [backend.decode(path, 1, data) for (path, data, _) in files],
+                'probe': lambda: [backend.probe(path, data) for (path, data, _) in files],
+                'encode': lambda: [backend.encode(ext, image, DEFAULT_ENCODER) for (_, _, image) in files],
+                'resize': lambda: [backend.resize(image, None, cv2.INTER_AREA, scale, scale) for (_, _, image) in files],
+            }
+            for operation in OPERATIONS:
+                if operation not in backend.operations:
+                    continue
+                key = '*' if operation == 'resize' else ext
+                seconds = time_call(work[operation], (), repeat) / len(files)
+                # Resize doesn't depend on the format, the times of all formats are summed up
+                timings[operation].setdefault(key, {})
+                timings[operation][key][backend.name] = timings[operation][key].get(backend.name, 0.0) + seconds
+
+    config = {}
+    for (operation, choices) in timings.items():
+        config[operation] = {}
+        for (key, times) in choices.items():
+            fastest = min(times, key=times.get)
+            config[operation][key] = 'pillow' if fastest == PillowBackend.name else fastest
+    return (config, timings)
+
+
+def collect_sample_files(inPath, count, seed = 0):
+    imageFiles = sorted(os.path.join(root, file) for root, _, files in os.walk(inPath) for file in files
+                        if os.path.splitext(file)[1].lower() in Image.registered_extensions())
+    random.Random(seed).shuffle(imageFiles)
+    return imageFiles[:count]
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Calibrate or show the image backends used per operation')
+    parser.add_argument(
+        '--calibrate',
+        dest='calibrate',
+        help='Time every backend on sample images and store the fastest one per operation and format in the config file',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-p',
+        '--path',
+        dest='path',
+        help='Directory of the sample images (default: current directory)',
+        default=None,
+        required=False
+    )
+    parser.add_argument(
+        '-n',
+        '--samples',
+        dest='samples',
+        help='Number of sample images (default: 50)',
+        type=int,
+        default=50,
+        required=False
+    )
+    parser.add_argument(
+        '-c',
+        '--config',
+        dest='config',
+        help=f"Config file (default: {config_file()})",
+        default=None,
+        required=False
+    )
+
+
+
+    args = parser.parse_args()
+
+    path = args.config or config_file()
+    if args.calibrate:
+        imageFiles = collect_sample_files(args.path or os.getcwd(), args.samples)
+        if len(imageFiles) == 0:
+            parser.error('No sample images found')
+        print(f"Calibrating on {len(imageFiles)} images...")
+        (config, timings) = calibrate(imageFiles)
+        for (operation, choices) in timings.items():
+            for (key, times) in sorted(choices.items()):
+                print(f"  {operation:<7} {key:<6} " + '  '.join(f"{name} {1000.0 * seconds:.2f} ms" for (name, seconds) in times.items())
+                      + f"  -> {config[operation][key]}")
+        with open(path, 'w') as f:
+            json.dump(dict(config, machine={'python': platform.python_version(), 'platform': platform.platform(), 'pillow': PIL.__version__,
+                                            'opencv': cv2.__version__}), f, indent=2)
+        print(f"Config written to {path}")
+    else:
+        config = load_config(path)
+        print(f"Config file: {path}" + ('' if os.path.exists(path) else ' (not found, every script uses its default backend)'))
+        for operation in OPERATIONS:
+            print(f"  {operation:<7} " + (', '.join(f"{key}: {name}" for (key, name) in sorted(config.get(operation, {}).items())) or 'default'))
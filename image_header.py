@@ -0,0 +1,354 @@
+import io, struct
+
+
+
+# Reads the size of an image from its file header, without decoding pixels.
+#
+# Supported are JPEG (SOF marker), PNG (IHDR chunk), BMP (DIB header), WebP
+# (VP8, VP8L and VP8X chunks) and AVIF (ispe property of the primary item).
+# Besides width and height, the number of color channels, the bits per
+# channel and the EXIF orientation are returned: the Orientation tag of the
+# EXIF data of JPEG (APP1), PNG (eXIf chunk before the image data) and WebP
+# (EXIF chunk) files, for AVIF the rotation and mirroring properties (irot,
+# imir) of the primary item, converted to the same value. Only the header bytes are read, for JPEG
+# the segments up to the start of the image data.
+#
+# read_header returns None for every other format and for files it can't
+# parse, the caller then falls back to an image library (see the header
+# backend of image_backend, which all scripts use to probe image sizes).
+
+
+
+EXIF_ORIENTATION_TAG = 0x0112
+EXIF_PREFIX = b'Exif\x00\x00'
+
+# JPEG markers with a frame header (SOF0 - SOF15 without DHT, JPG and DAC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# JPEG markers without a length field
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xD8)) | {0x01, 0xD8}
+
+# PNG color type -> channels
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+
+AVIF_BRANDS = (b'avif', b'avis')
+AVIF_ALPHA_URN = b'urn:mpeg:mpegB:cicp:systems:auxiliary:alpha'
+
+# AVIF rotation (irot angle, counter-clockwise in steps of 90 degrees) -> EXIF orientation,
+# without and with mirroring left-right afterwards
+AVIF_ORIENTATION = {False: (1, 8, 3, 6), True: (2, 7, 4, 5)}
+
+
+class ImageHeader:
+    def __init__(self, format, width, height, channels, orientation = 1, bitDepth = 8):
+        self.format = format
+        # Size as stored in the file, the EXIF orientation isn't applied
+        self.width = width
+        self.height = height
+        # Color channels of the decoded image, palette images count as RGB(A)
+        self.channels = channels
+        self.orientation = orientation
+        # Bits per channel of the decoded image (e.g. 16 for 16 bit PNG, 12 for 12 bit JPEG)
+        self.bitDepth = bitDepth
+
+    def size(self, oriented = True):
+        # (width, height), with the EXIF orientation applied unless oriented is False
+        if oriented and self.orientation in (5, 6, 7, 8):
+            # The image is stored rotated by 90 degrees
+            return (self.height, self.width)
+        return (self.width, self.height)
+
+    def __repr__(self):
+        return f"ImageHeader({self.format}, {self.width}x{self.height}, {self.channels} channels, {self.bitDepth} bit, orientation {self.orientation})"
+
+
+def _unpack(fmt, data, offset = 0):
+    if offset + struct.calcsize(fmt) > len(data):
+        raise ValueError('Truncated image header')
+    return struct.unpack_from(fmt, data, offset)
+
+
+def _read_exact(f, count):
+    data = f.read(count)
+    if len(data) < count:
+        raise ValueError('Truncated image header')
+    return data
+
+
+def exif_orientation(exif):
+    """
+    Returns the Orientation tag of IFD0 of the given EXIF data (a TIFF
+    structure, optionally with the Exif prefix of JPEG), 1 if there is none.
+    """
+    if exif.startswith(EXIF_PREFIX):
+        exif = exif[len(EXIF_PREFIX):]
+    try:
+        if exif[:4] == b'II*\x00':
+            endian = '<'
+        elif exif[:4] == b'MM\x00*':
+            endian = '>'
+        else:
+            return 1
+        (offset,) = _unpack(endian + 'I', exif, 4)
+        (count,) = _unpack(endian + 'H', exif, offset)
+        for index in range(count):
+            (tag, type, _) = _unpack(endian + 'HHI', exif, offset + 2 + 12 * index)
+            if tag == EXIF_ORIENTATION_TAG:
+                # SHORT, the value is stored in the entry itself
+                return _unpack(endian + 'H', exif, offset + 10 + 12 * index)[0] if type == 3 else 1
+    except ValueError:
+        pass
+    return 1
+
+
+def _parse_jpeg(f):
+    f.seek(2)
+    (size, orientation) = (None, None)
+    while True:
+        if _read_exact(f, 1) != b'\xff':
+            raise ValueError('Invalid JPEG marker')
+        marker = _read_exact(f, 1)[0]
+        while marker == 0xFF:
+            # Fill bytes
+            marker = _read_exact(f, 1)[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of the image data, the header is complete
+            break
+        (length,) = struct.unpack('>H', _read_exact(f, 2))
+        if marker in JPEG_SOF_MARKERS and size is None:
+            (precision, height, width, channels) = struct.unpack('>BHHB', _read_exact(f, 6))
+            size = (width, height, channels, precision)
+            f.seek(length - 8, io.SEEK_CUR)
+        elif marker == 0xE1 and orientation is None:
+            segment = _read_exact(f, length - 2)
+            # The first APP1 segment with EXIF data counts (an XMP segment is APP1 as well)
+            if segment.startswith(EXIF_PREFIX):
+                orientation = exif_orientation(segment)
+        else:
+            f.seek(length - 2, io.SEEK_CUR)
+    if size is None or size[0] == 0 or size[1] == 0:
+        # No frame header or the height is defined later (DNL marker)
+        return None
+    (width, height, channels, precision) = size
+    return ImageHeader('jpeg', width, height, channels, orientation or 1, precision)
+
+
+def _parse_png(f):
+    f.seek(8)
+    (length, chunkType) = struct.unpack('>I4s', _read_exact(f, 8))
+    if chunkType != b'IHDR':
+        return None
+    (width, height, bitDepth, colorType) = struct.unpack('>IIBB', _read_exact(f, 10))
+    channels = PNG_CHANNELS.get(colorType, 3)
+    # Palette entries and grayscale below 8 bits are decoded to 8 bits per channel
+    bitDepth = 16 if bitDepth == 16 else 8
+    f.seek(length - 10 + 4, io.SEEK_CUR)
+    orientation = 1
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            break
+        (length, chunkType) = struct.unpack('>I4s', chunk)
+        if chunkType in (b'IDAT', b'IEND'):
+            # The eXIf chunk has to come before the image data
+            break
+        if chunkType == b'eXIf':
+            orientation = exif_orientation(_read_exact(f, length))
+            break
+        if chunkType == b'tRNS' and colorType in (0, 2, 3):
+            # Transparency of a palette or a single color, decoded as alpha channel
+            channels += 1
+        # Skip the chunk data and its CRC
+        f.seek(length + 4, io.SEEK_CUR)
+    return ImageHeader('png', width, height, channels, orientation, bitDepth)
+
+
+def _parse_bmp(f):
+    f.seek(14)
+    (headerSize,) = struct.unpack('<I', _read_exact(f, 4))
+    if headerSize == 12:
+        # OS/2 BITMAPCOREHEADER
+        (width, height, _, bitCount) = struct.unpack('<HHHH', _read_exact(f, 8))
+    else:
+        (width, height, _, bitCount) = struct.unpack('<iiHH', _read_exact(f, 12))
+    # A negative height marks a top-down bitmap
+    return ImageHeader('bmp', abs(width), abs(height), 4 if bitCount == 32 else 3)
+
+
+def _parse_webp(f):
+    f.seek(12)
+    (size, channels, orientation, hasExif) = (None, 3, 1, False)
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            break
+        (chunkType, length) = struct.unpack('<4sI', chunk)
+        if chunkType == b'VP8X':
+            data = _read_exact(f, 10)
+            flags = data[0]
+            (channels, hasExif) = (4 if flags & 0x10 else 3, bool(flags & 0x08))
+            size = (int.from_bytes(data[4:7], 'little') + 1, int.from_bytes(data[7:10], 'little') + 1)
+            if not hasExif:
+                break
+            f.seek(length - 10 + (length & 1), io.SEEK_CUR)
+        elif chunkType == b'VP8 ' and size is None:
+            data = _read_exact(f, 10)
+            if data[3:6] != b'\x9d\x01\x2a':
+                return None
+            (width, height) = struct.unpack('<HH', data[6:10])
+            size = (width & 0x3FFF, height & 0x3FFF)
+            break
+        elif chunkType == b'VP8L' and size is None:
+            data = _read_exact(f, 5)
+            if data[0] != 0x2F:
+                return None
+            bits = int.from_bytes(data[1:5], 'little')
+            size = ((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+            channels = 4 if bits & (1 << 28) else 3
+            break
+        elif chunkType == b'EXIF':
+            orientation = exif_orientation(_read_exact(f, length))
+            break
+        else:
+            # Chunks are padded to an even size
+            f.seek(length + (length & 1), io.SEEK_CUR)
+    if size is None:
+        return None
+    return ImageHeader('webp', *size, channels, orientation)
+
+
+def _iter_boxes(data, offset = 0, end = None):
+    # Yields (type, content offset, end offset) of the ISOBMFF boxes in data[offset:end]
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        (size, boxType) = struct.unpack_from('>I4s', data, offset)
+        headerSize = 8
+        if size == 1:
+            (size,) = _unpack('>Q', data, offset + 8)
+            headerSize = 16
+        elif size == 0:
+            size = end - offset
+        if size < headerSize:
+            raise ValueError('Invalid box size')
+        yield (boxType, offset + headerSize, min(offset + size, end))
+        offset += size
+
+
+def _parse_avif(f):
+    (meta, brands) = (None, b'')
+    f.seek(0)
+    while meta is None:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        (size, boxType) = struct.unpack('>I4s', header)
+        headerSize = 8
+        if size == 1:
+            (size,) = struct.unpack('>Q', _read_exact(f, 8))
+            headerSize = 16
+        if boxType == b'ftyp':
+            brands = _read_exact(f, size - headerSize)
+        elif boxType == b'meta':
+            meta = _read_exact(f, size - headerSize)
+        elif size == 0:
+            break
+        else:
+            f.seek(size - headerSize, io.SEEK_CUR)
+    # Major brand and compatible brands (the minor version is never a valid brand)
+    if meta is None or not any(brands[index:index + 4] in AVIF_BRANDS for index in range(0, len(brands), 4)):
+        return None
+
+    # meta is a full box: version and flags first
+    boxes = {boxType: (start, end) for (boxType, start, end) in _iter_boxes(meta, 4)}
+    if b'pitm' not in boxes or b'iprp' not in boxes:
+        return None
+    (start, _) = boxes[b'pitm']
+    primaryItem = _unpack('>H' if meta[start] == 0 else '>I', meta, start + 4)[0]
+
+    (properties, associations) = ([], {})
+    for (boxType, start, end) in _iter_boxes(meta, *boxes[b'iprp']):
+        if boxType == b'ipco':
+            properties = list(_iter_boxes(meta, start, end))
+        elif boxType == b'ipma':
+            (version, flags) = (meta[start], int.from_bytes(meta[start + 1:start + 4], 'big'))
+            (count,) = _unpack('>I', meta, start + 4)
+            offset = start + 8
+            for _ in range(count):
+                (itemId,) = _unpack('>H' if version < 1 else '>I', meta, offset)
+                offset += 2 if version < 1 else 4
+                indexes = []
+                for _ in range(meta[offset]):
+                    if flags & 1:
+                        indexes.append(_unpack('>H', meta, offset + 1)[0] & 0x7FFF)
+                        offset += 2
+                    else:
+                        indexes.append(meta[offset + 1] & 0x7F)
+                        offset += 1
+                offset += 1
+                associations[itemId] = indexes
+
+    (size, channels, bitDepth, angle, axis) = (None, 3, 8, 0, None)
+    for index in associations.get(primaryItem, []):
+        if index < 1 or index > len(properties):
+            continue
+        # Property indexes start at 1
+        (boxType, start, end) = properties[index - 1]
+        if boxType == b'ispe':
+            size = _unpack('>II', meta, start + 4)
+        elif boxType == b'pixi':
+            channels = meta[start + 4]
+            if channels > 0 and start + 5 < end:
+                bitDepth = meta[start + 5]
+        elif boxType == b'irot':
+            angle = meta[start] & 3
+        elif boxType == b'imir':
+            axis = meta[start] & 1
+    if size is None:
+        return None
+    if axis == 0:
+        # The image is rotated first, then mirrored. Mode 0 mirrors about the horizontal axis
+        # (top-bottom), which is the same as rotating by 180 degrees and mirroring left-right.
+        angle = (angle + 2) % 4
+    if any(boxType == b'auxC' and meta[start + 4:end].rstrip(b'\x00') == AVIF_ALPHA_URN for (boxType, start, end) in properties):
+        channels += 1
+    return ImageHeader('avif', *size, channels, AVIF_ORIENTATION[axis is not None][angle], bitDepth)
+
+
+def _parser(signature):
+    # Parse function for the first 12 bytes of a file, None for an unknown format
+    if signature[:3] == b'\xff\xd8\xff':
+        return _parse_jpeg
+    if signature[:8] == b'\x89PNG\r\n\x1a\n':
+        return _parse_png
+    if signature[:2] == b'BM':
+        return _parse_bmp
+    if signature[:4] == b'RIFF' and signature[8:12] == b'WEBP':
+        return _parse_webp
+    if signature[4:8] == b'ftyp':
+        return _parse_avif
+    return None
+
+
+def parse_header(f):
+    # Same as read_header for an open binary file
+    signature = f.read(12)
+    parser = _parser(signature)
+    if parser is None:
+        return None
+    try:
+        return parser(f)
+    except (ValueError, struct.error, IndexError):
+        return None
+
+
+def read_header(path, data = None):
+    """
+    Returns the ImageHeader of the image file, or None if the format isn't
+    supported or the header can't be parsed. If the file content was already
+    read, it can be passed as data.
+    """
+    if data is not None:
+        return parse_header(io.BytesIO(data))
+    with open(path, 'rb') as f:
+        return parse_header(f)
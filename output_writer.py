@@ -0,0 +1,295 @@
+import os, queue, threading, time
+from contextlib import contextmanager
+import xml.etree.ElementTree as ET
+from encoder_options import DEFAULT_ENCODER
+from image_backend import encode_image
+from buffer_pool import retain_buffer, release_buffer, configure_buffer_pool, DEFAULT_MAX_BYTES
+from file_copy import copy_file
+
+
+
+# Asynchronous encode/write stage for the resize scripts.
+#
+# Encoding images (cv2.imencode releases the GIL, see image_backend) and writing the files to a
+# possibly slow (network) file system is done by a small pool of writer
+# threads, so the caller can already decode and transform the next image.
+# The writes are passed through a bounded queue: if the writer threads fall
+# behind, the caller blocks until there is room again (backpressure), so the
+# number of images waiting in memory stays bounded.
+#
+# Every process has one active writer (see active_writer). Write errors are
+# collected together with the source file that produced the output and are
+# returned by flush(), which waits until all queued writes are done. The
+# source file is set per thread, so several threads can share the writer;
+# wait(source) waits for the writes of a single source file.
+#
+# Besides the writer, this module keeps the per-stage timings of the current
+# process (reading file bytes ahead, decode, transform, encode, write and the
+# time spent waiting for the writer). Nested measurements are exclusive: the time of an inner stage
+# is not counted for the outer stage as well. Events worth reporting (e.g.
+# images copied unchanged) are counted along with the timings.
+
+
+
+STAGES = ('read', 'decode', 'transform', 'encode', 'write', 'wait')
+
+# Counted events and how they are reported
+COUNTS = {
+    'copied': 'images already had the output size and were copied without decoding',
+}
+
+
+class StageTimings:
+    def __init__(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def measure(self, stage):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        # Each stack entry holds the time spent in nested stages of this thread
+        stack = self._local.stack
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if len(stack) > 0:
+                stack[-1] += elapsed
+            self.add(stage, elapsed - nested)
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def count(self, name, value = 1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def merge(self, snapshot):
+        # snapshot is the result of reset() of another instance (e.g. of a worker process)
+        (seconds, counts) = snapshot
+        for (stage, value) in seconds.items():
+            self.add(stage, value)
+        for (name, value) in counts.items():
+            self.count(name, value)
+
+    def reset(self):
+        # Returns the timings and counts collected so far and starts over
+        with self._lock:
+            snapshot = (self.seconds, self.counts)
+            self.seconds = dict.fromkeys(STAGES, 0.0)
+            self.counts = {}
+        return snapshot
+
+    def total(self):
+        return sum(self.seconds.values())
+
+    def print(self):
+        total = self.total()
+        if total > 0:
+            print("Time per stage (summed over all processes and writer threads):")
+            for (stage, value) in self.seconds.items():
+                if value <= 0:
+                    # Stage not used in this run
+                    continue
+                print(f"  {stage:<10} {value:>9.2f} s  {100.0 * value / total:>5.1f} %")
+        for (name, value) in self.counts.items():
+            print(f"{value} {COUNTS.get(name, name)}.")
+
+
+
+
+def _encode_image(path, image):
+    try:
+        return encode_image(os.path.splitext(path)[1], image, _encoder)
+    except IOError:
+        raise IOError(f"Could not encode image {path}")
+
+
+def _encode_xml(path, xmlRoot):
+    # Same bytes as ElementTree.write(path) with its default encoding
+    return ET.tostring(xmlRoot, encoding='us-ascii')
+
+
+def _encode_bytes(path, data):
+    return data
+
+
+def _copy_file(path, source):
+    # Copy tasks don't encode anything, the file is copied directly (see file_copy)
+    (sourcePath, link) = source
+    copy_file(sourcePath, path, link)
+
+
+class OutputWriter:
+    def __init__(self, threads = 2, maxPending = None, timings = None):
+        """
+        Writes images and XML files with the given number of threads. With
+        threads = 0 every file is written synchronously by the caller.
+        maxPending limits the number of queued writes (default: 4 per thread).
+        """
+        self.threads = max(0, threads)
+        self.timings = timings if timings is not None else stage_timings()
+        self.errors = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)
+        self._pending = {}
+        self._queue = queue.Queue(maxsize=maxPending or self.threads * 4)
+        self._workers = [threading.Thread(target=self._drain, daemon=True) for _ in range(self.threads)]
+        for worker in self._workers:
+            worker.start()
+
+    def setSource(self, source):
+        # Errors of the following writes of the calling thread are reported for this source file
+        self._local.source = source
+
+    @property
+    def source(self):
+        return getattr(self._local, 'source', None)
+
+    def writeImage(self, path, image):
+        # The image must not be modified by the caller afterwards. An image of the
+        # buffer pool stays leased to the writer until it is encoded.
+        retain_buffer(image)
+        self._submit((self.source, str(path), _encode_image, image))
+
+    def writeXml(self, path, xmlRoot):
+        # The XML tree must not be modified by the caller afterwards
+        self._submit((self.source, str(path), _encode_xml, xmlRoot))
+
+    def writeBytes(self, path, data):
+        # Already encoded file content, e.g. an XML file rendered by voc_writer
+        self._submit((self.source, str(path), _encode_bytes, data))
+
+    def copyFile(self, path, sourcePath, link = False):
+        # Copies the file sourcePath to path, as hard link if link is True and the file system allows it
+        self._submit((self.source, str(path), _copy_file, (str(sourcePath), link)))
+
+    def _submit(self, task):
+        with self._lock:
+            self._pending[task[0]] = self._pending.get(task[0], 0) + 1
+        if self.threads == 0:
+            self._write(*task)
+        else:
+            with self.timings.measure('wait'):
+                self._queue.put(task)
+
+    def _drain(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                self._write(*task)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, source, path, encode, data):
+        try:
+            if encode is _copy_file:
+                with self.timings.measure('write'):
+                    encode(path, data)
+                return
+            try:
+                with self.timings.measure('encode'):
+                    payload = encode(path, data)
+            finally:
+                if encode is _encode_image:
+                    release_buffer(data)
+            with self.timings.measure('write'):
+                with open(path, 'wb') as file:
+                    file.write(payload)
+        except Exception as e:
+            with self._lock:
+                self.errors.append((source, f"{type(e).__name__}: {e}"))
+        finally:
+            with self._lock:
+                self._pending[source] -= 1
+                if self._pending[source] == 0:
+                    del self._pending[source]
+                    self._written.notify_all()
+
+    def wait(self, source):
+        """
+        Waits until all queued files of the given source file are written and
+        returns the error messages of its failed writes (which are not
+        returned by flush() anymore).
+        """
+        with self._written:
+            self._written.wait_for(lambda: source not in self._pending)
+            errors = [error for (errorSource, error) in self.errors if errorSource == source]
+            if len(errors) > 0:
+                self.errors = [entry for entry in self.errors if entry[0] != source]
+        return errors
+
+    def flush(self):
+        """
+        Waits until all queued files are written and returns the list of
+        (source file, error message) tuples of the failed writes since the
+        last flush.
+        """
+        if self.threads > 0:
+            with self.timings.measure('wait'):
+                self._queue.join()
+        with self._lock:
+            (errors, self.errors) = (self.errors, [])
+        return errors
+
+    def close(self):
+        errors = self.flush()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        return errors
+
+
+
+
+_timings = StageTimings()
+_writer = None
+_writerThreads = 2
+_writerMaxPending = None
+_encoder = DEFAULT_ENCODER
+
+
+def stage_timings():
+    return _timings
+
+
+def configure_writer(threads = 2, maxPending = None, encoder = None, poolBytes = DEFAULT_MAX_BYTES):
+    # Sets the number of writer threads (and the size of their queue), the encoder settings (see
+    # encoder_options) and the size of the image buffer pool (see buffer_pool) for this process,
+    # used as process pool initializer as well
+    global _writerThreads, _writerMaxPending, _encoder
+    close_writer()
+    configure_buffer_pool(poolBytes)
+    _writerThreads = threads
+    _writerMaxPending = maxPending
+    _encoder = encoder if encoder is not None else DEFAULT_ENCODER
+
+
+def active_writer():
+    global _writer
+    if _writer is None:
+        _writer = OutputWriter(_writerThreads, _writerMaxPending)
+    return _writer
+
+
+def flush_writer():
+    return _writer.flush() if _writer is not None else []
+
+
+def close_writer():
+    global _writer
+    errors = _writer.close() if _writer is not None else []
+    _writer = None
+    return errors
@@ -0,0 +1,293 @@
+import queue, threading, time
+import multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+from output_writer import StageTimings, stage_timings, active_writer, flush_writer
+from concurrency import available_cpus, initialize_worker
+from buffer_pool import BufferPoolStats, buffer_pool
+
+
+
+# Helpers to run many independent per-file jobs (e.g. resizing one annotated
+# image) either sequentially or in a pool of worker processes.
+#
+# Jobs are submitted in chunks, so only a bounded number of them is in flight
+# at any time, even for datasets with hundreds of thousands of images.
+# Results are consumed in submission order, which keeps the progress bar and
+# the error report deterministic. A failing file does not abort the run; its
+# error is collected and reported in the summary at the end.
+#
+# The output files are written asynchronously by the writer of each process
+# (see output_writer). It is flushed after every chunk (in sequential mode as
+# well), so all outputs of a chunk are on disk when its results arrive, and a
+# failed write is reported as error of the source file that produced it. The
+# per-stage timings of all processes are summed up in the summary.
+#
+# run_pipeline runs the jobs in a streaming pipeline of threads within this
+# process instead: prefetch threads read the input files ahead, worker threads
+# decode and transform them (OpenCV releases the GIL) and the writer threads
+# encode and write the outputs. The stages are connected by bounded queues, so
+# the memory use doesn't depend on the size of the dataset, and the summary
+# reports how busy the threads of every stage were.
+#
+# Every process that runs jobs limits the internal threads of OpenCV and BLAS
+# to its share of the available CPUs (see concurrency). The worker processes
+# are started by a fork server: a process forked after OpenCV started its own
+# thread pool hangs in the first parallel OpenCV call.
+
+
+
+# Return value of a job function with information for onResult (e.g. the
+# source state of resize_manifest) besides the outputs
+JobResult = namedtuple('JobResult', ['outputs', 'info'])
+
+
+class JobSummary:
+    def __init__(self):
+        self.jobs = 0
+        self.outputs = 0
+        self.errors = []
+        self.elapsed = 0.0
+        self.timings = StageTimings()
+        # Number of threads per pipeline stage (see run_pipeline)
+        self.stageThreads = None
+        self.bufferPool = BufferPoolStats()
+
+    def add(self, job, outputs, error):
+        self.jobs += 1
+        if isinstance(outputs, JobResult):
+            outputs = outputs.outputs
+        if error is not None:
+            self.errors.append((job[0], error))
+        elif outputs:
+            # Jobs with several output paths return one count per path
+            self.outputs += sum(outputs) if isinstance(outputs, (list, tuple)) else outputs
+
+
+    def imagesPerSecond(self):
+        return self.jobs / self.elapsed if self.elapsed > 0 else 0.0
+
+    def outputsPerSecond(self):
+        return self.outputs / self.elapsed if self.elapsed > 0 else 0.0
+
+    def utilization(self):
+        # Share of the run time the threads of every pipeline stage were busy
+        utilization = {}
+        for (stage, (timedStages, threads)) in (self.stageThreads or {}).items():
+            if threads == 0:
+                # Not a separate stage in this run
+                continue
+            busy = sum(self.timings.seconds.get(timedStage, 0.0) for timedStage in timedStages)
+            utilization[stage] = busy / (self.elapsed * threads) if self.elapsed > 0 and threads > 0 else 0.0
+        return utilization
+
+    def print(self):
+        print(f"Processed {self.jobs} images in {self.elapsed:.1f} s ({self.imagesPerSecond():.1f} images/s), "
+              f"{self.outputs} outputs written ({self.outputsPerSecond():.1f} outputs/s).")
+        self.timings.print()
+        self.bufferPool.print()
+        if self.stageThreads is not None:
+            print("Utilization per pipeline stage (the busiest stage is the bottleneck):")
+            for (stage, value) in self.utilization().items():
+                print(f"  {stage:<18} {100.0 * value:>5.1f} %  ({self.stageThreads[stage][1]} threads)")
+        if len(self.errors) > 0:
+            print(f"{len(self.errors)} images failed:")
+            for (file, error) in self.errors:
+                print('[ERROR] error with {}\n file: {}'.format(file, error))
+                print('--------------------------------------------------')
+
+
+
+
+def _run_job(func, job):
+    active_writer().setSource(job[0])
+    try:
+        return (func(*job), None)
+    except Exception as e:
+        return (None, f"{type(e).__name__}: {e}")
+
+
+def _run_chunk(func, chunk):
+    results = [_run_job(func, job) for job in chunk]
+    return (results, flush_writer(), stage_timings().reset(), buffer_pool().resetStats())
+
+
+def _chunks(jobs, chunksize):
+    for i in range(0, len(jobs), chunksize):
+        yield jobs[i:i + chunksize]
+
+
+def run_jobs(func, jobs, workers = 1, chunksize = 16, desc = 'Processing', initializer = None, initargs = (), onResult = None):
+    """
+    Calls func(*job) for every job tuple in jobs and returns a JobSummary.
+
+    func must return the number of outputs it produced (or a list with one
+    count per output path, or a JobResult with them). With workers > 1 the jobs are executed in a
+    process pool, so func and the job arguments must be picklable (i.e. func
+    has to be a module level function). workers = 0
+    uses one worker process per available CPU. initializer(*initargs) is called
+    once in every process that executes jobs (e.g. configure_writer).
+    onResult(job, outputs, error) is called in this process for every
+    finished job, after the outputs of the job were written.
+    """
+    jobs = list(jobs)
+    if workers == 0:
+        workers = default_workers()
+    summary = JobSummary()
+    start = time.perf_counter()
+    progress = tqdm(total=len(jobs), desc=desc, unit='img')
+
+    if workers is None or workers <= 1:
+        initialize_worker(1, 1, initializer, initargs)
+        stage_timings().reset()
+        buffer_pool().resetStats()
+        for chunk in _chunks(jobs, max(1, chunksize)):
+            _add_chunk(chunk, _run_chunk(func, chunk), summary, progress, onResult)
+    else:
+        maxPending = workers * 2
+        pending = deque()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context(), initializer=initialize_worker,
+                                 initargs=(workers, 1, initializer, initargs)) as executor:
+            for chunk in _chunks(jobs, max(1, chunksize)):
+                if len(pending) >= maxPending:
+                    _collect(pending.popleft(), summary, progress, onResult)
+                pending.append((chunk, executor.submit(_run_chunk, func, chunk)))
+            while len(pending) > 0:
+                _collect(pending.popleft(), summary, progress, onResult)
+
+    progress.close()
+    summary.elapsed = time.perf_counter() - start
+    return summary
+
+
+def _collect(pendingChunk, summary, progress, onResult):
+    (chunk, future) = pendingChunk
+    try:
+        chunkResult = future.result()
+    except Exception as e:
+        # The worker process died (e.g. killed by the OOM killer), all jobs of this chunk are lost
+        chunkResult = ([(None, f"{type(e).__name__}: {e}")] * len(chunk), [], ({}, {}), BufferPoolStats())
+    _add_chunk(chunk, chunkResult, summary, progress, onResult)
+
+
+def _add_chunk(chunk, chunkResult, summary, progress, onResult):
+    (results, writeErrors, timings, poolStats) = chunkResult
+    # The first failed write of a source file fails its job
+    writeErrors = dict(reversed(writeErrors))
+    for job, (outputs, error) in zip(chunk, results):
+        if error is None:
+            error = writeErrors.get(job[0])
+        summary.add(job, outputs, error)
+        if onResult is not None:
+            onResult(job, outputs, error)
+    summary.timings.merge(timings)
+    summary.bufferPool.merge(poolStats)
+    progress.update(len(chunk))
+
+
+def run_pipeline(func, jobs, threads = 4, prefetch = None, prefetchThreads = 1, maxPrefetched = 16, desc = 'Processing',
+                 initializer = None, initargs = (), onResult = None):
+    """
+    Calls func(*job, prefetched=prefetch(job)) (or func(*job) without a
+    prefetch function) for every job tuple in jobs in a pipeline of threads
+    in this process and returns a JobSummary:
+      - prefetchThreads threads call prefetch(job), e.g. to read the input
+        files, and put the results into a queue of at most maxPrefetched jobs,
+      - threads worker threads call func, which hands its outputs to the
+        active writer (see output_writer),
+      - the writer threads encode and write the outputs.
+    Every stage blocks when the queue to the next stage is full. initializer
+    and onResult work like in run_jobs.
+    """
+    jobs = list(jobs)
+    summary = JobSummary()
+    start = time.perf_counter()
+    progress = tqdm(total=len(jobs), desc=desc, unit='img')
+    # The worker threads share the CPUs
+    initialize_worker(1, max(1, threads), initializer, initargs)
+    timings = stage_timings()
+    timings.reset()
+    buffer_pool().resetStats()
+    writer = active_writer()
+
+    pendingJobs = iter(jobs)
+    jobsLock = threading.Lock()
+    prefetched = queue.Queue(maxsize=max(1, maxPrefetched))
+    finished = queue.Queue()
+
+    def prefetchLoop():
+        while True:
+            with jobsLock:
+                job = next(pendingJobs, None)
+            if job is None:
+                return
+            (data, error) = (None, None)
+            if prefetch is not None:
+                try:
+                    with timings.measure('read'):
+                        data = prefetch(job)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+            prefetched.put((job, data, error))
+
+    def workLoop():
+        while True:
+            item = prefetched.get()
+            if item is None:
+                return
+            (job, data, error) = item
+            outputs = None
+            if error is None:
+                writer.setSource(job[0])
+                try:
+                    outputs = func(*job, prefetched=data) if prefetch is not None else func(*job)
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+            finished.put((job, outputs, error))
+
+    prefetchers = [threading.Thread(target=prefetchLoop, daemon=True) for _ in range(max(1, prefetchThreads))]
+    workers = [threading.Thread(target=workLoop, daemon=True) for _ in range(max(1, threads))]
+    for thread in prefetchers + workers:
+        thread.start()
+
+    for _ in range(len(jobs)):
+        (job, outputs, error) = finished.get()
+        # The result counts once all outputs of the job are written
+        writeErrors = writer.wait(job[0])
+        if error is None and len(writeErrors) > 0:
+            error = writeErrors[0]
+        summary.add(job, outputs, error)
+        if onResult is not None:
+            onResult(job, outputs, error)
+        progress.update(1)
+
+    for thread in prefetchers:
+        thread.join()
+    for _ in workers:
+        prefetched.put(None)
+    for thread in workers:
+        thread.join()
+    writer.flush()
+
+    progress.close()
+    summary.elapsed = time.perf_counter() - start
+    summary.timings.merge(timings.reset())
+    summary.bufferPool.merge(buffer_pool().resetStats())
+    summary.stageThreads = {
+        'read': (('read',), len(prefetchers) if prefetch is not None else 0),
+        'decode/transform': (('decode', 'transform'), len(workers)),
+        'encode/write': (('encode', 'write'), writer.threads),
+    }
+    return summary
+
+
+def default_workers():
+    return available_cpus()
+
+
+def pool_context():
+    # Fork server where available (POSIX), the default start method otherwise
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return None
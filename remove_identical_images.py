@@ -1,19 +1,38 @@
-from sys import argv
+import argparse
 import os
 from pathlib import Path
-from PIL import Image
-import imagehash
+from hash_index import near_duplicate_clusters
+from voc_merge import merge_annotations, MERGE_IOU
+from hash_cache import HashCache, image_fingerprints, default_cache_path, CACHE_FILE, HASH_ALGORITHMS
 
 
-IMAGE_FORMATS = ('.jpeg', '.JPEG', '.png', '.PNG', '.jpg', '.JPG')
+
+# Removes images that are identical to another image of the folder.
+#
+# Every image is hashed exactly once (perceptual hash, pHash by default, in
+# worker processes, see hash_cache), images with the same hash are grouped in
+# a dictionary. Of each group, one image is kept: the first annotated one
+# (with an XML file), otherwise the last one in the order of the folder walk,
+# as selectWhichOneToRemove decides pairwise. All other images of the group
+# are removed together with their XML files, after their boxes were merged
+# into the XML file of the kept image (see voc_merge).
+# Images that can't be decoded are reported and kept.
+#
+# With a threshold, near-duplicates are removed as well: images whose hashes
+# differ in at most threshold bits are found with the index of hash_index
+# (without comparing all pairs), images connected by a chain of such pairs
+# form one group. Only then, JPEG images can be decoded at reduced resolution
+# for hashing (--reduced_decode, see hash_cache): its hashes are a few bits
+# off, so identical images could get different hashes.
+#
+# The hashes are cached in a file in the folder (see hash_cache), so a later
+# run only hashes the images that were added or changed. Files that are
+# byte-identical to another one aren't decoded at all (prefilter by file size
+# and digest, see hash_cache).
 
 
-def compare(image1_path, image2_path):
-    with Image.open(image1_path) as img1:
-        hashing1 = imagehash.phash(img1)
-    with Image.open(image2_path) as img2:
-        hashing2 = imagehash.phash(img2)
-    return (hashing1 - hashing2) == 0
+
+IMAGE_FORMATS = ('.jpeg', '.JPEG', '.png', '.PNG', '.jpg', '.JPG')
 
 
 def selectWhichOneToRemove(image1_path, image2_path):
@@ -25,7 +44,16 @@ def selectWhichOneToRemove(image1_path, image2_path):
         return image2_path
     else:
         return image1_path
-    
+
+
+def selectWhichOneToKeep(group):
+    # Applies selectWhichOneToRemove to the survivor so far and the next image of the group
+    keep = group[0]
+    for image in group[1:]:
+        if selectWhichOneToRemove(keep, image) == keep:
+            keep = image
+    return keep
+
 
 def remove(image_file_path):
     file = Path(image_file_path)
@@ -38,28 +66,156 @@ def remove(image_file_path):
     print('Deleting file: ' + image_file_path)
 
 
+def collect_images(image_path):
+    images = []
+    for root, _, files in os.walk(image_path):
+        for file in files:
+            if file.endswith(IMAGE_FORMATS):
+                images.append(os.path.join(root, file))
+    return images
 
-image_path = os.getcwd()
-if (len(argv) >= 2):
-    image_path = argv[1]
-print('Folder: ' + image_path)
 
+def find_duplicates(images, progress = True, threshold = 0, cache = None, algorithm = 'phash', hash_size = 8, reduced = False, workers = 1,
+                    prefilter = True, counts = None):
+    """
+    Hashes every image once (or takes the hash from the cache, a HashCache)
+    and returns the groups of images with the same hash, or hashes within a
+    Hamming distance of threshold (lists of at least two images, in the order
+    of images), and the list of (image, error message) of the images that
+    couldn't be hashed. algorithm is one of HASH_ALGORITHMS. Byte-identical
+    files are only decoded once if prefilter, see image_fingerprints (also
+    for counts).
+    """
+    (fingerprints, errors) = image_fingerprints(images, cache, hash_size, reduced, workers, progress=progress, prefilter=prefilter, counts=counts)
+    hashed = list(fingerprints)
+    hashes = [getattr(fingerprints[image], algorithm) for image in hashed]
+    if threshold > 0:
+        clusters = near_duplicate_clusters(hashes, threshold, hash_size * hash_size)
+        return ([[hashed[index] for index in cluster] for cluster in clusters], errors)
+    groups = {}
+    for (image, key) in zip(hashed, hashes):
+        groups.setdefault(key, []).append(image)
+    return ([group for group in groups.values() if len(group) > 1], errors)
 
-IMAGE_FORMATS = ('.jpeg', '.JPEG', '.png', '.PNG', '.jpg', '.JPG')
 
-images = []
-for root, _, files in os.walk(image_path):
-    for file in files:
-        if file.endswith(IMAGE_FORMATS):
-            file_path = os.path.join(root, file)
-            images.append(file_path)
-
-deleteCounter = 0
-for img1 in images:
-    for img2 in images:
-        if (img1 is not img2 and os.path.isfile(img1) and os.path.isfile(img2)):
-            if (compare(img1, img2)):
-                remove(selectWhichOneToRemove(img1, img2))
-                deleteCounter += 1
-
-print(f'Detecting identical duplicates complete. {deleteCounter} images were removed.')
+def remove_duplicates(groups, merge_iou = MERGE_IOU):
+    """
+    Removes all images of every group except the one to keep and returns the
+    number of removed images and of boxes merged into the kept XML files.
+    Boxes of the removed images that overlap a box of the kept image by less
+    than merge_iou are merged, None doesn't merge any boxes.
+    """
+    deleteCounter = 0
+    mergeCounter = 0
+    for group in groups:
+        keep = selectWhichOneToKeep(group)
+        others = [image for image in group if image != keep]
+        if merge_iou is not None:
+            mergeCounter += merge_annotations(keep, others, merge_iou)
+        for image in others:
+            remove(image)
+            deleteCounter += 1
+    return (deleteCounter, mergeCounter)
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Remove identical images (same perceptual hash) and their annotations')
+    parser.add_argument(
+        'path',
+        help='Directory of the images (default: current directory)',
+        nargs='?',
+        default=os.getcwd()
+    )
+    parser.add_argument(
+        '-t', '--threshold',
+        help='Also remove near-duplicates: images whose hashes differ in at most this number of bits (default: 0, identical hashes only)',
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        '--hash',
+        help='Perceptual hash of the images (default: phash)',
+        choices=HASH_ALGORITHMS,
+        default='phash'
+    )
+    parser.add_argument(
+        '--hash_size',
+        help='Bits per side of the hash, i.e. the hash has hash_size * hash_size bits (default: 8)',
+        type=int,
+        default=8
+    )
+    parser.add_argument(
+        '--reduced_decode',
+        help='Decode JPEG images only at the size the hash needs (faster, but the hashes differ in a few bits, '
+             'so it needs a threshold of at least 1)',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--workers',
+        help='Number of worker processes for hashing (0 = one per CPU core, default: 0)',
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        '--merge_iou',
+        help=f'Boxes of a removed image are added to the XML file of the kept image unless they overlap a box of the same class with at least this IoU (default: {MERGE_IOU})',
+        type=float,
+        default=MERGE_IOU
+    )
+    parser.add_argument(
+        '--no_merge',
+        help='Remove the XML files of the removed images without merging their boxes',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--no_prefilter',
+        help='Decode byte-identical files as well, instead of comparing the file sizes and digests first',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--cache',
+        help=f'File of the hash cache (default: {CACHE_FILE} in the image directory)',
+        default=None
+    )
+    parser.add_argument(
+        '--no_cache',
+        help='Hash all images again, without reading or writing the hash cache',
+        action='store_true'
+    )
+    args = parser.parse_args()
+    if args.threshold < 0:
+        parser.error('The threshold must not be negative')
+    if args.hash_size < 2:
+        parser.error('The hash size must be at least 2')
+    if args.reduced_decode and args.threshold == 0:
+        parser.error('--reduced_decode needs a threshold of at least 1, identical images may get hashes that differ in a few bits')
+
+    image_path = args.path
+    print('Folder: ' + image_path)
+
+    images = collect_images(image_path)
+    cache = None if args.no_cache else HashCache(args.cache or default_cache_path(image_path))
+    try:
+        counts = {}
+        (groups, errors) = find_duplicates(images, threshold=args.threshold, cache=cache, algorithm=args.hash, hash_size=args.hash_size,
+                                           reduced=args.reduced_decode, workers=args.workers, prefilter=not args.no_prefilter, counts=counts)
+        for (image, error) in errors:
+            print(f"[ERROR] Could not hash {image}: {error}")
+        (deleteCounter, mergeCounter) = remove_duplicates(groups, None if args.no_merge else args.merge_iou)
+        if not args.no_merge:
+            print(f"{mergeCounter} boxes of removed images were merged into the XML files of the kept images")
+        if cache is not None:
+            print(f"Hash cache: {counts['cached']} of {len(images)} images were cached")
+        if not args.no_prefilter:
+            print(f"Byte-level prefilter: {counts['digested']} images digested, {counts['copies']} decodes saved by byte-identical copies, "
+                  f"{counts['decoded']} images decoded")
+        if cache is not None:
+            cache.prune(image_path, [image for image in images if os.path.exists(image)])
+    finally:
+        if cache is not None:
+            cache.close()
+
+    kind = 'identical' if args.threshold == 0 else 'near-identical'
+    print(f'Detecting {kind} duplicates complete. {deleteCounter} images were removed.')
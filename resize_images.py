@@ -26,13 +26,28 @@ Verwendung:
    - `-o` oder `--output`: (Optional) Das Zielverzeichnis, in das die skalierten Bilder und XML-Dateien gespeichert werden. Wenn nicht angegeben, wird das Eingabeverzeichnis überschrieben.
    - `-x` oder `--new_x`: (Optional) Die neue Breite der Bilder (Standard: 320).
    - `-y` oder `--new_y`: (Optional) Die neue Höhe der Bilder (Standard: 320).
+   - `-s` oder `--sizes`: (Optional) Kommagetrennte Liste von Zielgrößen, z. B. `320x320,448x448,640x640` (ersetzt `-x` und `-y`). Jedes Bild wird nur einmal dekodiert und jede Größe direkt aus dem dekodierten Bild skaliert (die Ausgaben sind dieselben wie bei einem eigenen Aufruf pro Größe), jede Größe wird in ein eigenes Unterverzeichnis des Zielverzeichnisses (z. B. `320x320`) geschrieben.
    - `-m` oder `--mode`: (Optional) Der Skalierungsmodus. Mögliche Werte: `size`, `scale`, `target`, `crop` (Standard: `size`).
+   - `--crop_windows`: (Optional) Anzahl der gleichmäßig verteilten Ausschnitte pro Bild im Modus `crop` (Standard: 2, d. h. Anfang und Ende des Bildes). Bei `0` werden so viele Ausschnitte erzeugt, dass auch sehr breite Panoramen vollständig abgedeckt sind. Das Bild wird dafür nur einmal skaliert.
+   - `-w` oder `--workers`: (Optional) Anzahl der parallelen Worker-Prozesse (Standard: 1, `0` = ein Prozess pro CPU-Kern).
+   - `--chunksize`: (Optional) Anzahl der Bilder, die einem Worker-Prozess auf einmal übergeben werden (Standard: 16).
+   - `-i` oder `--incremental`: (Optional) Nur neue und geänderte Bilder skalieren. Ein Manifest (`.resize_manifest.sqlite`) im Zielverzeichnis speichert pro Quellbild Größe, Änderungszeit, Hash, Parameter und die erzeugten Ausgaben. Ausgaben gelöschter Quellbilder werden entfernt, ein abgebrochener Lauf wird beim nächsten Aufruf fortgesetzt. Das Zielverzeichnis muss sich vom Eingabeverzeichnis unterscheiden.
+   - `--reduced_decode`: (Optional) Stark verkleinerte JPEG-Bilder direkt in 1/2, 1/4 oder 1/8 der Auflösung dekodieren (schneller, weniger Speicher). Die Ausgabebilder weichen dabei leicht von denen der vollen Dekodierung ab (gemessen: PSNR etwa 27 bis 41 dB, einzelne Pixel um bis zu 70 Stufen), daher werden JPEG-Bilder standardmäßig in voller Auflösung dekodiert.
+   - `--minimal_xml`: (Optional) Nur die Standard-VOC-Tags (folder, filename, path, size, object) in die XML-Dateien schreiben. Standardmäßig bleiben alle übrigen Tags der Quelldatei (z. B. segmented, source, owner) unverändert erhalten.
+   - `-t` oder `--threads`: (Optional) Anzahl der Threads, die bei einem einzelnen Worker-Prozess die Bilder dekodieren und skalieren (Standard: 4, `0` = keine Pipeline). Die Bilder laufen dabei durch eine Pipeline aus Vorauslesen der Dateien, Dekodieren/Skalieren und Kodieren/Schreiben; die Stufen sind durch begrenzte Warteschlangen verbunden, sodass der Speicherbedarf unabhängig von der Größe des Datensatzes bleibt.
+   - `--prefetch`: (Optional) Maximale Anzahl vorausgelesener Bilder der Pipeline (Standard: 16).
+   - `--writer_queue`: (Optional) Maximale Anzahl von Ausgabedateien, die auf die Schreib-Threads warten (Standard: 4 pro Schreib-Thread).
+   - `--jpeg_quality`, `--jpeg_optimize`, `--jpeg_progressive`, `--jpeg_subsampling`, `--png_level`, `--webp_quality`, `--webp_method`: (Optional) Einstellungen des Encoders für die Ausgabebilder (siehe `encoder_options.py`). Standardmäßig werden die Voreinstellungen von OpenCV verwendet.
+   - `--writer_threads`: (Optional) Anzahl der Threads pro Prozess, die die Ausgabedateien im Hintergrund kodieren und schreiben (Standard: 2, `0` = synchron schreiben).
+   - `--copy_unchanged`: (Optional) Bilder, die bereits die Zielgröße haben (aufrecht gespeichert, 3 Farbkanäle mit 8 Bit), werden nicht dekodiert und neu kodiert, sondern unverändert kopiert; nur Pfad, Dateiname und die kleingeschriebenen Labels der XML-Datei werden neu geschrieben. `copy` (Standard) nutzt Reflinks bzw. `copy_file_range`, wo das Dateisystem es erlaubt, `link` legt harte Links an (die Ausgabe ist dann dieselbe Datei wie die Quelle), `off` kodiert jedes Bild neu. Die Anzahl der kopierten Bilder wird am Ende ausgegeben.
+   - `--buffer_pool`: (Optional) Größe des Puffer-Pools pro Prozess in MB (Standard: 256, `0` = aus). Skalierte Bilder werden in wiederverwendete, nach Größe gruppierte Puffer geschrieben und nach dem Kodieren freigegeben, statt für jedes Bild neuen Speicher anzulegen. Trefferquote und Spitzenbedarf des Pools werden am Ende ausgegeben.
 
    Beispiel:
    python resize_images_and_annotations.py -p "/pfad/zum/dataset" -o "/pfad/zum/ausgabeverzeichnis" -x 480 -y 640 -m crop
 
 Ausgabe:
 - Das Skript skaliert alle Bilder und speichert sie zusammen mit den aktualisierten XML-Dateien im angegebenen Zielverzeichnis.
+- Am Ende werden Durchsatz (Bilder/s, Ausgaben/s), die Zeit pro Verarbeitungsschritt (Lesen, Dekodieren, Transformieren, Kodieren, Schreiben, Warten auf den Schreib-Thread), bei der Pipeline die Auslastung jeder Stufe (die am stärksten ausgelastete Stufe ist der Engpass) sowie alle fehlgeschlagenen Dateien mit ihrer Fehlermeldung ausgegeben.
 
 Hinweise:
 - Es werden nur Bilddateien mit den Erweiterungen .jpeg, .jpg, .png und .JPG verarbeitet.
@@ -54,10 +69,18 @@ from optparse import OptionParser
 import cv2
 import numpy as np
 import xml.etree.ElementTree as ET
-import copy
 from math import floor
 from pathlib import Path
 from PIL import Image
+from parallel_utils import run_jobs, run_pipeline
+from image_io import probe_image_size, reduction_for_scale, read_image, decoded_size_matches
+from image_backend import resize_image
+from image_header import read_header
+from buffer_pool import output_buffer, use_buffer, release_buffer, DEFAULT_MAX_BYTES
+from output_writer import active_writer, stage_timings, configure_writer
+from voc_writer import VocTemplate
+from encoder_options import add_encoder_arguments, encoder_from_args
+from resize_manifest import ResizeManifest
 
 
 def create_path(path):
@@ -76,35 +99,148 @@ def get_file_name(path):
     return (base_dir, file_name, ext)
 
 
-def process_image(file_path, output_path, x, y, mode):
+# Returns the number of images written for the given image file. Errors are
+# raised to the caller, which collects them per file (see parallel_utils).
+def process_image(file_path, output_path, x, y, mode, reduced_decode = False, compat_xml = True, crop_windows = 2, copy_unchanged = 'copy', prefetched = None):
     # (base_dir, file_name, ext) = get_file_name(file_path)
     # xml = os.path.join(base_dir, file_name + '.xml')
     xml_file = Path(file_path).with_suffix(".xml")
-    try:
-        resize(file_path, str(xml_file), (x, y), output_path, mode)
-    except Exception as e:
-        print('[ERROR] error with {}\n file: {}'.format(file_path, e))
-        print('--------------------------------------------------')
+    with stage_timings().measure('transform'):
+        return resize(file_path, str(xml_file), (x, y), output_path, mode, reduced_decode, compat_xml, crop_windows, prefetched, copy_unchanged)
 
 
-def resize(image_path, xml_path, newSize, output_path, mode):
+def process_image_sizes(file_path, output_paths, sizes, mode, reduced_decode = False, compat_xml = True, crop_windows = 2, copy_unchanged = 'copy', prefetched = None):
+    # Job function for several target sizes, returns the number of images written per size
+    xml_file = Path(file_path).with_suffix(".xml")
+    with stage_timings().measure('transform'):
+        return resize_sizes(file_path, str(xml_file), sizes, output_paths, mode, reduced_decode, compat_xml, crop_windows, prefetched, copy_unchanged)
+
+
+def read_source_files(job):
+    # Prefetch stage of the pipeline: returns the content of the image and the XML file of a job
+    xml_file = Path(job[0]).with_suffix(".xml")
+    with open(job[0], 'rb') as f:
+        image_data = f.read()
+    with open(xml_file, 'rb') as f:
+        xml_data = f.read()
+    return (image_data, xml_data)
+
+
+def read_source_image(image_path, source_size, scale, reduced_decode = False, image_data = None):
+    # Decodes JPEG images at 1/2, 1/4 or 1/8 resolution, if the image (with the full resolution
+    # size from the file header) is scaled down at least that much. Returns the decoded image
+    # and the full resolution size (width, height).
+    reduction = reduction_for_scale(scale, image_path) if reduced_decode else 1
+    image = read_image(image_path, reduction, image_data)
+    if not decoded_size_matches(image, source_size[0], source_size[1], reduction):
+        # The header doesn't describe the decoded image, fall back to a full decode
+        if reduction > 1:
+            image = read_image(image_path, 1, image_data)
+        source_size = (image.shape[1], image.shape[0])
+    return (image, source_size)
+
+
+def get_decode_scale(mode, newW, newH, srcW, srcH):
+    # The largest scale factor the mode applies, the image is never decoded smaller than needed for it
+    if mode == 'target':
+        return min(newW / srcW, newH / srcH)
+    elif mode is None or mode in ('size', 'scale', 'crop'):
+        return max(newW / srcW, newH / srcH)
+    return 1.0
+
+
+def resize(image_path, xml_path, newSize, output_path, mode, reduced_decode = False, compat_xml = True, crop_windows = 2, prefetched = None, copy_unchanged = 'copy'):
+    return resize_sizes(image_path, xml_path, [newSize], [output_path], mode, reduced_decode, compat_xml, crop_windows, prefetched, copy_unchanged)[0]
+
+
+def resize_sizes(image_path, xml_path, sizes, output_paths, mode, reduced_decode = False, compat_xml = True, crop_windows = 2, prefetched = None, copy_unchanged = 'copy'):
+    """
+    Resizes the image to every size (x, y) in sizes and writes the outputs of
+    each size to its path in output_paths. The image is decoded only once.
+    Every size is scaled from the decoded image (not from the output of a
+    larger size), so the outputs are the same as those of a separate run per
+    size.
+    If the image already has the output size of a size, its file is copied
+    instead (copy_unchanged: 'copy', 'link' to allow hard links or 'off').
+    Returns the number of outputs per size.
+    """
     (base_dir, file_name, ext) = get_file_name(image_path)
-    image = cv2.imread(image_path)
-    xmlRoot = ET.parse(xml_path).getroot()
+    # prefetched is the content of the image and the XML file, if they were already read (see read_source_files)
+    (image_data, xml_data) = prefetched if prefetched is not None else (None, None)
+    # The XML files of all outputs are rendered from one template of the source XML file
+    xmlRoot = ET.parse(xml_path).getroot() if xml_data is None else ET.fromstring(xml_data)
+    xmlTemplate = VocTemplate(xmlRoot, compat_xml)
+    mode = mode and mode.lower()
+
+    header = read_header(image_path, image_data) if copy_unchanged != 'off' else None
+    (srcW, srcH) = header.size() if header is not None else probe_image_size(image_path, image_data)
+    counts = [0] * len(sizes)
+    resized = []
+    for (index, size) in enumerate(sizes):
+        output_path = output_paths[index] if output_paths[index] is not None else image_path
+        if is_unchanged(header, mode, size):
+            counts[index] = copy_source(image_path, xmlTemplate, file_name, ext, (srcW, srcH), output_path, copy_unchanged == 'link')
+        else:
+            resized.append(index)
+    if len(resized) == 0:
+        return counts
+
+    decode_scales = [get_decode_scale(mode, float(x), float(y), srcW, srcH) for (x, y) in sizes]
+    with stage_timings().measure('decode'):
+        (image, source_size) = read_source_image(image_path, (srcW, srcH), max(decode_scales[index] for index in resized), reduced_decode, image_data)
 
-    imgW = float(image.shape[1])
-    imgH = float(image.shape[0])
+    scaled_images = []
+    try:
+        for index in resized:
+            output_path = output_paths[index] if output_paths[index] is not None else image_path
+            (counts[index], scaled) = resize_to_size(image, source_size, xmlTemplate, file_name, ext, sizes[index], output_path, mode, crop_windows)
+            scaled_images.append(scaled)
+    finally:
+        # The scaled images are buffers of the buffer pool, the writer keeps its own lease until they are encoded
+        for scaled in scaled_images:
+            release_buffer(scaled)
+    return counts
+
+
+def is_unchanged(header, mode, size):
+    """
+    True if the mode writes the image described by the file header unchanged
+    for the output size (x, y): it has that size (or in the modes scale and
+    target, it is scaled by 1), is stored upright (no EXIF rotation) and has
+    3 color channels of 8 bits, like the images written by this script.
+    """
+    if header is None or header.orientation != 1 or header.channels != 3 or header.bitDepth != 8:
+        return False
+    (x, y) = size
+    if mode in ('scale', 'target'):
+        return get_decode_scale(mode, float(x), float(y), header.width, header.height) == 1.0
+    return (header.width, header.height) == (int(x), int(y))
+
+
+def copy_source(image_path, xmlTemplate, file_name, ext, source_size, output_path, link = False):
+    # Copies the image file (see file_copy) instead of decoding and encoding it, the XML file
+    # is rendered like for a resized image with scale 1. Returns the number of outputs.
+    (imgW, imgH) = source_size
+    active_writer().copyFile(os.path.join(output_path, file_name + '.' + ext), image_path, link)
+    active_writer().writeBytes(os.path.join(output_path, file_name + '.xml'), render_window_xml(xmlTemplate, file_name, ext, imgW, imgH, 1.0, 1.0, 0, 0, output_path))
+    stage_timings().count('copied')
+    return 1
+
+
+def resize_to_size(image, source_size, xmlTemplate, file_name, ext, newSize, output_path, mode, crop_windows = 2):
+    # image is the decoded source image or a scaled version of it, source_size the full resolution size
+    # of the source image. Returns the number of outputs and the scaled image the outputs were cut from.
     newW = float(newSize[0])
     newH = float(newSize[1])
+    imgW = float(source_size[0])
+    imgH = float(source_size[1])
     scaleX = newW / imgW
     scaleY = newH / imgH
 
-    if output_path is None:
-        output_path = image_path
-    mode = mode and mode.lower()
     # Standard resize mode
     if mode is None or mode == 'size':
-        resize_and_save_internal(image, xmlRoot, file_name, ext, int(newW), int(newH), scaleX, scaleY, 0, 0, output_path)
+        scaled = resize_and_save_internal(image, xmlTemplate, file_name, ext, int(newW), int(newH), scaleX, scaleY, 0, 0, output_path, source_size)
+        return (1, scaled)
     else:
         # Scaling mode: choose the correct scale to reach one of the x/y targets without undersize
         if mode == 'scale':
@@ -114,7 +250,8 @@ def resize(image_path, xml_path, newSize, output_path, mode):
             else:
                 scaleY = scaleX
                 newH = scaleY * imgH
-            resize_and_save_internal(image, xmlRoot, file_name, ext, int(newW), int(newH), scaleX, scaleY, 0, 0, output_path)
+            scaled = resize_and_save_internal(image, xmlTemplate, file_name, ext, int(newW), int(newH), scaleX, scaleY, 0, 0, output_path, source_size)
+            return (1, scaled)
         # Target mode: choose the correct scale to reach one of the x/y targets without oversize
         elif mode == 'target':
             if scaleY < scaleX:
@@ -123,81 +260,96 @@ def resize(image_path, xml_path, newSize, output_path, mode):
             else:
                 scaleY = scaleX
                 newH = scaleY * imgH
-            resize_and_save_internal(image, xmlRoot, file_name, ext, int(newW), int(newH), scaleX, scaleY, 0, 0, output_path)
+            scaled = resize_and_save_internal(image, xmlTemplate, file_name, ext, int(newW), int(newH), scaleX, scaleY, 0, 0, output_path, source_size)
+            return (1, scaled)
         # Crop mode: first, scale down to reach larger x/y edge size without undersize, afterwards check if crop is needed and split the image into parts
         elif mode == 'crop':
+            # The image is scaled only once, all crop windows are slices of the scaled image
             if scaleY > scaleX:
                 scaleX = scaleY
-                tX = int(scaleX * imgW - newW)
-                resize_and_save_internal(image, xmlRoot, file_name + '_1', ext, int(newW), int(newH), scaleX, scaleY, tX, 0, output_path)
-                resize_and_save_internal(image, xmlRoot, file_name, ext, int(newW), int(newH), scaleX, scaleY, 0, 0, output_path)
+                offsets = [(tX, 0) for tX in crop_window_offsets(scaleX * imgW - newW, newW, crop_windows)]
             elif scaleX > scaleY:
                 scaleY = scaleX
-                tY = int(scaleY * imgH - newH)
-                resize_and_save_internal(image, xmlRoot, file_name + '_1', ext, int(newW), int(newH), scaleX, scaleY, 0, tY, output_path)
-                resize_and_save_internal(image, xmlRoot, file_name, ext, int(newW), int(newH), scaleX, scaleY, 0, 0, output_path)
+                offsets = [(0, tY) for tY in crop_window_offsets(scaleY * imgH - newH, newH, crop_windows)]
             else:
-                resize_and_save_internal(image, xmlRoot, file_name, ext, int(newW), int(newH), scaleX, scaleY, 0, 0, output_path)
+                offsets = [(0, 0)]
+            scaled = scale_source_image(image, scaleX, scaleY, source_size)
+            for (index, (tX, tY)) in enumerate(offsets):
+                window_name = file_name if index == 0 else f"{file_name}_{index}"
+                save_window(scaled, xmlTemplate, window_name, ext, int(newW), int(newH), scaleX, scaleY, tX, tY, output_path)
+            return (len(offsets), scaled)
         else:
             raise Exception(f"Invalid resize mode: {mode}")
 
 
-def resize_and_save_internal(image, origXmlRoot, file_name, ext, newW, newH, scaleX, scaleY, tX, tY, output_path):
+def crop_window_offsets(overhang, window_size, windows = 2):
+    # Offsets of evenly spaced crop windows along the axis on which the scaled image is overhang pixels
+    # larger than the window. The first and the last window are at both ends. windows = 0 uses as many
+    # windows as needed for neighbouring windows to overlap by at least half of their size, so every
+    # object up to half the window size is completely inside one of them.
+    max_offset = int(overhang)
+    if windows == 0:
+        windows = max(2, int(np.ceil(2.0 * overhang / window_size)) + 1)
+    if windows < 2:
+        return [0]
+    return [index * max_offset // (windows - 1) for index in range(windows)]
+
+
+def scale_source_image(image, scaleX, scaleY, source_size = None):
+    # The scaled image is a buffer of the buffer pool, the caller releases it (see resize_sizes)
     interp = cv2.INTER_LINEAR if (scaleX * scaleY > 1.0) else cv2.INTER_AREA
-    image = cv2.resize(src=image, dsize=(0, 0), dst=None, fx=scaleX, fy=scaleY, interpolation=interp)
-    # image = cv2.resize(src=image, dsize=(newW, newH))
+    if source_size is None or tuple(source_size) == (image.shape[1], image.shape[0]):
+        dst = output_buffer(image, int(round(image.shape[1] * scaleX)), int(round(image.shape[0] * scaleY)))
+        return use_buffer(dst, resize_image(image, (0, 0), interp, fx=scaleX, fy=scaleY, dst=dst))
+    # The image was decoded at reduced resolution, scale it to the size the full resolution image would get
+    dsize = (int(round(source_size[0] * scaleX)), int(round(source_size[1] * scaleY)))
+    dst = output_buffer(image, *dsize)
+    return use_buffer(dst, resize_image(image, dsize, interp, dst=dst))
+
+
+def resize_and_save_internal(image, xmlTemplate, file_name, ext, newW, newH, scaleX, scaleY, tX, tY, output_path, source_size = None):
+    # Returns the scaled image
+    image = scale_source_image(image, scaleX, scaleY, source_size)
+    save_window(image, xmlTemplate, file_name, ext, newW, newH, scaleX, scaleY, tX, tY, output_path)
+    return image
+
+
+def save_window(image, xmlTemplate, file_name, ext, newW, newH, scaleX, scaleY, tX, tY, output_path):
+    # Writes the window (tX, tY, newW, newH) of the scaled image as a slice (no copy) together with its XML file
     imgW = image.shape[1]
     imgH = image.shape[0]
     if (imgW != newW or tX > 0 or imgH != newH or tY > 0):
         image = image[tY:newH+tY, tX:newW+tX]
+    xml = render_window_xml(xmlTemplate, file_name, ext, newW, newH, scaleX, scaleY, tX, tY, output_path)
 
-    xmlRoot = copy.deepcopy(origXmlRoot)
-    xmlRoot.find('filename').text = str(file_name + '.' + ext)
-    xmlRoot.find('path').text = str(os.path.join(output_path, file_name + '.' + ext))
-
-    size_node = xmlRoot.find('size')
-    size_node.find('width').text = str(newW)
-    size_node.find('height').text = str(newH)
-
-    for xmlObject in xmlRoot.findall('object'):
-        name = xmlObject.find('name')
-        name.text = name.text.lower()
-
-        bndbox = xmlObject.find('bndbox')
-        xmin = bndbox.find('xmin')
-        ymin = bndbox.find('ymin')
-        xmax = bndbox.find('xmax')
-        ymax = bndbox.find('ymax')
-        
-        xminFloat = float(xmin.text)
-        yminFloat = float(ymin.text)
-        xmaxFloat = float(xmax.text)
-        ymaxFloat = float(ymax.text)
-
-        xminInt = clamp(int(np.round(xminFloat * scaleX)) - tX, 0, newW)
-        yminInt = clamp(int(np.round(yminFloat * scaleY)) - tY, 0, newH)
-        xmaxInt = clamp(int(np.round(xmaxFloat * scaleX)) - tX, 0, newW)
-        ymaxInt = clamp(int(np.round(ymaxFloat * scaleY)) - tY, 0, newH)
-        
-        if (xminInt == newW or xmaxInt == 0 or yminInt == newH or ymaxInt == 0):
-            xmlRoot.remove(xmlObject)
-        else:
-            xmin.text = str(xminInt)
-            ymin.text = str(yminInt)
-            xmax.text = str(xmaxInt)
-            ymax.text = str(ymaxInt)
+    # Encoding and writing is done asynchronously by the writer threads
+    active_writer().writeImage(os.path.join(output_path, file_name + '.' + ext), image)
+    active_writer().writeBytes(os.path.join(output_path, file_name + '.xml'), xml)
 
-    cv2.imwrite(os.path.join(output_path, file_name + '.' + ext), image)
 
-    tree = ET.ElementTree(xmlRoot)
-    tree.write(os.path.join(output_path, file_name + '.xml'))
+def render_window_xml(xmlTemplate, file_name, ext, newW, newH, scaleX, scaleY, tX, tY, output_path):
+    # Scale, translate and clamp all boxes at once, objects outside of the image are dropped
+    boxes = np.round(xmlTemplate.boxes * (scaleX, scaleY, scaleX, scaleY)).astype(np.int64) - (tX, tY, tX, tY)
+    boxes = np.clip(boxes, 0, (newW, newH, newW, newH))
+    outside = (boxes[:, 0] == newW) | (boxes[:, 2] == 0) | (boxes[:, 1] == newH) | (boxes[:, 3] == 0)
+    xmlObjects = [None if outside[index] else xmlObject.render(xmlObject.name.lower(), *boxes[index])
+                  for (index, xmlObject) in enumerate(xmlTemplate.objects)]
+    return xmlTemplate.render(file_name + '.' + ext, os.path.join(output_path, file_name + '.' + ext), newW, newH, sourceObjects=xmlObjects)
 
 
 
 
 IMAGE_FORMATS = ('.jpeg', '.JPEG', '.png', '.PNG', '.jpg', '.JPG')
 
-def resize_all(inPath, outPath, x, y, mode = 'size'):
+def open_manifest(inPath, outPath, params):
+    if os.path.abspath(inPath) == os.path.abspath(outPath):
+        raise ValueError('Incremental runs need an output path different from the input path')
+    create_path(outPath)
+    return ResizeManifest(inPath, outPath, params)
+
+
+def collect_resize_jobs(inPath, outPath, x, y, mode, reduced_decode = False, compat_xml = True, crop_windows = 2, copy_unchanged = 'copy'):
+    jobs = []
     create_path(outPath)
     for root, _, files in os.walk(inPath):
             out_path = outPath + root[len(inPath):]
@@ -206,65 +358,260 @@ def resize_all(inPath, outPath, x, y, mode = 'size'):
             for file in files:
                 if file.endswith(IMAGE_FORMATS):
                     file_path = os.path.join(root, file)
-                    process_image(file_path, out_path, x, y, mode)
-    print('Complete.')
+                    jobs.append((file_path, out_path, x, y, mode, reduced_decode, compat_xml, crop_windows, copy_unchanged))
+    return jobs
+
+
+def size_folder_name(size):
+    return f"{int(size[0])}x{int(size[1])}"
+
+
+def collect_multi_size_jobs(inPath, outPath, sizes, mode, reduced_decode = False, compat_xml = True, crop_windows = 2, copy_unchanged = 'copy'):
+    # Every size gets its own output subtree <outPath>/<x>x<y>/..., one job per source image covers all sizes
+    jobs = []
+    size_paths = [os.path.join(outPath, size_folder_name(size)) for size in sizes]
+    for size_path in size_paths:
+        create_path(size_path)
+    for root, dirs, files in os.walk(inPath):
+            # Don't resize the outputs again, if they are written into the input directory
+            dirs[:] = [dir for dir in dirs if os.path.join(root, dir) not in size_paths]
+            out_paths = [size_path + root[len(inPath):] for size_path in size_paths]
+            for out_path in out_paths:
+                create_path(out_path)
+
+            for file in files:
+                if file.endswith(IMAGE_FORMATS):
+                    file_path = os.path.join(root, file)
+                    jobs.append((file_path, out_paths, sizes, mode, reduced_decode, compat_xml, crop_windows, copy_unchanged))
+    return jobs
 
 
+def parse_sizes(value):
+    # "320x320,448x448" -> [(320, 320), (448, 448)]
+    sizes = []
+    for item in value.split(','):
+        (x, y) = item.strip().lower().split('x')
+        sizes.append((int(x), int(y)))
+    return sizes
 
 
-parser = argparse.ArgumentParser()
-
-parser.add_argument(
-    '-p',
-    '--path',
-    dest='dataset_path',
-    help='Path to dataset (images and annotations)',
-    default='.',
-    required=False
-)
-parser.add_argument(
-    '-o',
-    '--output',
-    dest='output_path',
-    help='Output path for resized dataset (might be left empty, then the input will be overwritten)',
-    default='.',
-    required=False
-)
-parser.add_argument(
-    '-x',
-    '--new_x',
-    dest='x',
-    help='The new x images size',
-    default=320,
-    required=False
-)
-parser.add_argument(
-    '-y',
-    '--new_y',
-    dest='y',
-    help='The new y images size',
-    default=320,
-    required=False
-)
-parser.add_argument(
-    '-m',
-    '--mode',
-    dest='mode',
-    help='Resize mode: size, scale, target, or crop',
-    required=False
-)
-
-
-
-args = parser.parse_args()
-
-input_path = args.dataset_path
-output_path = args.output_path
-
-if input_path is None or input_path == '.':
-    input_path = os.getcwd()
-
-if output_path is None or output_path == '.':
-    output_path = input_path
-
-resize_all(input_path, output_path, args.x, args.y, args.mode)
+def resize_all(inPath, outPath, x, y, mode = 'size', workers = 1, chunksize = 16, reduced_decode = False, writer_threads = 2, incremental = False, compat_xml = True, crop_windows = 2,
+               threads = 4, prefetch = 16, writer_queue = None, sizes = None, encoder = None, pool_bytes = DEFAULT_MAX_BYTES, copy_unchanged = 'copy'):
+    # With a list of sizes, x and y are ignored and every image is decoded once for all sizes
+    if sizes:
+        job_func = process_image_sizes
+        jobs = collect_multi_size_jobs(inPath, outPath, sizes, mode, reduced_decode, compat_xml, crop_windows, copy_unchanged)
+    else:
+        job_func = process_image
+        jobs = collect_resize_jobs(inPath, outPath, x, y, mode, reduced_decode, compat_xml, crop_windows, copy_unchanged)
+    manifest = None
+    if incremental:
+        if sizes:
+            params = {'sizes': [list(size) for size in sizes], 'mode': (mode or 'size').lower()}
+        else:
+            params = {'x': int(x), 'y': int(y), 'mode': (mode or 'size').lower()}
+        if not compat_xml:
+            params['xml'] = 'minimal'
+        if params['mode'] == 'crop' and crop_windows != 2:
+            params['crop_windows'] = crop_windows
+        if encoder is not None and not encoder.isDefault():
+            params['encoder'] = encoder.toDict()
+        if copy_unchanged == 'off':
+            params['copy_unchanged'] = 'off'
+        manifest = open_manifest(inPath, outPath, params)
+        jobs = manifest.plan(jobs)
+        job_func = manifest.job(job_func)
+    onResult = manifest.record if manifest is not None else None
+    try:
+        if workers == 1 and threads > 0:
+            # Streaming pipeline in this process: read ahead -> decode and transform -> encode and write
+            summary = run_pipeline(job_func, jobs, threads, read_source_files, maxPrefetched=prefetch, desc='Resizing',
+                                   initializer=configure_writer, initargs=(writer_threads, writer_queue, encoder, pool_bytes), onResult=onResult)
+        else:
+            summary = run_jobs(job_func, jobs, workers, chunksize, desc='Resizing', initializer=configure_writer, initargs=(writer_threads, writer_queue, encoder, pool_bytes),
+                               onResult=onResult)
+    finally:
+        if manifest is not None:
+            manifest.close()
+    summary.print()
+    if manifest is not None:
+        manifest.print()
+    print('Complete.')
+    return summary
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-p',
+        '--path',
+        dest='dataset_path',
+        help='Path to dataset (images and annotations)',
+        default='.',
+        required=False
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        dest='output_path',
+        help='Output path for resized dataset (might be left empty, then the input will be overwritten)',
+        default='.',
+        required=False
+    )
+    parser.add_argument(
+        '-x',
+        '--new_x',
+        dest='x',
+        help='The new x images size',
+        default=320,
+        required=False
+    )
+    parser.add_argument(
+        '-y',
+        '--new_y',
+        dest='y',
+        help='The new y images size',
+        default=320,
+        required=False
+    )
+    parser.add_argument(
+        '-s',
+        '--sizes',
+        dest='sizes',
+        help='Comma separated list of target sizes, e.g. 320x320,448x448,640x640 (overrides -x and -y, every image is decoded once and every size is scaled from the decoded image and written to its own sub directory of the output path)',
+        default=None,
+        required=False
+    )
+    parser.add_argument(
+        '-m',
+        '--mode',
+        dest='mode',
+        help='Resize mode: size, scale, target, or crop',
+        required=False
+    )
+    parser.add_argument(
+        '--crop_windows',
+        dest='crop_windows',
+        help='Number of evenly spaced crop windows per image in crop mode (0 = as many as needed to cover the whole image, default: 2)',
+        type=int,
+        default=2,
+        required=False
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        dest='workers',
+        help='Number of worker processes (0 = one per CPU core, default: 1)',
+        type=int,
+        default=1,
+        required=False
+    )
+    parser.add_argument(
+        '--chunksize',
+        dest='chunksize',
+        help='Number of images submitted to a worker process at once (default: 16)',
+        type=int,
+        default=16,
+        required=False
+    )
+    parser.add_argument(
+        '--reduced_decode',
+        dest='reduced_decode',
+        help='Decode JPEGs at 1/2, 1/4 or 1/8 resolution if they are scaled down at least that much (faster, '
+             'but the output pixels can differ by a few percent from those of the full decode)',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-i',
+        '--incremental',
+        dest='incremental',
+        help='Only resize new and changed images (tracked in a manifest in the output path), remove the outputs of deleted images',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--minimal_xml',
+        dest='minimal_xml',
+        help='Only write the standard VOC tags (folder, filename, path, size, object) to the XML files, other tags like segmented, source or owner are dropped',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-t',
+        '--threads',
+        dest='threads',
+        help='Number of decode/transform threads of the streaming pipeline, used with a single worker process (0 = no pipeline, default: 4)',
+        type=int,
+        default=4,
+        required=False
+    )
+    parser.add_argument(
+        '--prefetch',
+        dest='prefetch',
+        help='Maximum number of images read ahead by the streaming pipeline (default: 16)',
+        type=int,
+        default=16,
+        required=False
+    )
+    parser.add_argument(
+        '--writer_queue',
+        dest='writer_queue',
+        help='Maximum number of output files waiting for the writer threads (default: 4 per writer thread)',
+        type=int,
+        default=None,
+        required=False
+    )
+    parser.add_argument(
+        '--writer_threads',
+        dest='writer_threads',
+        help='Number of threads per process encoding and writing the output files (0 = write synchronously, default: 2)',
+        type=int,
+        default=2,
+        required=False
+    )
+    parser.add_argument(
+        '--copy_unchanged',
+        dest='copy_unchanged',
+        help='Images that already have the output size are copied instead of decoded and encoded again: copy (reflink or in-kernel copy where the file '
+             'system supports it), link (hard link, the output is the same file as the source) or off (default: copy)',
+        choices=['copy', 'link', 'off'],
+        default='copy',
+        required=False
+    )
+    parser.add_argument(
+        '--buffer_pool',
+        dest='buffer_pool',
+        help='Size of the image buffer pool per process in MB (0 = off, default: 256)',
+        type=int,
+        default=DEFAULT_MAX_BYTES // 2**20,
+        required=False
+    )
+    add_encoder_arguments(parser)
+
+
+
+    args = parser.parse_args()
+
+    input_path = args.dataset_path
+    output_path = args.output_path
+
+    if input_path is None or input_path == '.':
+        input_path = os.getcwd()
+
+    if output_path is None or output_path == '.':
+        output_path = input_path
+
+    if args.crop_windows < 0 or args.crop_windows == 1:
+        parser.error('--crop_windows must be 0 or at least 2')
+
+    sizes = None
+    if args.sizes is not None:
+        try:
+            sizes = parse_sizes(args.sizes)
+        except ValueError:
+            parser.error(f"Invalid list of sizes: {args.sizes} (expected e.g. 320x320,448x448)")
+
+    resize_all(input_path, output_path, args.x, args.y, args.mode, args.workers, args.chunksize, args.reduced_decode, args.writer_threads, args.incremental, not args.minimal_xml, args.crop_windows,
+               args.threads, args.prefetch, args.writer_queue, sizes, encoder_from_args(args), args.buffer_pool * 2**20,
+               args.copy_unchanged)
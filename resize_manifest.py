@@ -0,0 +1,185 @@
+import os, json, hashlib, sqlite3
+from parallel_utils import JobResult
+
+
+
+# Manifest for incremental and resumable resize runs.
+#
+# The manifest is a SQLite database in the output directory. It has one entry
+# per source image that was resized successfully, with the size, mtime and
+# content hash of the image and its XML annotation, the resize parameters
+# and the output files written for it. A later run into the same output
+# directory
+#  - skips sources that are unchanged and were resized with the same
+#    parameters,
+#  - deletes the old outputs of changed sources and resizes them again,
+#  - deletes the outputs of sources that don't exist anymore.
+#
+# Entries are only added after the outputs of a source are on disk and are
+# committed in small batches, so a killed run continues with the sources that
+# were not finished (at most the last batch is resized again).
+#
+# Planning a run only stats the sources. The content hash of a new or changed
+# source is computed by its job (see ManifestJob), in the worker that reads
+# the files for resizing anyway, and recorded with its outputs. Only a source
+# whose mtime changed is hashed while planning, to skip it if its content is
+# still the same.
+
+
+
+MANIFEST_FILE_NAME = '.resize_manifest.sqlite'
+
+COMMIT_INTERVAL = 100
+
+
+def source_files(imageFile):
+    # The image file and its XML annotation (if present)
+    xmlFile = os.path.splitext(imageFile)[0] + '.xml'
+    return [imageFile, xmlFile] if os.path.exists(xmlFile) else [imageFile]
+
+
+def source_state(imageFile, contents = None):
+    """
+    Returns (size, mtime, hash) of the image file and its XML annotation. The
+    size is the sum and the mtime the latest of both files, the hash covers the
+    content of both files. If the files were already read, their content can
+    be passed as contents (in the order of source_files).
+    """
+    files = source_files(imageFile)
+    (size, mtime) = stat_state(files)
+    digest = hashlib.blake2b(digest_size=16)
+    if contents is not None:
+        for data in contents:
+            digest.update(data)
+        return (size, mtime, digest.hexdigest())
+    for file in files:
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return (size, mtime, digest.hexdigest())
+
+
+def stat_state(files):
+    stats = [os.stat(file) for file in files]
+    return (sum(stat.st_size for stat in stats), max(stat.st_mtime_ns for stat in stats))
+
+
+def output_files(imageFile, outputPath, count):
+    # The resize scripts name their outputs <name>, <name>_1, <name>_2, ... (each with an XML file)
+    (file_name, ext) = os.path.splitext(os.path.basename(imageFile))
+    names = [file_name if index == 0 else f"{file_name}_{index}" for index in range(count)]
+    outputs = []
+    for name in names:
+        outputs.append(os.path.join(outputPath, name + ext))
+        outputs.append(os.path.join(outputPath, name + '.xml'))
+    return outputs
+
+
+class ManifestJob:
+    """
+    Job function (see parallel_utils) that calls func and returns its outputs
+    together with the source state of the job's image (see source_state) as
+    JobResult, for ResizeManifest.record. The files are hashed in the process
+    that runs the job; content that the pipeline already read (prefetched) is
+    hashed without reading the files again.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, *job, **kwargs):
+        prefetched = kwargs.get('prefetched')
+        # Stat and hash before resizing: a source changed in the meantime is resized again by the next run
+        state = source_state(job[0], prefetched)
+        return JobResult(self.func(*job, **kwargs), state)
+
+
+class ResizeManifest:
+    def __init__(self, inPath, outPath, params):
+        self.inPath = inPath
+        self.outPath = outPath
+        self.params = json.dumps(params, sort_keys=True)
+        self.skipped = 0
+        self.changed = 0
+        self.removed = 0
+        self._uncommitted = 0
+        self.db = sqlite3.connect(os.path.join(outPath, MANIFEST_FILE_NAME))
+        self.db.execute("CREATE TABLE IF NOT EXISTS sources ("
+                        "source TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, hash TEXT, params TEXT, outputs TEXT)")
+        self.db.commit()
+
+    def _key(self, imageFile):
+        return os.path.relpath(imageFile, self.inPath)
+
+    def _removeOutputs(self, outputs):
+        for output in json.loads(outputs):
+            try:
+                os.remove(os.path.join(self.outPath, output))
+            except FileNotFoundError:
+                pass
+
+    def job(self, func):
+        # Job function to run the planned jobs with, it returns the source state for record
+        return ManifestJob(func)
+
+    def plan(self, jobs):
+        """
+        Returns the jobs that have to be run (with the job function of job).
+        Jobs of unchanged sources are dropped, the outputs of changed and
+        deleted sources are removed.
+        """
+        entries = {row[0]: row[1:] for row in self.db.execute("SELECT source, size, mtime, hash, params, outputs FROM sources")}
+        todo = []
+        for job in jobs:
+            imageFile = job[0]
+            key = self._key(imageFile)
+            entry = entries.pop(key, None)
+            if entry is not None:
+                (size, mtime, digest, params, outputs) = entry
+                if params == self.params and stat_state(source_files(imageFile)) == (size, mtime):
+                    self.skipped += 1
+                    continue
+                state = source_state(imageFile)
+                if params == self.params and state[2] == digest:
+                    # Only touched, the content didn't change
+                    self.db.execute("UPDATE sources SET size = ?, mtime = ? WHERE source = ?", (state[0], state[1], key))
+                    self.skipped += 1
+                    continue
+                self._removeOutputs(outputs)
+                self.db.execute("DELETE FROM sources WHERE source = ?", (key,))
+                self.changed += 1
+            todo.append(job)
+
+        # The remaining entries belong to deleted source files
+        for (key, (size, mtime, digest, params, outputs)) in entries.items():
+            self._removeOutputs(outputs)
+            self.db.execute("DELETE FROM sources WHERE source = ?", (key,))
+            self.removed += 1
+        self.db.commit()
+        return todo
+
+    def record(self, job, outputs, error):
+        # Called for every finished job (see run_jobs) with the JobResult of ManifestJob, only successful jobs are added
+        if error is not None:
+            return
+        (outputs, (size, mtime, digest)) = outputs
+        if isinstance(job[1], (list, tuple)):
+            # Job with several output paths and one count per path
+            files = [file for (outputPath, count) in zip(job[1], outputs or []) for file in output_files(job[0], outputPath, count)]
+        else:
+            files = output_files(job[0], job[1], outputs or 0)
+        files = [os.path.relpath(file, self.outPath) for file in files]
+        self.db.execute("INSERT OR REPLACE INTO sources (source, size, mtime, hash, params, outputs) VALUES (?, ?, ?, ?, ?, ?)",
+                        (self._key(job[0]), size, mtime, digest, self.params, json.dumps(files)))
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_INTERVAL:
+            self.db.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def print(self):
+        print(f"Manifest: {self.skipped} unchanged images skipped, {self.changed} changed images resized again, "
+              f"outputs of {self.removed} deleted images removed.")
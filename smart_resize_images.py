@@ -1,13 +1,24 @@
-import os
+import os, random, time
 import argparse
 from optparse import OptionParser
 import cv2
 import numpy as np
 import xml.etree.ElementTree as ET
-import copy
 from math import floor
 from pathlib import Path
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
+from parallel_utils import run_jobs, default_workers, pool_context
+from concurrency import initialize_worker
+from box_array import BoxArray
+from image_io import probe_image_size, reduction_for_scale, reduced_size, read_image, decoded_size_matches
+from image_backend import resize_image, encode_image
+from buffer_pool import output_buffer, use_buffer, release_buffer, DEFAULT_MAX_BYTES
+from output_writer import active_writer, stage_timings, configure_writer
+from voc_writer import VocTemplate, render_box_array
+from resize_manifest import ResizeManifest
+from encoder_options import add_encoder_arguments, encoder_from_args
 
 
 # This script resizes the given annotated images as best as possible.
@@ -25,128 +36,6 @@ from PIL import Image
 
 
 
-class BoundingBoxAnnotation:
-    def __init__(self, xmlObject = None, name = '', xmin = 0, ymin = 0, xmax = 0, ymax = 0):
-        if xmlObject is not None:
-            self.name = xmlObject.find('name').text.lower()
-            bndbox = xmlObject.find('bndbox')
-            self.xmin = float(bndbox.find('xmin').text)
-            self.ymin = float(bndbox.find('ymin').text)
-            self.xmax = float(bndbox.find('xmax').text)
-            self.ymax = float(bndbox.find('ymax').text)
-        else:
-            self.name = name
-            self.xmin = xmin
-            self.ymin = ymin
-            self.xmax = xmax
-            self.ymax = ymax
-
-    def width(self):
-        return self.xmax - self.xmin
-
-    def height(self):
-        return self.ymax - self.ymin
-
-    def scale(self, scaleX, scaleY):
-        self.xmin = self.xmin * scaleX
-        self.ymin = self.ymin * scaleY
-        self.xmax = self.xmax * scaleX
-        self.ymax = self.ymax * scaleY
-
-    def scaleToCenter(self, scaleX, scaleY, centerX, centerY):
-        self.xmin = centerX + (self.xmin - centerX) * scaleX
-        self.ymin = centerY + (self.ymin - centerY) * scaleY
-        self.xmax = centerX + (self.xmax - centerX) * scaleX
-        self.ymax = centerY + (self.ymax - centerY) * scaleY
-
-    def crop(self, cropX, cropY, cropW, cropH):
-        # self.xmin = clamp(self.xmin - cropX, 0.0, cropW)
-        # self.ymin = clamp(self.ymin - cropY, 0.0, cropH)
-        # self.xmax = clamp(self.xmax - cropX, 0.0, cropW)
-        # self.ymax = clamp(self.ymax - cropY, 0.0, cropH)
-        self.xmin = self.xmin - cropX
-        self.ymin = self.ymin - cropY
-        self.xmax = self.xmax - cropX
-        self.ymax = self.ymax - cropY
-
-    def clamp(self, imgW, imgH):
-        self.xmin = clamp(self.xmin, 0.0, imgW)
-        self.ymin = clamp(self.ymin, 0.0, imgH)
-        self.xmax = clamp(self.xmax, 0.0, imgW)
-        self.ymax = clamp(self.ymax, 0.0, imgH)
-
-    def isEmpty(self, minSize = 10.0):
-        return self.width() < minSize or self.height() < minSize
-
-    def percentW(self, imgW, padding = 0.0):
-        factor = (0.0 if self.isTouchingLeftBorder() else 1.0) + (0.0 if self.isTouchingRightBorder(imgW) else 1.0)
-        return (self.width() + factor * padding) / imgW
-
-    def percentH(self, imgH, padding = 0.0):
-        factor = (0.0 if self.isTouchingTopBorder() else 1.0) + (0.0 if self.isTouchingBottomBorder(imgH) else 1.0)
-        return (self.height() + factor * padding) / imgH
-
-    def percentAvg(self, imgW, imgH, padding = 0.0):
-        return (self.percentW(imgW, padding) + self.percentH(imgH, padding)) / 2.0
-
-    def centerX(self):
-        return (self.xmin + self.xmax) / 2.0
-
-    def centerY(self):
-        return (self.ymin + self.ymax) / 2.0
-
-    def isTouchingBorder(self, imgW, imgH):
-        return self.xmin <= 3.5 or self.ymin <= 3.5 or self.xmax >= imgW - 3.5 or self.ymax >= imgH - 3.5
-
-    def isTouchingLeftBorder(self):
-        return self.xmin <= 3.5
-
-    def isTouchingTopBorder(self):
-        return self.ymin <= 3.5
-
-    def isTouchingRightBorder(self, imgW):
-        return self.xmax >= imgW - 3.5
-
-    def isTouchingBottomBorder(self, imgH):
-        return self.ymax >= imgH - 3.5
-
-    def replaceExistingXmlContent(self, xmlObject):
-        if self.isEmpty():
-            return False
-        xmlObject.find('name').text = self.name
-        bndbox = xmlObject.find('bndbox')
-        bndbox.find('xmin').text = str(int(round(self.xmin)))
-        bndbox.find('ymin').text = str(int(round(self.ymin)))
-        bndbox.find('xmax').text = str(int(round(self.xmax)))
-        bndbox.find('ymax').text = str(int(round(self.ymax)))
-        return True
-
-    def toXml(self, xmlRoot):
-        if self.isEmpty():
-            return False
-        xmlObject = ET.Element('object')
-        xmlObject.append(new_et_element('name', self.name))
-        xmlObject.append(new_et_element('pose', 'Unspecified'))
-        xmlObject.append(new_et_element('truncated', '0'))
-        xmlObject.append(new_et_element('difficult', '0'))
-        bndbox = ET.Element('bndbox')
-        bndbox.append(new_et_element('xmin', str(int(round(self.xmin)))))
-        bndbox.append(new_et_element('ymin', str(int(round(self.ymin)))))
-        bndbox.append(new_et_element('xmax', str(int(round(self.xmax)))))
-        bndbox.append(new_et_element('ymax', str(int(round(self.ymax)))))
-        xmlObject.append(bndbox)
-        xmlRoot.append(xmlObject)
-        return True
-
-
-
-
-def new_et_element(tag, text):
-    obj = ET.Element(tag)
-    obj.text = text
-    return obj
-
-
 def create_path(path):
     Path(path).mkdir(parents=True, exist_ok=True)
 
@@ -162,132 +51,225 @@ def get_file_name(path):
     return (base_dir, file_name, ext)
 
 
-def process_image(imageFile, outputPath, x, y):
+# Returns the number of images written for the given image file. Errors are
+# raised to the caller, which collects them per file (see parallel_utils).
+# The outputs are written asynchronously by the active writer of this process.
+def process_image(imageFile, outputPath, x, y, reducedDecode = False, compatXml = True):
     (base_dir, file_name, ext) = get_file_name(imageFile)
     xml = os.path.join(base_dir, file_name + '.xml')
-    try:
-        smart_resize(imageFile, xml, (x, y), outputPath)
-    except Exception as e:
-        print('[ERROR] error with {}\n file: {}'.format(imageFile, e))
-        print('--------------------------------------------------')
+    with stage_timings().measure('transform'):
+        return smart_resize(imageFile, xml, (x, y), outputPath, reducedDecode, compatXml)
 
 
-def smart_resize(imageFile, xmlFile, targetSize, outputPath):
+def smart_resize(imageFile, xmlFile, targetSize, outputPath, reducedDecode = False, compatXml = True):
     (base_dir, file_name, image_file_ext) = get_file_name(imageFile)
 
-    # Prepare the image data
-    image = cv2.imread(imageFile)
-
-    imgW = float(image.shape[1])
-    imgH = float(image.shape[0])
     targetW = float(targetSize[0])
     targetH = float(targetSize[1])
-    scaleX = targetW / imgW
-    scaleY = targetH / imgH
 
+    fileCounter = 0
     if (not Path(xmlFile).exists):
         # Don't resize the image file, if no XML annotation data was found
         print(f"No XML file was found for {file_name}.{image_file_ext} in {base_dir}. Image won\'t be resized!")
     else:
-        fileCounter = 0
-
         # Prepare the XML data
-        bboxAnnotations = []
         xmlRoot = ET.parse(xmlFile).getroot()
-        xmlObjects = xmlRoot.findall('object')
-        for xmlObject in xmlObjects:
-            bboxAnnotations.append(BoundingBoxAnnotation(xmlObject))
+        bboxAnnotations = BoxArray.fromXml(xmlRoot)
 
-        numObjects = len(bboxAnnotations)
-        if (numObjects == 0):
+        if (len(bboxAnnotations) == 0):
             # Don't resize the image file, if no bounding boxes were found in the XML annotation file
             print(f"No bounding boxes were found in {file_name}.xml in {base_dir}. Image won\'t be resized!")
-        
-        elif (numObjects == 1):
-            if scaleY > scaleX:
-                # Source image's width is larger than target width
-                bboxAnnotationsCopy = deepcopy(bboxAnnotations)
-                imageCopy = scaleImage(image, scaleY, scaleY, bboxAnnotationsCopy)
-                if (bboxAnnotationsCopy[0].width() > targetW):
-                    fileCounter = saveCroppedLeftTopAndRightBottomImageParts(imageCopy, xmlRoot, file_name, image_file_ext, targetW, targetH, outputPath, bboxAnnotationsCopy, fileCounter, 0.25)
-                    fileCounter = saveBoundingBox(image, xmlRoot, file_name, image_file_ext, targetW, targetH, outputPath, bboxAnnotations, fileCounter)
-                else:
-                    imageCopy = cropImageToCenter(imageCopy, bboxAnnotationsCopy[0].centerX(), bboxAnnotationsCopy[0].centerY(), int(targetW), int(targetH), bboxAnnotationsCopy)
-                    fileCounter = saveAsCopy(imageCopy, xmlRoot, file_name, image_file_ext, outputPath, bboxAnnotationsCopy, fileCounter)
-            elif scaleX > scaleY:
-                # Source image's height is larger than target height
-                bboxAnnotationsCopy = deepcopy(bboxAnnotations)
-                imageCopy = scaleImage(image, scaleX, scaleX, bboxAnnotationsCopy)
-                if (bboxAnnotationsCopy[0].height() > targetH):
-                    fileCounter = saveCroppedLeftTopAndRightBottomImageParts(imageCopy, xmlRoot, file_name, image_file_ext, targetW, targetH, outputPath, bboxAnnotationsCopy, fileCounter, 0.25)
-                    fileCounter = saveBoundingBox(image, xmlRoot, file_name, image_file_ext, targetW, targetH, outputPath, bboxAnnotations, fileCounter)
-                else:
-                    imageCopy = cropImageToCenter(imageCopy, bboxAnnotationsCopy[0].centerX(), bboxAnnotationsCopy[0].centerY(), int(targetW), int(targetH), bboxAnnotationsCopy)
-                    fileCounter = saveAsCopy(imageCopy, xmlRoot, file_name, image_file_ext, outputPath, bboxAnnotationsCopy, fileCounter)
-            else: # scaleX == scaleY
-                bboxAnnotationsCopy = deepcopy(bboxAnnotations)
-                imageCopy = scaleImage(image, scaleX, scaleY, bboxAnnotationsCopy)
-                fileCounter = saveAsCopy(imageCopy, xmlRoot, file_name, image_file_ext, outputPath, bboxAnnotationsCopy, fileCounter)
-
-        else: # (numObjects > 1):
-            if scaleY > scaleX:
-                # Source image's width is larger than target width
-                bboxAnnotationsCopy = deepcopy(bboxAnnotations)
-                imageCopy = scaleImage(image, scaleY, scaleY, bboxAnnotationsCopy)
-                combined = combineBoundingBoxes(bboxAnnotationsCopy)
-                if (combined.width() > targetW):
-                    fileCounter = saveCroppedLeftTopAndRightBottomImageParts(imageCopy, xmlRoot, file_name, image_file_ext, targetW, targetH, outputPath, bboxAnnotationsCopy, fileCounter)
-                else:
-                    imageCopy = cropImageToCenter(imageCopy, combined.centerX(), combined.centerY(), int(targetW), int(targetH), bboxAnnotationsCopy)
-                    fileCounter = saveAsCopy(imageCopy, xmlRoot, file_name, image_file_ext, outputPath, bboxAnnotationsCopy, fileCounter)
-
-                fileCounter = saveZoomedBoundingBoxes(image, scaleY, xmlRoot, file_name, image_file_ext, targetW, targetH, outputPath, bboxAnnotations, fileCounter)
-            elif scaleX > scaleY:
-                # Source image's height is larger than target height
-                bboxAnnotationsCopy = deepcopy(bboxAnnotations)
-                imageCopy = scaleImage(image, scaleX, scaleX, bboxAnnotationsCopy)
-                combined = combineBoundingBoxes(bboxAnnotationsCopy)
-                if (combined.height() > targetH):
-                    fileCounter = saveCroppedLeftTopAndRightBottomImageParts(imageCopy, xmlRoot, file_name, image_file_ext, targetW, targetH, outputPath, bboxAnnotationsCopy, fileCounter)
-                else:
-                    imageCopy = cropImageToCenter(imageCopy, combined.centerX(), combined.centerY(), int(targetW), int(targetH), bboxAnnotationsCopy)
-                    fileCounter = saveAsCopy(imageCopy, xmlRoot, file_name, image_file_ext, outputPath, bboxAnnotationsCopy, fileCounter)
-
-                fileCounter = saveZoomedBoundingBoxes(image, scaleX, xmlRoot, file_name, image_file_ext, targetW, targetH, outputPath, bboxAnnotations, fileCounter)
-            else: # scaleX == scaleY
-                bboxAnnotationsCopy = deepcopy(bboxAnnotations)
-                imageCopy = scaleImage(image, scaleX, scaleY, bboxAnnotationsCopy)
-                fileCounter = saveAsCopy(imageCopy, xmlRoot, file_name, image_file_ext, outputPath, bboxAnnotationsCopy, fileCounter)
-
-                fileCounter = saveZoomedBoundingBoxes(image, scaleX, xmlRoot, file_name, image_file_ext, targetW, targetH, outputPath, bboxAnnotations, fileCounter)
-
-
-def deepcopy(arr):
-    return [copy.deepcopy(x) for x in arr]
-
-def combineBoundingBoxes(bboxAnnotations):
-    xMin = min([bbox.xmin for bbox in bboxAnnotations])
-    yMin = min([bbox.ymin for bbox in bboxAnnotations])
-    xMax = max([bbox.xmax for bbox in bboxAnnotations])
-    yMax = max([bbox.ymax for bbox in bboxAnnotations])
-    return BoundingBoxAnnotation(None, '', xMin, yMin, xMax, yMax)
-
-def scaleImage(image, scaleX, scaleY, bboxAnnotations):
-    for bbox in bboxAnnotations:
-        bbox.scale(scaleX, scaleY)
+        else:
+            # Plan all outputs on the bounding boxes and the image size from the file header first,
+            # then decode the image (at reduced resolution, if enabled and possible) and render the outputs
+            sourceSize = probe_image_size(imageFile)
+            outputs = planSmartResize(sourceSize[0], sourceSize[1], bboxAnnotations, targetW, targetH)
+            if (len(outputs) > 0):
+                with stage_timings().measure('decode'):
+                    (image, decodedSize) = readSourceImage(imageFile, sourceSize, outputs, reducedDecode)
+                if (decodedSize != sourceSize):
+                    # The file header didn't describe the decoded image, plan again with its real size
+                    sourceSize = decodedSize
+                    outputs = planSmartResize(sourceSize[0], sourceSize[1], bboxAnnotations, targetW, targetH)
+
+                # The XML files of all outputs are rendered from one template of the source XML file
+                xmlTemplate = VocTemplate(xmlRoot, compatXml)
+                scaledImages = {}
+                try:
+                    for output in outputs:
+                        imageCopy = renderOutput(image, sourceSize, output, scaledImages)
+                        fileCounter = saveAsCopy(imageCopy, xmlTemplate, file_name, image_file_ext, outputPath, output.bboxAnnotations, fileCounter)
+                        if (output.operation[0] != 'scaled'):
+                            release_buffer(imageCopy)
+                finally:
+                    for scaled in scaledImages.values():
+                        release_buffer(scaled)
+
+    return fileCounter
+
+
+# The branches of smart_resize, an output image is created by one of them
+BRANCHES = ('crop', 'bbox', 'zoom', 'copy')
+
+class PlannedOutput:
+    # One output image of smart_resize. The bounding boxes are already
+    # transformed to the output image, clamped and filtered. operation
+    # describes how the pixels are rendered from the source image (see
+    # renderOutput) and scale is the factor the source pixels are scaled by.
+    def __init__(self, branch, operation, scale, size, bboxAnnotations):
+        self.branch = branch
+        self.operation = operation
+        self.scale = scale
+        self.size = size
+        self.bboxAnnotations = bboxAnnotations
+
+
+def planSmartResize(imgW, imgH, bboxAnnotations, targetW, targetH):
+    # Runs the branch logic of smart_resize on the bounding boxes only, without
+    # touching any pixels. imgW and imgH are the full resolution size of the
+    # source image. Returns the list of PlannedOutput in the order of writing.
+    scaleX = targetW / float(imgW)
+    scaleY = targetH / float(imgH)
+    outputs = []
+
+    numObjects = len(bboxAnnotations)
+    if (numObjects == 1):
+        if scaleY > scaleX:
+            # Source image's width is larger than target width
+            bboxAnnotationsCopy = bboxAnnotations.copy()
+            scaledSize = scaleBoundingBoxes(imgW, imgH, scaleY, scaleY, bboxAnnotationsCopy)
+            if (bboxAnnotationsCopy.width()[0] > targetW):
+                planCroppedLeftTopAndRightBottomImageParts(outputs, scaleY, scaleY, scaledSize, targetW, targetH, bboxAnnotationsCopy, 0.25)
+                planBoundingBox(outputs, imgW, imgH, targetW, targetH, bboxAnnotations)
+            else:
+                planCroppedToCenter(outputs, scaleY, scaleY, scaledSize, bboxAnnotationsCopy.centerX()[0], bboxAnnotationsCopy.centerY()[0], targetW, targetH, bboxAnnotationsCopy)
+        elif scaleX > scaleY:
+            # Source image's height is larger than target height
+            bboxAnnotationsCopy = bboxAnnotations.copy()
+            scaledSize = scaleBoundingBoxes(imgW, imgH, scaleX, scaleX, bboxAnnotationsCopy)
+            if (bboxAnnotationsCopy.height()[0] > targetH):
+                planCroppedLeftTopAndRightBottomImageParts(outputs, scaleX, scaleX, scaledSize, targetW, targetH, bboxAnnotationsCopy, 0.25)
+                planBoundingBox(outputs, imgW, imgH, targetW, targetH, bboxAnnotations)
+            else:
+                planCroppedToCenter(outputs, scaleX, scaleX, scaledSize, bboxAnnotationsCopy.centerX()[0], bboxAnnotationsCopy.centerY()[0], targetW, targetH, bboxAnnotationsCopy)
+        else: # scaleX == scaleY
+            bboxAnnotationsCopy = bboxAnnotations.copy()
+            scaledSize = scaleBoundingBoxes(imgW, imgH, scaleX, scaleY, bboxAnnotationsCopy)
+            planAsCopy(outputs, 'copy', ('scaled', scaleX, scaleY, None), max(scaleX, scaleY), scaledSize, bboxAnnotationsCopy)
+
+    elif (numObjects > 1):
+        if scaleY > scaleX:
+            # Source image's width is larger than target width
+            bboxAnnotationsCopy = bboxAnnotations.copy()
+            scaledSize = scaleBoundingBoxes(imgW, imgH, scaleY, scaleY, bboxAnnotationsCopy)
+            combined = bboxAnnotationsCopy.combined()
+            if (combined.width()[0] > targetW):
+                planCroppedLeftTopAndRightBottomImageParts(outputs, scaleY, scaleY, scaledSize, targetW, targetH, bboxAnnotationsCopy)
+            else:
+                planCroppedToCenter(outputs, scaleY, scaleY, scaledSize, combined.centerX()[0], combined.centerY()[0], targetW, targetH, bboxAnnotationsCopy)
+
+            planZoomedBoundingBoxes(outputs, imgW, imgH, scaleY, targetW, targetH, bboxAnnotations)
+        elif scaleX > scaleY:
+            # Source image's height is larger than target height
+            bboxAnnotationsCopy = bboxAnnotations.copy()
+            scaledSize = scaleBoundingBoxes(imgW, imgH, scaleX, scaleX, bboxAnnotationsCopy)
+            combined = bboxAnnotationsCopy.combined()
+            if (combined.height()[0] > targetH):
+                planCroppedLeftTopAndRightBottomImageParts(outputs, scaleX, scaleX, scaledSize, targetW, targetH, bboxAnnotationsCopy)
+            else:
+                planCroppedToCenter(outputs, scaleX, scaleX, scaledSize, combined.centerX()[0], combined.centerY()[0], targetW, targetH, bboxAnnotationsCopy)
+
+            planZoomedBoundingBoxes(outputs, imgW, imgH, scaleX, targetW, targetH, bboxAnnotations)
+        else: # scaleX == scaleY
+            bboxAnnotationsCopy = bboxAnnotations.copy()
+            scaledSize = scaleBoundingBoxes(imgW, imgH, scaleX, scaleY, bboxAnnotationsCopy)
+            planAsCopy(outputs, 'copy', ('scaled', scaleX, scaleY, None), max(scaleX, scaleY), scaledSize, bboxAnnotationsCopy)
+
+            planZoomedBoundingBoxes(outputs, imgW, imgH, scaleX, targetW, targetH, bboxAnnotations)
+
+    return outputs
+
+
+def getDecodeReduction(imageFile, outputs, reducedDecode = False):
+    # JPEG images are decoded at the smallest resolution (1/2, 1/4 or 1/8) that
+    # is still at least as large as every planned output needs
+    if (not reducedDecode or len(outputs) == 0):
+        return 1
+    return reduction_for_scale(max(output.scale for output in outputs), imageFile)
+
+def readSourceImage(imageFile, sourceSize, outputs, reducedDecode = False):
+    # Returns the decoded image and the full resolution size (width, height) of the source image
+    reduction = getDecodeReduction(imageFile, outputs, reducedDecode)
+    image = read_image(imageFile, reduction)
+    if (not decoded_size_matches(image, sourceSize[0], sourceSize[1], reduction)):
+        # The header doesn't describe the decoded image (e.g. unusual EXIF data), fall back to a full decode
+        if (reduction > 1):
+            image = read_image(imageFile)
+        sourceSize = (image.shape[1], image.shape[0])
+    return (image, sourceSize)
+
+def renderOutput(image, sourceSize, output, scaledImages):
+    # Renders the pixels of a planned output from the decoded source image. The
+    # scaled source images are cached in scaledImages, so all crops of the same
+    # scale share one resize. The pixels are rendered into buffers of the buffer
+    # pool: the caller releases the scaledImages when the image is done and
+    # every other output after saving it.
+    operation = output.operation
+    if (operation[0] == 'scaled'):
+        (_, scaleX, scaleY, window) = operation
+        if ((scaleX, scaleY) not in scaledImages):
+            dst = output_buffer(image, *getScaledSize(sourceSize[0], sourceSize[1], scaleX, scaleY))
+            scaledImages[(scaleX, scaleY)] = use_buffer(dst, scaleImage(image, scaleX, scaleY, None, sourceSize, dst))
+        imageCopy = scaledImages[(scaleX, scaleY)]
+        return imageCopy if window is None else cropImage(imageCopy, *window, None)
+    elif (operation[0] == 'bbox'):
+        (_, scale, centerX, centerY, x, y, w, h) = operation
+        dst = output_buffer(image, w, h)
+        return use_buffer(dst, scaleImageToCenterAndCrop(image, scale, scale, centerX, centerY, x, y, w, h, None, sourceSize, dst))
+    else: # zoom
+        (_, x, y, w, h, scale, centerX, centerY) = operation
+        dst = output_buffer(image, w, h)
+        return use_buffer(dst, cropAndScaleImageToCenter(image, x, y, w, h, scale, scale, centerX, centerY, None, sourceSize, dst))
+
+def getDecodeScale(image, sourceSize):
+    # Ratio between the decoded image and the full resolution source image
+    if (sourceSize is None):
+        return (1.0, 1.0)
+    return (image.shape[1] / sourceSize[0], image.shape[0] / sourceSize[1])
+
+def getScaledSize(imgW, imgH, scaleX, scaleY):
+    # Size of an image scaled by cv2.resize with fx = scaleX and fy = scaleY
+    return (int(round(imgW * scaleX)), int(round(imgH * scaleY)))
+
+def scaleBoundingBoxes(imgW, imgH, scaleX, scaleY, bboxAnnotations):
+    # Box part of scaleImage, returns the size of the scaled image
+    bboxAnnotations.scale(scaleX, scaleY)
+    return getScaledSize(imgW, imgH, scaleX, scaleY)
+
+
+# The following functions transform the image and its bounding boxes. The
+# bounding boxes may be None to only transform the pixels.
+
+def scaleImage(image, scaleX, scaleY, bboxAnnotations, sourceSize = None, dst = None):
+    # The image functions below write their result into dst if it is given and fits (see buffer_pool)
+    if (bboxAnnotations is not None):
+        bboxAnnotations.scale(scaleX, scaleY)
     interp = cv2.INTER_LINEAR if (scaleX * scaleY > 1.0) else cv2.INTER_AREA
-    return cv2.resize(image, None, fx=scaleX, fy=scaleY, interpolation=interp)
+    if (sourceSize is None or tuple(sourceSize) == (image.shape[1], image.shape[0])):
+        return resize_image(image, (0, 0), interp, fx=scaleX, fy=scaleY, dst=dst)
+    # The image was decoded at reduced resolution, scale it to the size the full resolution image would get
+    return resize_image(image, getScaledSize(sourceSize[0], sourceSize[1], scaleX, scaleY), interp, dst=dst)
 
-def scaleImageToCenter(image, scaleX, scaleY, centerX, centerY, bboxAnnotations):
+def scaleImageToCenter(image, scaleX, scaleY, centerX, centerY, bboxAnnotations, dst = None):
     imgH, imgW = image.shape[:2]
-    for bbox in bboxAnnotations:
-        bbox.scaleToCenter(scaleX, scaleY, centerX, centerY)
+    if (bboxAnnotations is not None):
+        bboxAnnotations.scaleToCenter(scaleX, scaleY, centerX, centerY)
     interp = cv2.INTER_LINEAR if (scaleX * scaleY > 1.0) else cv2.INTER_AREA
     M = np.float32([
         [scaleX, 0, centerX * (1 - scaleX)],
         [0, scaleY, centerY * (1 - scaleY)]
     ])
-    temp = cv2.warpAffine(image, M, (imgW, imgH), flags=interp)
+    temp = cv2.warpAffine(image, M, (imgW, imgH), dst=dst, flags=interp)
 
     # rect = BoundingBoxAnnotation(None, '', 0, 0, imgW, imgH)
     # rect.scaleToCenter(scaleX, scaleY, centerX, centerY)
@@ -298,25 +280,70 @@ def scaleImageToCenter(image, scaleX, scaleY, centerX, centerY, bboxAnnotations)
 
     return temp
 
+def scaleImageToCenterAndCrop(image, scaleX, scaleY, centerX, centerY, x, y, w, h, bboxAnnotations, sourceSize = None, dst = None):
+    # Same result as scaleImageToCenter followed by cropImage(x, y, w, h), but
+    # the crop offset is folded into the affine matrix, so only the w x h output
+    # window is rendered instead of the whole source frame. All coordinates are
+    # full resolution coordinates, an image decoded at reduced resolution is
+    # compensated in the matrix.
+    (decodeX, decodeY) = getDecodeScale(image, sourceSize)
+    if (bboxAnnotations is not None):
+        bboxAnnotations.scaleToCenter(scaleX, scaleY, centerX, centerY)
+        bboxAnnotations.crop(x, y)
+    (pixelScaleX, pixelScaleY) = (scaleX / decodeX, scaleY / decodeY)
+    interp = cv2.INTER_LINEAR if (pixelScaleX * pixelScaleY > 1.0) else cv2.INTER_AREA
+    M = np.float32([
+        [pixelScaleX, 0, centerX * (1 - scaleX) - x],
+        [0, pixelScaleY, centerY * (1 - scaleY) - y]
+    ])
+    return cv2.warpAffine(image, M, (w, h), dst=dst, flags=interp)
+
+def cropAndScaleImageToCenter(image, x, y, w, h, scaleX, scaleY, centerX, centerY, bboxAnnotations, sourceSize = None, dst = None):
+    # Same result as cropImage(x, y, w, h) followed by scaleImageToCenter (with
+    # the center given in coordinates of the cropped image), but without copying
+    # or enlarging the source: the warp reads directly from the part of the crop
+    # window inside the image, everything outside stays black.
+    imgH, imgW = image.shape[:2]
+    (decodeX, decodeY) = getDecodeScale(image, sourceSize)
+    if (bboxAnnotations is not None):
+        bboxAnnotations.crop(x, y)
+        bboxAnnotations.scaleToCenter(scaleX, scaleY, centerX, centerY)
+    # Part of the crop window inside the image, in decoded pixels
+    (left, top) = (int(max(x, 0) * decodeX), int(max(y, 0) * decodeY))
+    (right, bottom) = (int(np.ceil((x + w) * decodeX)), int(np.ceil((y + h) * decodeY)))
+    roi = image[top:min(bottom, imgH), left:min(right, imgW)]
+    if (roi.size == 0):
+        if (dst is not None and dst.shape == (h, w) + image.shape[2:]):
+            dst.fill(0)
+            return dst
+        return np.zeros((h, w) + image.shape[2:], dtype=image.dtype)
+    (pixelScaleX, pixelScaleY) = (scaleX / decodeX, scaleY / decodeY)
+    interp = cv2.INTER_LINEAR if (pixelScaleX * pixelScaleY > 1.0) else cv2.INTER_AREA
+    M = np.float32([
+        [pixelScaleX, 0, (left / decodeX - x) * scaleX + centerX * (1 - scaleX)],
+        [0, pixelScaleY, (top / decodeY - y) * scaleY + centerY * (1 - scaleY)]
+    ])
+    return cv2.warpAffine(roi, M, (w, h), dst=dst, flags=interp)
+
 def resizeImage(image, newSizeX, newSizeY, bboxAnnotations):
     return scaleImage(image, newSizeX / image.shape[1], newSizeY / image.shape[0], bboxAnnotations)
 
 def resizeImageToCenter(image, newSizeX, newSizeY, centerX, centerY, bboxAnnotations):
     return scaleImageToCenter(image, newSizeX / image.shape[1], newSizeY / image.shape[0], centerX, centerY, bboxAnnotations)
 
-def enlargeImage(image, x, y, w, h):
+def enlargeImage(image, x, y, w, h, dst = None):
     top = -y if y < 0 else 0
     bottom = (y + h) - image.shape[0] if (y + h) > image.shape[0] else 0
     left = -x if x < 0 else 0
     right = (x + w) - image.shape[1] if (x + w) > image.shape[1] else 0
     color = [0, 0, 0]
-    return cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    return cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, dst=dst, value=color)
 
 def cropImage(image, x, y, w, h, bboxAnnotations):
     if (x < 0 or y < 0 or x + w > image.shape[1] or y + h > image.shape[0]):
         image = enlargeImage(image, x, y, w, h)
-        for bbox in bboxAnnotations:
-            bbox.crop(min(x, 0), min(y, 0), image.shape[1], image.shape[0])
+        if (bboxAnnotations is not None):
+            bboxAnnotations.crop(min(x, 0), min(y, 0))
 
     if (x < 0):
         # w += x
@@ -329,66 +356,86 @@ def cropImage(image, x, y, w, h, bboxAnnotations):
     # if (y + h > image.shape[0]):
     #     h = image.shape[0] - y
 
-    for bbox in bboxAnnotations:
-        bbox.crop(x, y, w, h)
+    if (bboxAnnotations is not None):
+        bboxAnnotations.crop(x, y)
     return image[y:y+h, x:x+w]
 
-def cropImageToCenter(image, centerX, centerY, w, h, bboxAnnotations, clampValues = True):
+def getCenteredWindow(centerX, centerY, w, h, imgW, imgH, clampValues = True):
     x = int(centerX - w / 2)
     y = int(centerY - h / 2)
     if (clampValues):
-        x = clamp(x, 0, image.shape[1] - w)
-        y = clamp(y, 0, image.shape[0] - h)
-        w = clamp(w, 0, image.shape[1] - x)
-        h = clamp(h, 0, image.shape[0] - y)
-    return cropImage(image, x, y, w, h, bboxAnnotations)
-
-def saveCroppedLeftTopAndRightBottomImageParts(image, origXmlRoot, imageFileName, imageFileExt, targetW, targetH, outputPath, bboxAnnotations, fileCounter, minSizePercent = 0.05):
-    minSize = max(min(targetW * minSizePercent, targetH * minSizePercent), 10.0)
+        x = clamp(x, 0, imgW - w)
+        y = clamp(y, 0, imgH - h)
+        w = clamp(w, 0, imgW - x)
+        h = clamp(h, 0, imgH - y)
+    return (x, y, w, h)
 
-    bboxAnnotations_left_top_part = deepcopy(bboxAnnotations)
-    img_left_top_part = cropImage(image, 0, 0, int(targetW), int(targetH), bboxAnnotations_left_top_part)
-    fileCounter = saveAsCopy(img_left_top_part, origXmlRoot, imageFileName, imageFileExt, outputPath, bboxAnnotations_left_top_part, fileCounter, minSize)
-
-    imgW = float(image.shape[1])
-    tX = int(imgW - targetW)
-    imgH = float(image.shape[0])
-    tY = int(imgH - targetH)
-    img_right_bottom_part = cropImage(image, tX, tY, int(targetW), int(targetH), bboxAnnotations)
-    fileCounter = saveAsCopy(img_right_bottom_part, origXmlRoot, imageFileName, imageFileExt, outputPath, bboxAnnotations, fileCounter, minSize)
-    return fileCounter
+def cropImageToCenter(image, centerX, centerY, w, h, bboxAnnotations, clampValues = True):
+    (x, y, w, h) = getCenteredWindow(centerX, centerY, w, h, image.shape[1], image.shape[0], clampValues)
+    return cropImage(image, x, y, w, h, bboxAnnotations)
 
-def saveZoomedBoundingBoxes(image, scale, origXmlRoot, imageFileName, imageFileExt, targetW, targetH, outputPath, bboxAnnotations, fileCounter):
-    for index, bbox in enumerate(bboxAnnotations):
-        bboxAnnotationsCopy = deepcopy(bboxAnnotations)
-        bboxCopy = bboxAnnotationsCopy[index]
-        percentMin = max(bboxCopy.percentW(targetW), bboxCopy.percentH(targetH))
-        if (percentMin < 0.5 and not bboxCopy.isTouchingBorder(image.shape[1], image.shape[0])):
-            imageCopy = cropImageToCenter(image, bboxCopy.centerX(), bboxCopy.centerY(), int(targetW), int(targetH), bboxAnnotationsCopy, False)
-            percentMin = max(bboxCopy.percentW(targetW, 20.0), bboxCopy.percentH(targetH, 20.0))
-            rescale = min(1.0 / percentMin, 4.0 * scale)
-            imageCopy = scaleImageToCenter(imageCopy, rescale, rescale, bboxCopy.centerX(), bboxCopy.centerY(), bboxAnnotationsCopy)
-            fileCounter = saveAsCopy(imageCopy, origXmlRoot, imageFileName, imageFileExt, outputPath, bboxAnnotationsCopy, fileCounter)
-    return fileCounter
 
-def saveBoundingBox(image, origXmlRoot, imageFileName, imageFileExt, targetW, targetH, outputPath, bboxAnnotations, fileCounter):
-        bboxAnnotationsCopy = deepcopy(bboxAnnotations)
-        bbox = bboxAnnotationsCopy[0]
-        scaleX = targetW / bbox.width()
-        scaleY = targetH / bbox.height()
-        newscale = min(scaleX, scaleY)
-        imageCopy = scaleImageToCenter(image, newscale, newscale, bbox.centerX(), bbox.centerY(), bboxAnnotationsCopy)
-        imageCopy = cropImageToCenter(imageCopy, bbox.centerX(), bbox.centerY(), int(targetW), int(targetH), bboxAnnotationsCopy, True)
-        fileCounter = saveAsCopy(imageCopy, origXmlRoot, imageFileName, imageFileExt, outputPath, bboxAnnotationsCopy, fileCounter)
-        return fileCounter
+# The following functions plan the outputs of the branches of smart_resize.
+# They only transform the bounding boxes the same way the image functions
+# above would, and append a PlannedOutput to outputs.
 
-def saveAsCopy(image, origXmlRoot, imageFileName, imageFileExt, outputPath, bboxAnnotations, fileCounter, minSize = 10.0):
-    for bbox in bboxAnnotations:
-        bbox.clamp(image.shape[1], image.shape[0])
+def planAsCopy(outputs, branch, operation, scale, size, bboxAnnotations, minSize = 10.0):
+    # Box part of saveAsCopy: outputs without any remaining bounding box are not written
+    bboxAnnotations.clamp(size[0], size[1])
+    bboxAnnotations = bboxAnnotations.select(~bboxAnnotations.isEmpty(minSize))
+    if len(bboxAnnotations) > 0:
+        outputs.append(PlannedOutput(branch, operation, scale, size, bboxAnnotations))
 
-    bboxAnnotations = [bbox for bbox in bboxAnnotations if not bbox.isEmpty(minSize)]
+def planCroppedToCenter(outputs, scaleX, scaleY, scaledSize, centerX, centerY, targetW, targetH, bboxAnnotations):
+    (x, y, w, h) = getCenteredWindow(centerX, centerY, int(targetW), int(targetH), scaledSize[0], scaledSize[1])
+    bboxAnnotations.crop(x, y)
+    planAsCopy(outputs, 'copy', ('scaled', scaleX, scaleY, (x, y, w, h)), max(scaleX, scaleY), (w, h), bboxAnnotations)
 
-    if bboxAnnotations is None or len(bboxAnnotations) == 0:
+def planCroppedLeftTopAndRightBottomImageParts(outputs, scaleX, scaleY, scaledSize, targetW, targetH, bboxAnnotations, minSizePercent = 0.05):
+    minSize = max(min(targetW * minSizePercent, targetH * minSizePercent), 10.0)
+    (w, h) = (int(targetW), int(targetH))
+
+    bboxAnnotations_left_top_part = bboxAnnotations.copy()
+    planAsCopy(outputs, 'crop', ('scaled', scaleX, scaleY, (0, 0, w, h)), max(scaleX, scaleY), (w, h), bboxAnnotations_left_top_part, minSize)
+
+    tX = int(float(scaledSize[0]) - targetW)
+    tY = int(float(scaledSize[1]) - targetH)
+    bboxAnnotations.crop(tX, tY)
+    planAsCopy(outputs, 'crop', ('scaled', scaleX, scaleY, (tX, tY, w, h)), max(scaleX, scaleY), (w, h), bboxAnnotations, minSize)
+
+def planZoomedBoundingBoxes(outputs, imgW, imgH, scale, targetW, targetH, bboxAnnotations):
+    percentMin = np.maximum(bboxAnnotations.percentW(targetW), bboxAnnotations.percentH(targetH))
+    candidates = (percentMin < 0.5) & ~bboxAnnotations.isTouchingBorder(imgW, imgH)
+    for index in np.flatnonzero(candidates):
+        bboxCopy = bboxAnnotations[index]
+        (x, y, w, h) = getCenteredWindow(bboxCopy.centerX()[0], bboxCopy.centerY()[0], int(targetW), int(targetH), imgW, imgH, False)
+        bboxCopy.crop(x, y)
+        percentMin = max(bboxCopy.percentW(targetW, 20.0)[0], bboxCopy.percentH(targetH, 20.0)[0])
+        rescale = min(1.0 / percentMin, 4.0 * scale)
+        (centerX, centerY) = (bboxCopy.centerX()[0], bboxCopy.centerY()[0])
+        bboxAnnotationsCopy = bboxAnnotations.copy()
+        bboxAnnotationsCopy.crop(x, y)
+        bboxAnnotationsCopy.scaleToCenter(rescale, rescale, centerX, centerY)
+        planAsCopy(outputs, 'zoom', ('zoom', x, y, w, h, rescale, centerX, centerY), rescale, (w, h), bboxAnnotationsCopy)
+
+def planBoundingBox(outputs, imgW, imgH, targetW, targetH, bboxAnnotations):
+    bboxAnnotationsCopy = bboxAnnotations.copy()
+    bbox = bboxAnnotationsCopy[0]
+    scaleX = targetW / bbox.width()[0]
+    scaleY = targetH / bbox.height()[0]
+    newscale = min(scaleX, scaleY)
+    (centerX, centerY) = (bbox.centerX()[0], bbox.centerY()[0])
+    (x, y, w, h) = getCenteredWindow(centerX, centerY, int(targetW), int(targetH), imgW, imgH, True)
+    bboxAnnotationsCopy.scaleToCenter(newscale, newscale, centerX, centerY)
+    bboxAnnotationsCopy.crop(x, y)
+    planAsCopy(outputs, 'bbox', ('bbox', newscale, centerX, centerY, x, y, w, h), newscale, (w, h), bboxAnnotationsCopy)
+
+def saveAsCopy(image, xmlTemplate, imageFileName, imageFileExt, outputPath, bboxAnnotations, fileCounter, minSize = 10.0):
+    bboxAnnotations.clamp(image.shape[1], image.shape[0])
+
+    bboxAnnotations = bboxAnnotations.select(~bboxAnnotations.isEmpty(minSize))
+
+    if len(bboxAnnotations) == 0:
         return fileCounter
 
     # FOR TESTING:
@@ -398,28 +445,12 @@ def saveAsCopy(image, origXmlRoot, imageFileName, imageFileExt, outputPath, bbox
         imageFileName = str(imageFileName + '_' + str(fileCounter))
     imageFileNameWithExt = str(imageFileName + '.' + imageFileExt)
     newImageFile = os.path.join(outputPath, imageFileNameWithExt)
-    cv2.imwrite(newImageFile, image)
-
-    if (origXmlRoot is not None):
-        xmlRoot = copy.deepcopy(origXmlRoot)
-        xmlRoot.find('filename').text = imageFileNameWithExt
-        xmlRoot.find('path').text = str(newImageFile)
-
-        size_node = xmlRoot.find('size')
-        imgW = image.shape[1]
-        imgH = image.shape[0]
-        size_node.find('width').text = str(imgW)
-        size_node.find('height').text = str(imgH)
-        
-        xmlObjects = xmlRoot.findall('object')
-        for xmlObject in xmlObjects:
-            xmlRoot.remove(xmlObject)
+    active_writer().writeImage(newImageFile, image)
 
-        for bbox in bboxAnnotations:
-            bbox.toXml(xmlRoot)
-
-        tree = ET.ElementTree(xmlRoot)
-        tree.write(os.path.join(outputPath, imageFileName + '.xml'))
+    if (xmlTemplate is not None):
+        # All source objects are replaced by the transformed bounding boxes
+        xml = xmlTemplate.render(imageFileNameWithExt, str(newImageFile), image.shape[1], image.shape[0], render_box_array(bboxAnnotations))
+        active_writer().writeBytes(os.path.join(outputPath, imageFileName + '.xml'), xml)
 
     return fileCounter + 1
 
@@ -428,7 +459,15 @@ def saveAsCopy(image, origXmlRoot, imageFileName, imageFileExt, outputPath, bbox
 
 IMAGE_FORMATS = ('.jpeg', '.JPEG', '.png', '.PNG', '.jpg', '.JPG')
 
-def resize_all(inPath, outPath, x, y):
+def open_manifest(inPath, outPath, params):
+    if os.path.abspath(inPath) == os.path.abspath(outPath):
+        raise ValueError('Incremental runs need an output path different from the input path')
+    create_path(outPath)
+    return ResizeManifest(inPath, outPath, params)
+
+
+def collect_resize_jobs(inPath, outPath, x, y, reducedDecode = False, compatXml = True):
+    jobs = []
     create_path(outPath)
     for root, _, files in os.walk(inPath):
             out_path = outPath + root[len(inPath):]
@@ -437,47 +476,320 @@ def resize_all(inPath, outPath, x, y):
             for file in files:
                 if file.endswith(IMAGE_FORMATS):
                     image_file = os.path.join(root, file)
-                    process_image(image_file, out_path, x, y)
+                    jobs.append((image_file, out_path, x, y, reducedDecode, compatXml))
+    return jobs
+
+
+def resize_all(inPath, outPath, x, y, workers = 1, chunksize = 16, reducedDecode = False, writerThreads = 2, incremental = False, compatXml = True, encoder = None,
+               poolBytes = DEFAULT_MAX_BYTES):
+    jobs = collect_resize_jobs(inPath, outPath, x, y, reducedDecode, compatXml)
+    manifest = None
+    if incremental:
+        params = {'x': int(x), 'y': int(y), 'mode': 'smart'}
+        if not compatXml:
+            params['xml'] = 'minimal'
+        if encoder is not None and not encoder.isDefault():
+            params['encoder'] = encoder.toDict()
+        manifest = open_manifest(inPath, outPath, params)
+        jobs = manifest.plan(jobs)
+    try:
+        summary = run_jobs(manifest.job(process_image) if manifest is not None else process_image, jobs, workers, chunksize, desc='Resizing', initializer=configure_writer, initargs=(writerThreads, None, encoder, poolBytes),
+                           onResult=manifest.record if manifest is not None else None)
+    finally:
+        if manifest is not None:
+            manifest.close()
+    summary.print()
+    if manifest is not None:
+        manifest.print()
     print('Complete.')
+    return summary
+
+
+BRANCH_NAMES = {
+    'crop': 'crop-left/right',
+    'bbox': 'saveBoundingBox',
+    'zoom': 'saveZoomedBoundingBoxes',
+    'copy': 'plain copy',
+}
+
+class PlanSummary:
+    # Aggregated result of planning smart_resize for many images (see plan_all)
+    def __init__(self):
+        self.images = 0
+        self.skipped = 0
+        self.errors = []
+        self.imagesPerBranch = dict.fromkeys(BRANCHES, 0)
+        self.outputsPerBranch = dict.fromkeys(BRANCHES, 0)
+        self.reductions = {1: 0, 2: 0, 4: 0, 8: 0}
+        self.sourcePixels = 0
+        self.decodedPixels = 0
+        self.outputPixels = 0
+
+    def add(self, sourceSize, reduction, outputs):
+        self.images += 1
+        if len(outputs) == 0:
+            self.skipped += 1
+            return
+        for branch in set(output.branch for output in outputs):
+            self.imagesPerBranch[branch] += 1
+        for output in outputs:
+            self.outputsPerBranch[output.branch] += 1
+            self.outputPixels += output.size[0] * output.size[1]
+        self.reductions[reduction] += 1
+        self.sourcePixels += sourceSize[0] * sourceSize[1]
+        (decodedW, decodedH) = reduced_size(sourceSize[0], sourceSize[1], reduction)
+        self.decodedPixels += decodedW * decodedH
+
+    def merge(self, other):
+        self.images += other.images
+        self.skipped += other.skipped
+        self.errors += other.errors
+        for branch in BRANCHES:
+            self.imagesPerBranch[branch] += other.imagesPerBranch[branch]
+            self.outputsPerBranch[branch] += other.outputsPerBranch[branch]
+        for reduction in self.reductions:
+            self.reductions[reduction] += other.reductions[reduction]
+        self.sourcePixels += other.sourcePixels
+        self.decodedPixels += other.decodedPixels
+        self.outputPixels += other.outputPixels
+
+    def outputs(self):
+        return sum(self.outputsPerBranch.values())
+
+    def print(self):
+        print(f"{self.images} images, {self.skipped} without outputs, {len(self.errors)} failed, {self.outputs()} output images planned.")
+        print(f"{'branch':<25} {'images':>9} {'outputs':>9}")
+        for branch in BRANCHES:
+            print(f"{BRANCH_NAMES[branch]:<25} {self.imagesPerBranch[branch]:>9} {self.outputsPerBranch[branch]:>9}")
+        print(f"Decode: {self.decodedPixels / 1e6:.1f} MPixel ({self.sourcePixels / 1e6:.1f} MPixel at full resolution), "
+              + ', '.join(f"{count} images at 1/{reduction}" for (reduction, count) in self.reductions.items()))
+        print(f"Encode: {self.outputPixels / 1e6:.1f} MPixel")
+        for (file, error) in self.errors:
+            print('[ERROR] error with {}\n file: {}'.format(file, error))
+
+
+def plan_image(imageFile, x, y, reducedDecode = False):
+    # Reads only the XML file and the image header, returns (sourceSize, reduction, outputs)
+    xmlFile = os.path.splitext(imageFile)[0] + '.xml'
+    bboxAnnotations = BoxArray.fromXml(ET.parse(xmlFile).getroot())
+    if (len(bboxAnnotations) == 0):
+        return (None, 1, [])
+    sourceSize = probe_image_size(imageFile)
+    outputs = planSmartResize(sourceSize[0], sourceSize[1], bboxAnnotations, float(x), float(y))
+    return (sourceSize, getDecodeReduction(imageFile, outputs, reducedDecode), outputs)
+
+
+def plan_images(imageFiles, x, y, reducedDecode = False):
+    summary = PlanSummary()
+    for imageFile in imageFiles:
+        try:
+            summary.add(*plan_image(imageFile, x, y, reducedDecode))
+        except Exception as e:
+            summary.images += 1
+            summary.errors.append((imageFile, f"{type(e).__name__}: {e}"))
+    return summary
+
+
+def calibrate_plan(imageFiles, x, y, reducedDecode = False, encoder = None):
+    """
+    Resizes the given images in memory (nothing is written) and returns the
+    measured seconds per decoded pixel and per output pixel (render + encode
+    with the encoder settings, see encoder_options), and the list of
+    (image, error message) of the samples that failed.
+    """
+    (decodeSeconds, decodedPixels, renderSeconds, outputPixels) = (0.0, 0, 0.0, 0)
+    errors = []
+    for imageFile in imageFiles:
+        try:
+            (sourceSize, reduction, outputs) = plan_image(imageFile, x, y, reducedDecode)
+            if (len(outputs) == 0):
+                continue
+            start = time.perf_counter()
+            image = read_image(imageFile, reduction)
+            decodeTime = time.perf_counter() - start
+
+            start = time.perf_counter()
+            scaledImages = {}
+            try:
+                for output in outputs:
+                    imageCopy = renderOutput(image, sourceSize, output, scaledImages)
+                    encode_image(os.path.splitext(imageFile)[1], imageCopy, encoder)
+                    if (output.operation[0] != 'scaled'):
+                        release_buffer(imageCopy)
+            finally:
+                for scaled in scaledImages.values():
+                    release_buffer(scaled)
+            renderTime = time.perf_counter() - start
+        except Exception as e:
+            errors.append((imageFile, f"{type(e).__name__}: {e}"))
+            continue
+        # Only samples that were resized completely are counted
+        decodeSeconds += decodeTime
+        decodedPixels += image.shape[0] * image.shape[1]
+        renderSeconds += renderTime
+        outputPixels += sum(output.size[0] * output.size[1] for output in outputs)
+    return (decodeSeconds / max(decodedPixels, 1), renderSeconds / max(outputPixels, 1), errors)
+
+
+def collect_image_files(inPath):
+    imageFiles = []
+    for root, _, files in os.walk(inPath):
+        for file in files:
+            if file.endswith(IMAGE_FORMATS):
+                imageFiles.append(os.path.join(root, file))
+    return imageFiles
+
+
+def plan_all(inPath, x, y, workers = 1, chunksize = 256, reducedDecode = False, calibrationSamples = 20, encoder = None):
+    """
+    Dry run of resize_all: plans the outputs of all images from the XML files
+    and image headers only, prints the number of images and outputs per
+    branch, the decoded and encoded pixels and an estimated runtime. The
+    runtime is extrapolated from resizing a random sample of the images in
+    memory (calibration).
+    """
+    start = time.perf_counter()
+    imageFiles = collect_image_files(inPath)
+    summary = PlanSummary()
+    chunks = [imageFiles[i:i + chunksize] for i in range(0, len(imageFiles), chunksize)]
+    if workers == 0:
+        workers = default_workers()
+    if workers <= 1:
+        for chunk in chunks:
+            summary.merge(plan_images(chunk, x, y, reducedDecode))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context(), initializer=initialize_worker, initargs=(workers, 1)) as executor:
+            for chunkSummary in executor.map(plan_images, chunks, repeat(x), repeat(y), repeat(reducedDecode)):
+                summary.merge(chunkSummary)
+    summary.print()
+    print(f"Planned in {time.perf_counter() - start:.1f} s.")
+
+    if (calibrationSamples > 0 and summary.outputs() > 0):
+        samples = random.Random(0).sample(imageFiles, min(calibrationSamples, len(imageFiles)))
+        (decodeCost, renderCost, errors) = calibrate_plan(samples, x, y, reducedDecode, encoder)
+        for (file, error) in errors:
+            print(f"[ERROR] Calibration failed for {file}: {error}")
+        decodeTime = decodeCost * summary.decodedPixels
+        renderTime = renderCost * summary.outputPixels
+        print(f"Calibration on {len(samples) - len(errors)} images ({len(errors)} failed): {decodeCost * 1e9:.2f} s per GPixel decoded, {renderCost * 1e9:.2f} s per GPixel rendered and encoded.")
+        # More processes than CPUs don't run faster
+        processes = max(1, min(workers, default_workers()))
+        print(f"Estimated runtime: {(decodeTime + renderTime) / processes:.0f} s with {processes} worker processes "
+              f"(decode {decodeTime:.0f} s, render and encode {renderTime:.0f} s in total, without file system overhead).")
+    return summary
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '-x',
+        '--new_x',
+        dest='x',
+        help='The new x images size',
+        default=480,
+        required=False
+    )
+    parser.add_argument(
+        '-y',
+        '--new_y',
+        dest='y',
+        help='The new y images size',
+        default=640,
+        required=False
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        dest='out',
+        help='The output path of the new images & annotation files',
+        default='.',
+        required=False
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        dest='workers',
+        help='Number of worker processes (0 = one per CPU core, default: 1)',
+        type=int,
+        default=1,
+        required=False
+    )
+    parser.add_argument(
+        '--chunksize',
+        dest='chunksize',
+        help='Number of images submitted to a worker process at once (default: 16)',
+        type=int,
+        default=16,
+        required=False
+    )
+    parser.add_argument(
+        '--reduced_decode',
+        dest='reduced_decode',
+        help='Decode JPEGs at 1/2, 1/4 or 1/8 resolution if all their outputs are scaled down at least that much (faster, '
+             'but the output pixels can differ by a few percent from those of the full decode)',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-i',
+        '--incremental',
+        dest='incremental',
+        help='Only resize new and changed images (tracked in a manifest in the output path), remove the outputs of deleted images',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--minimal_xml',
+        dest='minimal_xml',
+        help='Only write the standard VOC tags (folder, filename, path, size, object) to the XML files, other tags like segmented, source or owner are dropped',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--plan',
+        dest='plan',
+        help='Dry run: only read the XML files and image headers, print the planned outputs per branch and an estimated runtime',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--calibration_samples',
+        dest='calibration_samples',
+        help='Number of images resized in memory to estimate the runtime in --plan mode (0 = no estimate, default: 20)',
+        type=int,
+        default=20,
+        required=False
+    )
+    parser.add_argument(
+        '--writer_threads',
+        dest='writer_threads',
+        help='Number of threads per process encoding and writing the output files (0 = write synchronously, default: 2)',
+        type=int,
+        default=2,
+        required=False
+    )
+    parser.add_argument(
+        '--buffer_pool',
+        dest='buffer_pool',
+        help='Size of the image buffer pool per process in MB (0 = off, default: 256)',
+        type=int,
+        default=DEFAULT_MAX_BYTES // 2**20,
+        required=False
+    )
+    add_encoder_arguments(parser)
+
+
+
+    args = parser.parse_args()
+
+    input_path = os.getcwd()
+    if (args.out is not None and args.out != '.'):
+        output_path = args.out
+    else:
+        output_path = input_path
 
-
-
-
-parser = argparse.ArgumentParser()
-
-parser.add_argument(
-    '-x',
-    '--new_x',
-    dest='x',
-    help='The new x images size',
-    default=480,
-    required=False
-)
-parser.add_argument(
-    '-y',
-    '--new_y',
-    dest='y',
-    help='The new y images size',
-    default=640,
-    required=False
-)
-parser.add_argument(
-    '-o',
-    '--output',
-    dest='out',
-    help='The output path of the new images & annotation files',
-    default='.',
-    required=False
-)
-
-
-
-args = parser.parse_args()
-
-input_path = os.getcwd()
-if (args.out is not None and args.out != '.'):
-    output_path = args.out
-else:
-    output_path = input_path
-
-resize_all(input_path, output_path, args.x, args.y)
+    if args.plan:
+        plan_all(input_path, args.x, args.y, args.workers, reducedDecode=args.reduced_decode, calibrationSamples=args.calibration_samples,
+                 encoder=encoder_from_args(args))
+    else:
+        resize_all(input_path, output_path, args.x, args.y, args.workers, args.chunksize, args.reduced_decode, args.writer_threads, args.incremental, not args.minimal_xml,
+                   encoder_from_args(args), args.buffer_pool * 2**20)
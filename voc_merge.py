@@ -0,0 +1,127 @@
+import os
+import copy
+import numpy as np
+import xml.etree.ElementTree as ET
+from box_array import BoxArray
+from image_backend import probe_size
+
+
+
+# Merges the Pascal VOC annotations of duplicate images.
+#
+# When duplicates are removed, the XML file of a removed image may have boxes
+# that the XML file of the kept image doesn't have. These boxes are added to
+# the kept XML file: the boxes of the other file are rescaled to the size of
+# the kept image (the duplicates may have different resolutions), and every
+# box that overlaps a box of the same class in the kept file with an IoU of at
+# least the threshold is considered the same object and dropped. The IoU
+# matrix of all pairs of boxes of the same class is computed with numpy, in
+# blocks of rows that fit into the CPU cache, so it stays fast and the memory
+# bounded for images with thousands of boxes. The objects of the kept file
+# stay unchanged. The <object> nodes of the new boxes are copied from the
+# other file with all their tags (pose, truncated, difficult, ...) and
+# appended, only their bndbox is rewritten if the box was rescaled.
+
+
+
+MERGE_IOU = 0.5
+
+# Rows of the IoU matrix computed at once
+IOU_BLOCK_ROWS = 128
+
+
+def annotation_path(image_path):
+    return os.path.splitext(image_path)[0] + '.xml'
+
+
+def annotation_size(xmlRoot, image_path):
+    # (width, height) of the image from the <size> node, from the image header if it's missing
+    size = xmlRoot.find('size')
+    if size is not None:
+        try:
+            (width, height) = (int(float(size.find('width').text)), int(float(size.find('height').text)))
+            if width > 0 and height > 0:
+                return (width, height)
+        except (AttributeError, TypeError, ValueError):
+            pass
+    return probe_size(image_path)
+
+
+def matched_boxes(boxes, other, threshold = MERGE_IOU):
+    # Mask of the boxes of other that overlap a box of the same class of boxes with an IoU of at least threshold
+    matched = np.zeros(len(other), dtype=bool)
+    otherLabels = other.labelsIn(boxes.names)
+    for label in np.unique(boxes.labels):
+        candidates = np.flatnonzero(otherLabels == label)
+        if len(candidates) == 0:
+            continue
+        sameClass = boxes.select(boxes.labels == label)
+        others = other.select(candidates)
+        for start in range(0, len(sameClass), IOU_BLOCK_ROWS):
+            overlapping = (sameClass[start:start + IOU_BLOCK_ROWS].iou(others) >= threshold).any(axis=0)
+            matched[candidates[overlapping]] = True
+    return matched
+
+
+def merge_boxes(boxes, other, threshold = MERGE_IOU):
+    # The boxes and the boxes of other that don't match any of them
+    return boxes.concatenate(other.select(~matched_boxes(boxes, other, threshold)))
+
+
+def copy_object(xmlObject, box = None):
+    # Copy of an <object> node of another XML file, with the bndbox set to box (xmin, ymin, xmax, ymax) if given
+    xmlObject = copy.deepcopy(xmlObject)
+    if box is not None:
+        bndbox = xmlObject.find('bndbox')
+        for (tag, value) in zip(('xmin', 'ymin', 'xmax', 'ymax'), np.rint(box).astype(np.int64)):
+            bndbox.find(tag).text = str(value)
+    return xmlObject
+
+
+def append_objects(xmlRoot, xmlObjects):
+    # Appends the nodes to the root, indented like its first child
+    children = list(xmlRoot)
+    if len(children) > 0:
+        (indent, end) = (xmlRoot.text, children[-1].tail)
+        for xmlObject in [children[-1]] + xmlObjects:
+            xmlObject.tail = indent
+        xmlObjects[-1].tail = end
+    xmlRoot.extend(xmlObjects)
+
+
+def merge_annotations(keep_image, other_images, threshold = MERGE_IOU):
+    """
+    Adds the boxes of the XML files of other_images (duplicates of
+    keep_image) that aren't in the XML file of keep_image to it, rescaled to
+    its size. Returns the number of added boxes, the XML file is only written
+    if there are any.
+    """
+    keep_xml = annotation_path(keep_image)
+    if not os.path.isfile(keep_xml):
+        return 0
+    tree = ET.parse(keep_xml)
+    xmlRoot = tree.getroot()
+    boxes = BoxArray.fromXml(xmlRoot)
+    (width, height) = annotation_size(xmlRoot, keep_image)
+    merged = boxes
+    added = []
+    for image in other_images:
+        xml_path = annotation_path(image)
+        if not os.path.isfile(xml_path):
+            continue
+        otherRoot = ET.parse(xml_path).getroot()
+        # The boxes of fromXml are in the order of the <object> nodes
+        otherObjects = otherRoot.findall('object')
+        other = BoxArray.fromXml(otherRoot)
+        (otherWidth, otherHeight) = annotation_size(otherRoot, image)
+        rescaled = (otherWidth, otherHeight) != (width, height)
+        if rescaled:
+            other.scale(width / otherWidth, height / otherHeight)
+            other.clamp(width, height)
+        new = np.flatnonzero(~matched_boxes(merged, other, threshold))
+        merged = merged.concatenate(other.select(new))
+        added += [copy_object(otherObjects[index], other.boxes[index] if rescaled else None) for index in new]
+    if len(added) > 0:
+        append_objects(xmlRoot, added)
+        tree.write(keep_xml)
+    return len(added)
@@ -0,0 +1,160 @@
+import re
+import copy
+import numpy as np
+import xml.etree.ElementTree as ET
+
+
+
+# Fast Pascal VOC XML serialization for the resize scripts.
+#
+# The resize scripts write one XML file per output image. Instead of a deep
+# copy of the source XML tree per output, which is then modified and
+# serialized, the source tree is serialized once into a template: a list of
+# byte segments with slots for the values that differ per output (file name,
+# path, image size and the objects). Rendering an output is a join of the
+# segments with the (escaped) values, which produces exactly the bytes that
+# ElementTree.write produces for the modified tree.
+#
+# In compatibility mode (the default) the template keeps all tags of the
+# source file, including unknown ones like segmented, source or owner. Without
+# it, only the standard VOC tags (folder, filename, path, size and the
+# objects) are written.
+
+
+
+VOC_TAGS = ('folder', 'filename', 'path', 'size', 'object')
+
+# Slots are marked with private use characters in the text of the source
+# tree, which ElementTree serializes as character references
+_SLOT_MARK = '\ue000'
+_SLOT_PATTERN = re.compile(rb'<object>&#57344;([^&]*)&#57344;</object>|&#57344;([^&]*)&#57344;')
+
+# Serialization settings of output_writer (same as ElementTree.write)
+ENCODING = 'us-ascii'
+
+
+def escape_text(text):
+    # Escaping of element text in ElementTree, non-ASCII characters become character references
+    text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    return text.encode(ENCODING, 'xmlcharrefreplace')
+
+
+def _slot(name):
+    return _SLOT_MARK + name + _SLOT_MARK
+
+
+def _compile(element):
+    # Serializes the element (with its tail) and splits it at the slots
+    data = ET.tostring(element, encoding=ENCODING)
+    segments = []
+    start = 0
+    for match in _SLOT_PATTERN.finditer(data):
+        segments.append(data[start:match.start()])
+        segments.append((match.group(1) or match.group(2)).decode(ENCODING))
+        start = match.end()
+    segments.append(data[start:])
+    return segments
+
+
+def _render(segments, values):
+    # Literal segments are at even, slot names at odd positions
+    return b''.join(segment if index % 2 == 0 else values[segment] for (index, segment) in enumerate(segments))
+
+
+class VocObject:
+    # One <object> node of the source file, rendered with its original
+    # content (and whitespace) except for the name and the bounding box. The
+    # node is owned by this instance and compiled on the first render.
+    def __init__(self, xmlObject):
+        self.name = xmlObject.find('name').text
+        bndbox = xmlObject.find('bndbox')
+        self.box = tuple(float(bndbox.find(tag).text) for tag in ('xmin', 'ymin', 'xmax', 'ymax'))
+        self._xmlObject = xmlObject
+        self._segments = None
+
+    def render(self, name, xmin, ymin, xmax, ymax):
+        if self._segments is None:
+            self._xmlObject.find('name').text = _slot('name')
+            bndbox = self._xmlObject.find('bndbox')
+            for tag in ('xmin', 'ymin', 'xmax', 'ymax'):
+                bndbox.find(tag).text = _slot(tag)
+            self._segments = _compile(self._xmlObject)
+            self._xmlObject = None
+        return _render(self._segments, {
+            'name': escape_text(name),
+            'xmin': str(xmin).encode(ENCODING),
+            'ymin': str(ymin).encode(ENCODING),
+            'xmax': str(xmax).encode(ENCODING),
+            'ymax': str(ymax).encode(ENCODING),
+        })
+
+
+class VocTemplate:
+    def __init__(self, xmlRoot, compat = True):
+        """
+        Creates the template from the root of the source XML file. The source
+        objects are available as VocObject in self.objects.
+        """
+        xmlRoot = copy.deepcopy(xmlRoot)
+        if not compat:
+            for child in list(xmlRoot):
+                if child.tag not in VOC_TAGS:
+                    xmlRoot.remove(child)
+        xmlRoot.find('filename').text = _slot('filename')
+        xmlRoot.find('path').text = _slot('path')
+        size = xmlRoot.find('size')
+        size.find('width').text = _slot('width')
+        size.find('height').text = _slot('height')
+
+        # The source objects are replaced by slots in place, new objects are appended at the end
+        self.objects = []
+        for (index, child) in enumerate(xmlRoot):
+            if child.tag == 'object':
+                placeholder = xmlRoot.makeelement('object', {})
+                placeholder.text = _slot(f"object{len(self.objects)}")
+                xmlRoot[index] = placeholder
+                self.objects.append(VocObject(child))
+        appended = xmlRoot.makeelement('object', {})
+        appended.text = _slot('objects')
+        xmlRoot.append(appended)
+        self._segments = _compile(xmlRoot)
+        # (N, 4) array with xmin, ymin, xmax, ymax of the source objects
+        self.boxes = np.array([voc_object.box for voc_object in self.objects], dtype=np.float64).reshape(-1, 4)
+
+    def render(self, fileName, path, width, height, objects = b'', sourceObjects = None):
+        """
+        Returns the XML file of an output image as bytes. objects is appended
+        after all other nodes (see render_box_array). sourceObjects is the
+        list of rendered source objects (see VocObject.render), which stay at
+        their original position, None drops a source object. By default all
+        source objects are dropped.
+        """
+        values = {
+            'filename': escape_text(fileName),
+            'path': escape_text(path),
+            'width': str(width).encode(ENCODING),
+            'height': str(height).encode(ENCODING),
+            'objects': objects,
+        }
+        for index in range(len(self.objects)):
+            rendered = sourceObjects[index] if sourceObjects is not None else None
+            values[f"object{index}"] = rendered or b''
+        return _render(self._segments, values)
+
+
+def render_box_array(bboxAnnotations, minSize = 10.0):
+    """
+    Renders one <object> node per box of the BoxArray, like BoxArray.toXml
+    (boxes smaller than minSize are skipped). Returns the bytes to pass as
+    objects to VocTemplate.render.
+    """
+    keep = ~bboxAnnotations.isEmpty(minSize)
+    rounded = np.rint(bboxAnnotations.boxes).astype(np.int64)
+    heads = [b'<object><name>' + escape_text(name) + b'</name><pose>Unspecified</pose><truncated>0</truncated><difficult>0</difficult><bndbox><xmin>'
+             for name in bboxAnnotations.names]
+    parts = []
+    for index in np.flatnonzero(keep):
+        (xmin, ymin, xmax, ymax) = rounded[index]
+        parts.append(b'%s%d</xmin><ymin>%d</ymin><xmax>%d</xmax><ymax>%d</ymax></bndbox></object>'
+                     % (heads[bboxAnnotations.labels[index]], xmin, ymin, xmax, ymax))
+    return b''.join(parts)